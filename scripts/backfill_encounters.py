@@ -0,0 +1,45 @@
+import argparse
+from datetime import date
+
+import firebase_admin
+
+from adapters.fhir_store import ResourceClient
+from blueprints.pubsub import PubsubController
+from services.encounter_backfill_service import (
+    BACKFILL_CONCURRENCY,
+    EncounterBackfillService,
+)
+
+
+def backfill_encounters(start: date, end: date, concurrency: int):
+    _ = firebase_admin.initialize_app()
+    resource_client = ResourceClient()
+    controller = PubsubController(resource_client)
+    service = EncounterBackfillService(
+        resource_client, controller.sync_encounter, concurrency=concurrency
+    )
+    checkpoint = service.run(start, end)
+    print(
+        f"backfilled encounters until {checkpoint['next_day']}: "
+        f"synced={checkpoint['synced']} failed={checkpoint['failed']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sync encounters to Notion and Firestore again"
+    )
+    parser.add_argument(
+        "--start", help="first day, YYYY-MM-DD", type=date.fromisoformat, required=True
+    )
+    parser.add_argument(
+        "--end", help="last day, YYYY-MM-DD", type=date.fromisoformat, required=True
+    )
+    parser.add_argument(
+        "--concurrency",
+        help="encounters synced in parallel",
+        type=int,
+        default=BACKFILL_CONCURRENCY,
+    )
+    args = parser.parse_args()
+    backfill_encounters(args.start, args.end, args.concurrency)
@@ -0,0 +1,124 @@
+import argparse
+import logging
+import statistics
+import threading
+import time
+from datetime import datetime
+from unittest.mock import Mock
+
+import structlog
+
+from adapters.fire_store import FireStoreBatchWriter
+from services.patient_call_logs_service import (
+    CALLING_STATUS,
+    CREATED_STATUS,
+    PATIENT_CALL_LOGS,
+    PatientCallLogsService,
+)
+
+
+class SlowFireStoreClient:
+    """Stand-in for Firestore where every round trip takes a fixed latency"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self.client = Mock()
+        self.client.batch.side_effect = lambda: Mock(commit=self._round_trip)
+
+    def _round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+
+    def get_collection(self, collection: str):
+        collection_ref = Mock()
+        collection_ref.where.return_value.stream.side_effect = lambda: (
+            self._round_trip() or []
+        )
+        return collection_ref
+
+    def update_value(self, collection: str, collection_id: str, value: dict):
+        self._round_trip()
+
+    def add_value(self, collection: str, value: dict, id: str = ""):
+        self._round_trip()
+
+
+def legacy_upsert(firestore_client, appointment_id: str, patient_id: str):
+    """The upsert before deterministic ids, a query and then one write per log"""
+    call_ref = firestore_client.get_collection(PATIENT_CALL_LOGS)
+    logs = list(call_ref.where("appointment_id", "==", appointment_id).stream())
+    if logs:
+        for log in logs:
+            firestore_client.update_value(
+                PATIENT_CALL_LOGS, log.id, {"status": CALLING_STATUS}
+            )
+    else:
+        value = {
+            "patient_id": patient_id,
+            "status": CREATED_STATUS,
+            "appointment_id": appointment_id,
+            "timestamp": datetime.now(),
+        }
+        firestore_client.add_value(PATIENT_CALL_LOGS, value, appointment_id)
+
+
+def run(name: str, bookings: int, latency: float, upsert):
+    client = SlowFireStoreClient(latency)
+    upsert = upsert(client)
+    latencies = []
+
+    def book(i: int):
+        start = time.perf_counter()
+        upsert(f"appointment-{i}", f"patient-{i}")
+        latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=book, args=(i,)) for i in range(bookings)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    print(
+        f"{name}: bookings={bookings} round_trips={client.round_trips} "
+        f"p50={statistics.median(latencies) * 1000:.0f}ms "
+        f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f}ms"
+    )
+
+
+def legacy(firestore_client):
+    return lambda appointment_id, patient_id: legacy_upsert(
+        firestore_client, appointment_id, patient_id
+    )
+
+
+def merge_write(firestore_client):
+    service = PatientCallLogsService(
+        firestore_client, FireStoreBatchWriter(firestore_client)
+    )
+    return service.upsert_call_docs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark call log upserts on booking"
+    )
+    parser.add_argument(
+        "--bookings", help="number of concurrent bookings", type=int, default=8
+    )
+    parser.add_argument(
+        "--latency",
+        help="simulated Firestore round trip in seconds",
+        type=float,
+        default=0.03,
+    )
+    args = parser.parse_args()
+
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING)
+    )
+    run("query and write", args.bookings, args.latency, legacy)
+    run("single merge write", args.bookings, args.latency, merge_write)
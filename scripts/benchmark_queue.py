@@ -0,0 +1,102 @@
+import argparse
+import json
+import threading
+import time
+
+import requests
+from fhir.resources import construct_fhir_element
+
+from services.lists_service import MAX_CONFLICT_RETRIES, ListsService
+
+LIST_ID = "benchmark-list"
+
+
+class InMemoryListStore:
+    """Stand-in for the FHIR store List with If-Match checks and a fixed round trip latency"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.version = 0
+        self.conflicts = 0
+        self.data = json.dumps(
+            {
+                "resourceType": "List",
+                "id": LIST_ID,
+                "status": "current",
+                "mode": "working",
+                "title": "Patient Queue",
+            }
+        )
+
+
+class InMemoryListClient:
+    def __init__(self, store: InMemoryListStore):
+        self.store = store
+        self.last_seen_etag = None
+
+    def get_resource(self, list_id, resource_type):
+        time.sleep(self.store.latency)
+        with self.store.lock:
+            self.last_seen_etag = f'W/"{self.store.version}"'
+            data = self.store.data
+        return construct_fhir_element(resource_type, json.loads(data))
+
+    def put_resource(self, list_id, fhir_list, lock_header):
+        time.sleep(self.store.latency)
+        with self.store.lock:
+            if lock_header != f'W/"{self.store.version}"':
+                self.store.conflicts += 1
+                response = requests.Response()
+                response.status_code = 412
+                raise requests.HTTPError(response=response)
+            self.store.version += 1
+            self.store.data = fhir_list.json()
+        return fhir_list
+
+
+def run(joiners: int, latency: float, max_retries: int):
+    store = InMemoryListStore(latency)
+    failures = []
+
+    def join(patient_id: str):
+        service = ListsService(InMemoryListClient(store), max_retries=max_retries)
+        try:
+            service.enqueue(LIST_ID, patient_id)
+        except requests.HTTPError as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=join, args=(str(i),)) for i in range(joiners)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    enqueued = len(json.loads(store.data).get("entry", []))
+    print(
+        f"joiners={joiners} latency={latency * 1000:.0f}ms max_retries={max_retries} "
+        f"enqueued={enqueued} failed={len(failures)} conflicts={store.conflicts} "
+        f"elapsed={elapsed:.2f}s throughput={enqueued / elapsed:.1f}/s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark concurrent patients joining the queue"
+    )
+    parser.add_argument(
+        "--joiners", help="number of concurrent patients", type=int, default=50
+    )
+    parser.add_argument(
+        "--latency",
+        help="simulated FHIR round trip in seconds",
+        type=float,
+        default=0.05,
+    )
+    args = parser.parse_args()
+
+    # max_retries=0 is the behaviour without retries, where every conflict is a 503
+    for retries in [0, MAX_CONFLICT_RETRIES]:
+        run(args.joiners, args.latency, retries)
@@ -0,0 +1,34 @@
+import argparse
+import time
+
+from utils.postal_index import (
+    ADDRESS_DATA_PATH,
+    POSTAL_INDEX_PATH,
+    PostalIndex,
+    build_postal_index,
+)
+
+
+def build(source_path: str, output_path: str):
+    start = time.perf_counter()
+    index = build_postal_index(source_path)
+    with open(output_path, "wb") as f:
+        f.write(index)
+    print(
+        f"wrote {len(PostalIndex(index))} postal codes to {output_path} "
+        f"({len(index)} bytes) in {time.perf_counter() - start:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the postal code index from the address data"
+    )
+    parser.add_argument(
+        "--source", help="folder of the zip-XXX.json files", default=ADDRESS_DATA_PATH
+    )
+    parser.add_argument(
+        "--output", help="path of the index file", default=POSTAL_INDEX_PATH
+    )
+    args = parser.parse_args()
+    build(args.source, args.output)
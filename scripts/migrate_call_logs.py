@@ -0,0 +1,71 @@
+import argparse
+from collections import defaultdict
+
+import firebase_admin
+from firebase_admin import firestore
+
+from services.patient_call_logs_service import (
+    CALLING_STATUS,
+    CREATED_STATUS,
+    PATIENT_CALL_LOGS,
+)
+
+STATUS_ORDER = [CREATED_STATUS, CALLING_STATUS]
+# Every moved log takes two writes, the copy and the delete, of the 500 per batch
+LOGS_PER_BATCH = 250
+
+
+def _merge_logs(logs: list) -> dict:
+    """Merges logs of the same appointment, keeping the first booking and last status"""
+    logs = sorted(logs, key=lambda x: str(x.get("timestamp", "")))
+    merged = dict(logs[0])
+    merged["status"] = max(
+        (x.get("status", CREATED_STATUS) for x in logs),
+        key=lambda x: STATUS_ORDER.index(x) if x in STATUS_ORDER else -1,
+    )
+    return merged
+
+
+def migrate_call_logs(dry_run: bool):
+    """Moves call logs stored under random document ids to the appointment id"""
+    _ = firebase_admin.initialize_app()
+    client = firestore.client()
+    collection = client.collection(PATIENT_CALL_LOGS)
+
+    logs_by_appointment = defaultdict(list)
+    legacy_ids = defaultdict(list)
+    for doc in collection.stream():
+        value = doc.to_dict()
+        appointment_id = value.get("appointment_id")
+        if appointment_id is None:
+            print(f"skipping {doc.id} without appointment_id")
+            continue
+        logs_by_appointment[appointment_id].append(value)
+        if doc.id != appointment_id:
+            legacy_ids[appointment_id].append(doc.id)
+
+    print(f"{len(legacy_ids)} appointments have call logs under random ids")
+    if dry_run:
+        return
+
+    appointment_ids = list(legacy_ids)
+    for i in range(0, len(appointment_ids), LOGS_PER_BATCH):
+        batch = client.batch()
+        for appointment_id in appointment_ids[i : i + LOGS_PER_BATCH]:
+            batch.set(
+                collection.document(appointment_id),
+                _merge_logs(logs_by_appointment[appointment_id]),
+            )
+            for doc_id in legacy_ids[appointment_id]:
+                batch.delete(collection.document(doc_id))
+        batch.commit()
+        print(f"migrated {min(i + LOGS_PER_BATCH, len(appointment_ids))} appointments")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate call logs to appointment ids")
+    parser.add_argument(
+        "--dry-run", help="only count the logs to migrate", action="store_true"
+    )
+    args = parser.parse_args()
+    migrate_call_logs(args.dry_run)
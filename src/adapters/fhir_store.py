@@ -33,6 +33,13 @@ def _get_session():
 ResourceSearchArgs = List[Tuple[str, str]]
 
 
+def is_version_conflict(err) -> bool:
+    """Returns True if the HTTP error is an optimistic locking failure (If-Match mismatch)
+    see: https://build.fhir.org/http.html#concurrency
+    """
+    return err.response is not None and err.response.status_code == 412
+
+
 class ResourceBundle(TypedDict):
     resource: DomainResource
     request: str
@@ -62,13 +69,25 @@ class ResourceClient:
         return self._get_bundle(resource, None, fullurl, "POST")
 
     def get_put_bundle(
-        self, resource: DomainResource, uid: str, fullurl: str = None
+        self,
+        resource: DomainResource,
+        uid: str,
+        fullurl: str = None,
+        if_match: str = None,
     ) -> ResourceBundle:
-        """Returns dictionary of bundle for put ready to process with `create_resources`"""
-        return self._get_bundle(resource, uid, fullurl, "PUT")
+        """Returns dictionary of bundle for put ready to process with `create_resources`
+        With `if_match`, the whole transaction fails with 412 if the resource was
+        updated since that version was read.
+        """
+        return self._get_bundle(resource, uid, fullurl, "PUT", if_match)
 
     def _get_bundle(
-        self, resource: DomainResource, uid: str, fullurl: str, method: str
+        self,
+        resource: DomainResource,
+        uid: str,
+        fullurl: str,
+        method: str,
+        if_match: str = None,
     ) -> ResourceBundle:
         url = resource.resource_type
         if uid:
@@ -78,6 +97,9 @@ class ResourceClient:
             "resource": resource,
             "request": {"method": method, "url": url},
         }
+        if if_match:
+            # Optimistic lock per entry: https://build.fhir.org/http.html#concurrency
+            bundle["request"]["ifMatch"] = if_match
 
         if fullurl:
             bundle["fullUrl"] = fullurl
@@ -255,7 +277,7 @@ class ResourceClient:
 
         resource_path = f"{self._url}/{resource.resource_type}/{resource_uid}"
 
-        headers = self._headers
+        headers = dict(self._headers)
         if lock_header != "":
             # Optimistic lock: https://build.fhir.org/http.html#concurrency
             headers["If-Match"] = lock_header
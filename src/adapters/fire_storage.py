@@ -1,20 +1,84 @@
-import json
+import csv
 import os
+import threading
 import urllib.parse
+from typing import Dict, List
 
-import pandas as pd
 from google.cloud import storage
 
 BASE_STORAGE_URL = os.getenv("GCP_STORAGE_BASE_PATH")
 
+# Rows are sent to GCS in chunks of this size through a resumable upload, so only
+# one chunk is held in memory. Chunks must be a multiple of 256 KiB.
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class CsvResultWriter:
+    """Streams the rows of a CSV file to GCS as they are written
+
+    Rows can be written in any order from several threads with their index. They
+    are written to the file in the order of their index, the rows that arrive
+    before the ones preceding them wait in memory until those are written, so the
+    writers are expected to bound how far ahead of each other they get. The file
+    is only visible in the bucket once the writer is closed.
+    """
+
+    def __init__(self, file, fieldnames: List[str], url: str):
+        self.url = url
+        self._file = file
+        self._writer = csv.writer(file, lineterminator="\n")
+        self._fieldnames = fieldnames
+        self._lock = threading.Lock()
+        self._waiting: Dict[int, dict] = {}
+        self._next_index = 0
+        # The index column keeps the layout of the files written with pandas
+        self._writer.writerow([""] + fieldnames)
+
+    def write(self, index: int, row: dict):
+        with self._lock:
+            self._waiting[index] = row
+            while self._next_index in self._waiting:
+                row = self._waiting.pop(self._next_index)
+                self._writer.writerow(
+                    [self._next_index] + [row.get(name) for name in self._fieldnames]
+                )
+                self._next_index += 1
+
+    def close(self) -> int:
+        """Finalizes the upload and returns the number of rows written"""
+        with self._lock:
+            if self._waiting:
+                raise ValueError(
+                    f"row {self._next_index} was not written, "
+                    f"{len(self._waiting)} rows after it are missing from the file"
+                )
+            self._file.close()
+            return self._next_index
+
+    def abort(self):
+        """Drops the rows still waiting and releases the upload, does nothing once
+        the writer is closed. The partial file is replaced when the job runs again.
+        """
+        with self._lock:
+            self._waiting.clear()
+            if not self._file.closed:
+                self._file.close()
+
 
 class StorageClient:
-    def upload_blob_from_memory(self, output, bucket_name, object_name, file_name):
-        """Uploads a file to the bucket."""
+    def open_csv_writer(
+        self, bucket_name: str, object_name: str, file_name: str, fieldnames: list
+    ) -> CsvResultWriter:
+        """Opens a CSV file in the bucket to be written row by row"""
         storage_client = storage.Client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(f"{object_name}/{file_name}")
         encoded_blob_path = urllib.parse.quote(f"{object_name}/{file_name}", safe="")
-        df = pd.read_json(json.dumps(output))
-        blob.upload_from_string(data=df.to_csv(), content_type="text/csv")
-        return f"{BASE_STORAGE_URL}/b/{bucket_name}/o/{encoded_blob_path}"
+        file = blob.open(
+            "w", chunk_size=UPLOAD_CHUNK_SIZE, content_type="text/csv", newline=""
+        )
+        return CsvResultWriter(
+            file,
+            fieldnames,
+            f"{BASE_STORAGE_URL}/b/{bucket_name}/o/{encoded_blob_path}",
+        )
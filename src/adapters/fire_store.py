@@ -1,5 +1,16 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Tuple
+
+import structlog
 from firebase_admin import firestore
 
+log = structlog.get_logger()
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_SIZE = 500
+
 
 class FireStoreClient:
     def __init__(self, client: firestore._FirestoreClient = None):
@@ -17,3 +28,125 @@ class FireStoreClient:
 
     def get_collection(self, collection: str):
         return self.client.collection(collection)
+
+
+class FireStoreBatchWriter:
+    """Groups writes of concurrent requests into shared batch commits
+
+    Every write returns a future that resolves once its batch is committed. Writes
+    are committed as soon as the previous commit is done, and the writes that
+    arrive meanwhile share the next commit, up to the maximum size. Batches are
+    atomic, so when a commit fails its writes are committed one by one and only
+    the failing ones see the error.
+    """
+
+    def __init__(
+        self,
+        firestore_client: FireStoreClient,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        self.firestore_client = firestore_client
+        self._max_batch_size = max_batch_size
+        self._condition = threading.Condition()
+        self._pending: List[Tuple[str, object, dict, dict, Future]] = []
+        self._flusher: Optional[threading.Thread] = None
+
+    def set(
+        self, collection: str, document_id: str, value: dict, merge: bool = False
+    ) -> Future:
+        ref = self.firestore_client.get_collection(collection).document(document_id)
+        return self._add("set", ref, value, {"merge": merge})
+
+    def update(self, collection: str, document_id: str, value: dict) -> Future:
+        ref = self.firestore_client.get_collection(collection).document(document_id)
+        return self._add("update", ref, value, {})
+
+    def flush(self):
+        """Commits the pending writes right away"""
+        with self._condition:
+            writes = self._take_pending()
+        self._commit(writes)
+
+    def _add(self, operation: str, ref, value: dict, options: dict) -> Future:
+        future = Future()
+        with self._condition:
+            self._pending.append((operation, ref, value, options, future))
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._run, name="firestore-writer", daemon=True
+                )
+                self._flusher.start()
+            self._condition.notify()
+        return future
+
+    def _take_pending(self) -> list:
+        writes = self._pending[: self._max_batch_size]
+        self._pending = self._pending[self._max_batch_size :]
+        return writes
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                writes = self._take_pending()
+            self._commit(writes)
+
+    def _commit(self, writes: list):
+        if not writes:
+            return
+
+        start = time.perf_counter()
+        try:
+            self._commit_batch(writes)
+        except Exception as e:
+            if len(writes) == 1:
+                writes[0][-1].set_exception(e)
+                return
+            log.warning(f"firestore batch failed, committing one by one: {e}")
+            for write in writes:
+                try:
+                    self._commit_batch([write])
+                except Exception as write_error:
+                    write[-1].set_exception(write_error)
+                else:
+                    write[-1].set_result(None)
+            return
+
+        log.info(
+            "committed firestore batch",
+            batch_size=len(writes),
+            commit_ms=round((time.perf_counter() - start) * 1000),
+        )
+        for write in writes:
+            write[-1].set_result(None)
+
+    def _commit_batch(self, writes: list):
+        batch = self.firestore_client.client.batch()
+        for operation, ref, value, options, _ in writes:
+            getattr(batch, operation)(ref, value, **options)
+        batch.commit()
+
+
+_shared_client: Optional[FireStoreClient] = None
+_shared_writer: Optional[FireStoreBatchWriter] = None
+_shared_lock = threading.Lock()
+
+
+def get_firestore_client() -> FireStoreClient:
+    """Returns the Firestore client shared by the process"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = FireStoreClient()
+        return _shared_client
+
+
+def get_batch_writer() -> FireStoreBatchWriter:
+    """Returns the batch writer shared by the process"""
+    global _shared_writer
+    client = get_firestore_client()
+    with _shared_lock:
+        if _shared_writer is None:
+            _shared_writer = FireStoreBatchWriter(client)
+        return _shared_writer
@@ -0,0 +1,265 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import structlog
+from notion_client import APIErrorCode, APIResponseError, Client
+from notion_client.errors import HTTPResponseError
+
+log = structlog.get_logger()
+
+# Notion allows an average of three requests per second per integration
+NOTION_REQUESTS_PER_SECOND = 3.0
+NOTION_REQUEST_BURST = 3
+
+MAX_RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_BACKOFF_SECONDS = 1.0
+MAX_RATE_LIMIT_BACKOFF_SECONDS = 30.0
+
+# Longer than a pub/sub ack deadline is pointless, the message is redelivered anyway
+WRITE_TIMEOUT_SECONDS = 60.0
+
+# Lower runs first. Pages have to exist before they can be updated.
+PRIORITY_CREATE = 0
+PRIORITY_QUERY = 1
+PRIORITY_UPDATE = 2
+
+
+class TokenBucket:
+    """Thread safe token bucket refilled at a constant rate"""
+
+    def __init__(
+        self,
+        rate: float = NOTION_REQUESTS_PER_SECOND,
+        capacity: int = NOTION_REQUEST_BURST,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._updated_at = clock()
+        self._paused_until = 0.0
+
+    def take(self) -> float:
+        """Blocks until a token is available and returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    elapsed = now - self._updated_at
+                    self._tokens = min(
+                        self.capacity, self._tokens + elapsed * self.rate
+                    )
+                    self._updated_at = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """Hands out no tokens for the given seconds, e.g. after a 429"""
+        with self._lock:
+            now = self._clock()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated_at = self._paused_until
+
+
+# Shared by every writer of the process since the budget is per integration
+notion_request_budget = TokenBucket()
+
+
+class _Request:
+    def __init__(self, priority: int, call: Callable, kwargs: dict):
+        self.priority = priority
+        self.call = call
+        self.kwargs = kwargs
+        self.futures: List[Future] = [Future()]
+        self.attempts = 0
+
+
+class NotionWriter:
+    """Serializes the requests to Notion through a shared token bucket
+
+    Requests are sent by a single dispatcher thread in priority order. An update of
+    a page that is still waiting in the queue absorbs later updates of the same
+    page, last write wins per property, so bursts cost a single request. On 429
+    the bucket is paused for Retry-After, or an exponential backoff, and the
+    request is put back in the queue.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        bucket: TokenBucket = None,
+        max_retries: int = MAX_RATE_LIMIT_RETRIES,
+        backoff: float = RATE_LIMIT_BACKOFF_SECONDS,
+        timeout: float = WRITE_TIMEOUT_SECONDS,
+    ):
+        self._client = client
+        self._bucket = bucket or notion_request_budget
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._queue: list = []
+        self._sequence = itertools.count()
+        self._pending_updates: Dict[str, _Request] = {}
+        self._dispatcher: Optional[threading.Thread] = None
+        self._throttled_seconds = 0.0
+        self._rate_limited = 0
+        self._collapsed = 0
+
+    def query_database(self, **kwargs) -> dict:
+        return self._submit(PRIORITY_QUERY, self._client.databases.query, kwargs)
+
+    def create_page(self, **kwargs) -> dict:
+        return self._submit(PRIORITY_CREATE, self._client.pages.create, kwargs)
+
+    def update_page(self, page_id: str, properties: dict) -> dict:
+        future = None
+        with self._condition:
+            pending = self._pending_updates.get(page_id)
+            if pending is not None:
+                pending.kwargs["properties"].update(properties)
+                future = Future()
+                pending.futures.append(future)
+                self._collapsed += 1
+        if future is not None:
+            return future.result(self._timeout)
+
+        request = _Request(
+            PRIORITY_UPDATE,
+            self._client.pages.update,
+            {"page_id": page_id, "properties": dict(properties)},
+        )
+        return self._wait(self._enqueue(request, page_id))
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "throttled_seconds": round(self._throttled_seconds, 3),
+                "rate_limited": self._rate_limited,
+                "collapsed_updates": self._collapsed,
+            }
+
+    def _submit(self, priority: int, call: Callable, kwargs: dict) -> dict:
+        return self._wait(self._enqueue(_Request(priority, call, kwargs)))
+
+    def _wait(self, request: _Request) -> dict:
+        return request.futures[0].result(self._timeout)
+
+    def _enqueue(self, request: _Request, page_id: str = None) -> _Request:
+        with self._condition:
+            if page_id is not None:
+                self._pending_updates[page_id] = request
+            heapq.heappush(
+                self._queue, (request.priority, next(self._sequence), request)
+            )
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch, name="notion-writer", daemon=True
+                )
+                self._dispatcher.start()
+            self._condition.notify()
+        return request
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, request = heapq.heappop(self._queue)
+                page_id = request.kwargs.get("page_id")
+                if self._pending_updates.get(page_id) is request:
+                    # later updates of the page start a new request from here
+                    del self._pending_updates[page_id]
+
+            waited = self._bucket.take()
+            with self._condition:
+                self._throttled_seconds += waited
+
+            try:
+                result = request.call(**request.kwargs)
+            except HTTPResponseError as e:
+                if self._is_rate_limited(e) and request.attempts < self._max_retries:
+                    self._retry_later(request, e)
+                    continue
+                for future in request.futures:
+                    future.set_exception(e)
+            except Exception as e:
+                for future in request.futures:
+                    future.set_exception(e)
+            else:
+                for future in request.futures:
+                    future.set_result(result)
+
+    def _retry_later(self, request: _Request, error: HTTPResponseError):
+        request.attempts += 1
+        delay = min(
+            self._backoff * 2 ** (request.attempts - 1), MAX_RATE_LIMIT_BACKOFF_SECONDS
+        )
+        retry_after = error.headers.get("retry-after") if error.headers else None
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        self._bucket.pause(delay)
+        with self._condition:
+            self._rate_limited += 1
+        log.warning(
+            "rate limited by notion",
+            retry_in=delay,
+            attempts=request.attempts,
+            **self.stats(),
+        )
+        page_id = request.kwargs.get("page_id")
+        with self._condition:
+            pending = self._pending_updates.get(page_id)
+            if pending is not None:
+                # a newer update of the page was queued meanwhile, its values win
+                pending.kwargs["properties"] = {
+                    **request.kwargs["properties"],
+                    **pending.kwargs["properties"],
+                }
+                pending.futures.extend(request.futures)
+                return
+        self._enqueue(request, page_id)
+
+    @staticmethod
+    def _is_rate_limited(error: HTTPResponseError) -> bool:
+        if isinstance(error, APIResponseError):
+            return error.code == APIErrorCode.RateLimited
+        return error.status == 429
+
+
+_notion_writers: Dict[Client, NotionWriter] = {}
+_notion_writers_lock = threading.Lock()
+
+
+def get_notion_writer(client: Client) -> NotionWriter:
+    """Returns the writer of the process for the client
+
+    Services are built per request, while the priority order and the collapsing
+    of updates only apply within a writer, and each writer runs its own
+    dispatcher thread.
+    """
+    with _notion_writers_lock:
+        writer = _notion_writers.get(client)
+        if writer is None:
+            writer = _notion_writers[client] = NotionWriter(client)
+        return writer
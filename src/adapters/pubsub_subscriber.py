@@ -0,0 +1,70 @@
+import os
+from typing import List, TypedDict
+
+import google.auth
+import requests
+from google.auth.transport import requests as google_requests
+
+PUBSUB_API = "https://pubsub.googleapis.com/v1"
+
+# Pull requests wait on the server this long for messages before returning empty
+PULL_TIMEOUT_SECONDS = 60
+
+
+class ReceivedMessage(TypedDict):
+    ackId: str
+    message: dict
+
+
+class PubSubSubscriber:
+    """Pulls messages of a subscription through the Pub/Sub REST API
+
+    When PUBSUB_EMULATOR_HOST is set, as with the gcloud emulator, requests go to
+    the emulator without credentials.
+    """
+
+    def __init__(self, subscription: str, session=None, api_url: str = None):
+        emulator_host = os.getenv("PUBSUB_EMULATOR_HOST")
+        if api_url is None:
+            api_url = f"http://{emulator_host}/v1" if emulator_host else PUBSUB_API
+        if session is None:
+            session = requests.Session() if emulator_host else _get_session()
+        self._session = session
+        self._url = f"{api_url}/{subscription}"
+
+    def pull(self, max_messages: int) -> List[ReceivedMessage]:
+        response = self._session.post(
+            f"{self._url}:pull",
+            json={"maxMessages": max_messages},
+            timeout=PULL_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()
+        return response.json().get("receivedMessages", [])
+
+    def acknowledge(self, ack_ids: List[str]):
+        if not ack_ids:
+            return
+        response = self._session.post(
+            f"{self._url}:acknowledge", json={"ackIds": ack_ids}
+        )
+        response.raise_for_status()
+
+    def nack(self, ack_ids: List[str]):
+        """Makes the messages available for redelivery right away"""
+        self.modify_ack_deadline(ack_ids, 0)
+
+    def modify_ack_deadline(self, ack_ids: List[str], seconds: int):
+        if not ack_ids:
+            return
+        response = self._session.post(
+            f"{self._url}:modifyAckDeadline",
+            json={"ackIds": ack_ids, "ackDeadlineSeconds": seconds},
+        )
+        response.raise_for_status()
+
+
+def _get_session():
+    credentials, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/pubsub"]
+    )
+    return google_requests.AuthorizedSession(credentials)
@@ -37,6 +37,7 @@ from blueprints.twilio_token import twilio_token_blueprint
 from blueprints.verifications import verifications_blueprint
 from utils.logging import add_gcp_fields
 from utils.notion_setup import NotionSingleton
+from utils.postal_index import get_postal_index
 from utils.stripe_setup import StripeSingleton
 
 # Structlog Logging Configuration
@@ -152,6 +153,10 @@ else:
     StripeSingleton(stripe)
     NotionSingleton.client()
 
+# Loads the postal index before the first /address request, building it from the
+# JSON files takes about 1.5s when the prebuilt file is missing
+get_postal_index()
+
 
 if __name__ == "__main__":
     # Used when running locally only. When deploying to Cloud Run,
@@ -1,15 +1,20 @@
 import json
-import os
 import re
 
 from flask import Blueprint, Response, request
 
 from json_serialize import json_serial
 from utils.middleware import jwt_authenticated
+from utils.postal_index import get_postal_index, normalize_name
 
 address_blueprint = Blueprint("address", __name__, url_prefix="/address")
 
-BASE_PATH = os.getcwd() + "/src/assets/address"
+# Postal codes of a single batch lookup
+MAX_BATCH_SIZE = 5000
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+# Names matching the query that are ranked to pick the suggestions
+SUGGEST_SCAN_LIMIT = 500
 
 REGIONS = [
     {
@@ -461,6 +466,10 @@ PREFECTURES = [
 ]
 
 
+REGIONS_BY_ID = {region["id"]: region for region in REGIONS}
+PREFECTURES_BY_ID = {pref["id"]: pref for pref in PREFECTURES}
+
+
 class AddressController:
     """
     Controller is the class that holds the functions for the calls of address blueprint.
@@ -468,39 +477,164 @@ class AddressController:
 
     @staticmethod
     def get_address_by_zip(code: str):
-        pref_code = code[0:3]
-        with open(f"{BASE_PATH}/zip-{pref_code}.json") as f:
-            data = json.load(f)
-        if isinstance(data, dict) and data.get(code) is None:
+        address = get_postal_index().lookup(code)
+        if address is None:
             raise Exception("valid postal code")
-        pref_data = data[code]
-        street = None
-        if len(pref_data) == 3:
-            pref_id, city, area = pref_data
-        elif len(pref_data) > 3:
-            pref_id, city, area, street = pref_data
-        prefecture = get_prefecture_by_id(pref_id)
-        region = get_region_by_id(prefecture["region"])
-        output = {
-            "region": region["name"],
-            "prefecture": prefecture["name"],
-            "city": city,
-            "area": area,
-            "street": street,
-        }
+        output = get_address_output(*address)
+        return Response(status=200, response=json.dumps(output, default=json_serial))
+
+    @staticmethod
+    def get_addresses_by_zips(zipcodes: list):
+        """Looks up many postal codes at once, in the order given
+
+        Each item has the zipcode as given and either its address or the error of
+        that zipcode, so one invalid code does not fail the batch.
+        """
+        if not isinstance(zipcodes, list) or not zipcodes:
+            raise Exception("zipcodes needs to be a non empty list")
+        if len(zipcodes) > MAX_BATCH_SIZE:
+            raise Exception(f"zipcodes can have at most {MAX_BATCH_SIZE} items")
+        index = get_postal_index()
+        # the same code is often repeated in imports, each one is looked up once
+        addresses = {}
+        output = []
+        for zipcode in zipcodes:
+            item = {"zipcode": zipcode}
+            try:
+                code = get_validated_processed_code(str(zipcode))
+                if code not in addresses:
+                    address = index.lookup(code)
+                    addresses[code] = address and get_address_output(*address)
+                if addresses[code] is None:
+                    raise Exception("valid postal code")
+                item.update(code=code, **addresses[code])
+            except Exception as err:
+                item["error"] = str(err)
+            output.append(item)
+        return Response(status=200, response=json.dumps(output, default=json_serial))
+
+    @staticmethod
+    def get_zips_by_place(prefecture: str, city: str, area: str = None):
+        """Lists every postal code of a city, or of an area of the city
+
+        The prefecture is its id or its name, and the notes of the area names are
+        ignored, so 丸の内 also lists the codes of 丸の内（次のビルを除く）.
+        """
+        pref = get_prefecture_by_name(prefecture or "")
+        if not pref:
+            raise Exception(f"prefecture is not valid: {prefecture}")
+        if not city:
+            raise Exception("city is required")
+        index = get_postal_index()
+        output = []
+        for i in index.codes_in(pref["id"], city, area or None):
+            _, _, area_name, street = index.address_at(i)
+            output.append(
+                {"zipcode": index.code_at(i), "area": area_name, "street": street}
+            )
+        return Response(status=200, response=json.dumps(output, default=json_serial))
+
+    @staticmethod
+    def suggest(query: str, limit: int = SUGGEST_LIMIT):
+        """Suggests addresses for a partial postal code, or for the beginning of a
+        prefecture, city or area name
+
+        Prefectures are matched on their kanji, kana and english names, cities and
+        areas on their kanji names, which may start with the prefecture.
+        """
+        query = normalize_name(query or "").strip()
+        if not query:
+            raise Exception("q is required")
+        if limit < 1:
+            raise Exception(f"limit needs to be positive: {limit}")
+        limit = min(limit, MAX_SUGGEST_LIMIT)
+        index = get_postal_index()
+
+        digits = re.sub("[-ー−]", "", query)
+        if re.fullmatch("[0-9]{1,7}", digits):
+            output = []
+            for i in index.codes_with_prefix(digits)[:limit]:
+                output.append(
+                    {
+                        "zipcode": index.code_at(i),
+                        **get_address_output(*index.address_at(i)),
+                    }
+                )
+            return Response(
+                status=200, response=json.dumps(output, default=json_serial)
+            )
+
+        output = [
+            {"zipcode": None, **get_address_output(pref["id"], None, None, None)}
+            for pref in get_prefectures_by_prefix(query)
+        ][:limit]
+
+        pref_id = None
+        for pref in PREFECTURES:
+            if query.startswith(pref["name"]):
+                pref_id, query = pref["id"], query[len(pref["name"]) :]
+                break
+
+        matches = []
+        if query:
+            for position, area_only in index.names_with_prefix(query):
+                if pref_id is None or index.pref_at(position) == pref_id:
+                    matches.append((area_only, len(matches), position))
+                if len(matches) == SUGGEST_SCAN_LIMIT:
+                    break
+        # matches on the city come before the areas of the same name elsewhere
+        for _, _, position in sorted(matches)[: limit - len(output)]:
+            output.append(
+                {
+                    "zipcode": index.code_at(position),
+                    **get_address_output(*index.address_at(position)),
+                }
+            )
         return Response(status=200, response=json.dumps(output, default=json_serial))
 
 
+def get_address_output(pref_id: int, city: str, area: str, street: str) -> dict:
+    prefecture = get_prefecture_by_id(pref_id)
+    region = get_region_by_id(prefecture["region"])
+    return {
+        "region": region["name"],
+        "prefecture": prefecture["name"],
+        "city": city,
+        "area": area,
+        "street": street,
+    }
+
+
+def get_prefecture_by_name(name: str) -> dict:
+    name = normalize_name(name).strip()
+    for pref in PREFECTURES:
+        if name in (str(pref["id"]), pref["name"], pref["short"], pref["en"]):
+            return pref
+    return {}
+
+
+def get_prefectures_by_prefix(prefix: str) -> list:
+    # the kana of the data is in katakana
+    kana = "".join(chr(ord(x) + 0x60) if "ぁ" <= x <= "ゖ" else x for x in prefix)
+    return [
+        pref
+        for pref in PREFECTURES
+        if pref["name"].startswith(prefix)
+        or pref["kana"].startswith(kana)
+        or pref["en"].startswith(prefix.lower())
+    ]
+
+
 def get_region_by_id(region_id: str) -> dict:
     if region_id < 1 or region_id > 8:
         return {}
-    return [region for region in REGIONS if region["id"] == region_id][0]
+    return REGIONS_BY_ID[region_id]
 
 
 def get_prefecture_by_id(pref_id: str) -> dict:
     if pref_id < 1 or pref_id > 47:
         return {}
-    return [pref for pref in PREFECTURES if pref["id"] == pref_id][0]
+    return PREFECTURES_BY_ID[pref_id]
 
 
 def get_validated_processed_code(code: str):
@@ -528,3 +662,48 @@ def get_address():
         return AddressController.get_address_by_zip(code)
     except Exception as err:
         return Response(status=400, response=str(err))
+
+
+@address_blueprint.route("/batch", methods=["POST"])
+@jwt_authenticated()
+def get_addresses():
+    """
+    Get the addresses of the zipcodes provided in the body as {"zipcodes": [...]}
+
+    """
+    try:
+        body = request.get_json() or {}
+        return AddressController.get_addresses_by_zips(body.get("zipcodes"))
+    except Exception as err:
+        return Response(status=400, response=str(err))
+
+
+@address_blueprint.route("/zipcodes", methods=["GET"])
+@jwt_authenticated()
+def get_zipcodes():
+    """
+    Get the zipcodes of the prefecture and city, and optionally the area, provided in param
+
+    """
+    try:
+        return AddressController.get_zips_by_place(
+            request.args.get("prefecture"),
+            request.args.get("city"),
+            request.args.get("area"),
+        )
+    except Exception as err:
+        return Response(status=400, response=str(err))
+
+
+@address_blueprint.route("/suggest", methods=["GET"])
+@jwt_authenticated()
+def suggest_address():
+    """
+    Get address suggestions for the partial zipcode or name provided in param q
+
+    """
+    try:
+        limit = int(request.args.get("limit", SUGGEST_LIMIT))
+        return AddressController.suggest(request.args.get("q"), limit)
+    except Exception as err:
+        return Response(status=400, response=str(err))
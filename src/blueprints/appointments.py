@@ -1,5 +1,6 @@
 import json
 from datetime import datetime, timedelta
+from typing import Optional
 from uuid import UUID, uuid1
 
 import pytz
@@ -10,7 +11,7 @@ from blueprints.service_requests import ServiceRequestController
 from json_serialize import json_serial
 from services.appointment_service import AppointmentService
 from services.email_notification_service import EmailNotificationService
-from services.lists_service import ListsService
+from services.lists_service import ListsService, get_queue_list_ids
 from services.patient_call_logs_service import PatientCallLogsService
 from services.patient_service import PatientService
 from services.practitioner_role_service import PractitionerRoleService
@@ -401,60 +402,63 @@ class AppointmentController:
         )
 
     def create_appointment_on_queue(
-        self, list_id: str, practitioner_id: UUID
+        self, list_id: Optional[str], practitioner_id: UUID
     ) -> Response:
-        resources = []
-        search_clause = []
-        search_clause.append(("practitioner", practitioner_id))
-        practitioner_role = self.resource_client.search(
-            "PractitionerRole", search_clause
+        """Books a walk-in appointment for the top patient of the queue.
+        The queue update and the appointment are committed in one transaction.
+        Without list_id, the longest of the configured queues is used.
+
+        :returns: created appointment in JSON object
+        :rtype: Response
+        """
+        if list_id is None:
+            if not (list_ids := get_queue_list_ids()):
+                return Response(status=400, response="No list is configured")
+            list_id = self.lists_service.longest(list_ids)
+
+        practitioner_role = self.practitioner_role_service.get_role_by_practitioner(
+            practitioner_id
         )
-        practitioner_role_json = json.loads(practitioner_role.json())
-        role_id = practitioner_role_json["entry"][0]["resource"]["id"]
-        top_queue_patient, lists = self.lists_service.dequeue(list_id)
-        lock_header = self.resource_client.last_seen_etag
-        if top_queue_patient is None:
-            return Response(status=400, response="No Patient in list")
-        resources.append(lists)
+        if practitioner_role is None:
+            return Response(status=400, response="Practitioner role not found")
+
         jst = pytz.timezone("Asia/Tokyo")
         now = datetime.now().astimezone(jst)
         start = now
         end = now + timedelta(minutes=10)
-        role_rid = f"PractitionerRole/{role_id}"
-        patient_rid = f"Patient/{top_queue_patient}"
 
         # validation for start time and end time for doctor
-        doctor_is_available = (
-            self.practitioner_role_service.schedule_is_available_for_doctor(
-                role_id, start, end
-            )
-        )
-        if not doctor_is_available:
-            # change response message
+        if not PractitionerRoleService.is_available_for_walk_in(
+            practitioner_role, start, end
+        ):
             return Response(status=400, response="Doctor is not available")
 
-        # Create Appointment Bundle
-        appointment_uuid = uuid1().urn
-        (
-            err,
-            appointment,
-        ) = self.appointment_service.create_appointment_for_practitioner_role(
-            role_rid,
-            start.isoformat(),
-            end.isoformat(),
-            None,
-            patient_rid,
-            "walkin",
-            None,
-            appointment_uuid,
-            "online",
-        )
+        role_rid = f"PractitionerRole/{practitioner_role.id}"
+
+        def create_appointment(patient_id: str):
+            appointment_uuid = uuid1().urn
+            (
+                err,
+                appointment,
+            ) = self.appointment_service.create_appointment_for_practitioner_role(
+                role_rid,
+                start.isoformat(),
+                end.isoformat(),
+                None,
+                f"Patient/{patient_id}",
+                "walkin",
+                None,
+                appointment_uuid,
+                "online",
+            )
+            return err, [appointment]
 
+        err, top_queue_patient, resp = self.lists_service.dequeue_into_transaction(
+            list_id, create_appointment
+        )
         if err is not None:
             return Response(status=400, response=err.args[0])
-        resources.append(appointment)
 
-        resp = self.resource_client.create_resources(resources, lock_header)
         resp = list(
             filter(lambda x: x.resource.resource_type == "Appointment", resp.entry)
         )[0].resource
@@ -561,3 +565,13 @@ def create_appointment_on_queue(list_id: str, practitioner_id: str) -> Response:
     the patient creates a appointment for doctor
     """
     return AppointmentController().create_appointment_on_queue(list_id, practitioner_id)
+
+
+@appointment_blueprint.route("/list/practitioner/<practitioner_id>", methods=["POST"])
+@jwt_authenticated()
+@jwt_authorized("/Practitioner/{practitioner_id}")
+def create_appointment_on_longest_queue(practitioner_id: str) -> Response:
+    """
+    the patient on top of the longest walk-in queue creates a appointment for doctor
+    """
+    return AppointmentController().create_appointment_on_queue(None, practitioner_id)
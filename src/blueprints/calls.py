@@ -6,7 +6,7 @@ from uuid import UUID
 from flask import Blueprint, Response, request
 
 from adapters.fhir_store import ResourceClient
-from services.patient_call_logs_service import PatientCallLogsService
+from services.patient_call_logs_service import CALLING_STATUS, PatientCallLogsService
 from services.patient_service import PatientService
 from utils.middleware import jwt_authenticated, jwt_authorized
 
@@ -14,8 +14,6 @@ calls_blueprint = Blueprint("calls", __name__, url_prefix="/calls")
 
 APNS_TOPIC = os.getenv("APNS_TOPIC")
 APPLE_PUSH_ENDPOINT = os.getenv("APPLE_PUSH_ENDPOINT")
-CALLING_STATUS = "calling"
-PATIENT_CALL_LOGS = "patient_call_logs"
 
 
 @calls_blueprint.route("", methods=["POST"])
@@ -54,7 +52,7 @@ class CallsController:
         command = self._build_command(endpoint, cert, data)
 
         err, _ = self.patient_call_logs_service.upsert_call_docs(
-            appointment_id, patient_id
+            appointment_id, patient_id, CALLING_STATUS
         )
 
         if err:
@@ -4,6 +4,7 @@ import os
 from flask import Blueprint, Response
 
 from json_serialize import json_serial
+from services.lists_service import get_queue_list_ids
 from utils.middleware import jwt_authenticated
 
 config_blueprint = Blueprint("config", __name__, url_prefix="/config")
@@ -28,7 +29,10 @@ class ConfigController:
         return Response(
             status=200,
             response=json.dumps(
-                {"patientQueueListId": LIST_ID},
+                {
+                    "patientQueueListId": LIST_ID,
+                    "patientQueueListIds": get_queue_list_ids(),
+                },
                 default=json_serial,
             ),
         )
@@ -11,6 +11,7 @@ from flask import Blueprint
 from flask.wrappers import Response
 
 from adapters.fhir_store import ResourceClient
+from services.lists_service import ListsService, get_queue_list_ids
 from services.slack_notification_service import SlackNotificationService
 from utils.datetime_encoder import datetime_encoder
 from utils.middleware import jwt_authenticated, jwt_authorized
@@ -81,6 +82,17 @@ def create_entry(list_id: str, patient_id: str) -> Response:
     return ListsController().create_entry(list_id, patient_id)
 
 
+@lists_blueprint.route("/items/<patient_id>", methods=["POST"])
+@jwt_authenticated()
+@jwt_authorized("/Patient/{patient_id}")
+def create_entry_in_least_loaded_list(patient_id: str) -> Response:
+    """
+    This creates an entry at the end of the shortest walk-in queue configured
+    with `LIST_IDS`. The id of the chosen list is the `id` of the returned data.
+    """
+    return ListsController().create_entry_in_least_loaded_list(patient_id)
+
+
 @lists_blueprint.route("/<list_id>/items/<patient_id>", methods=["DELETE"])
 @jwt_authenticated()
 @jwt_authorized("/Patient/{patient_id}")
@@ -100,11 +112,14 @@ def get_spot_details(list_id: str) -> Response:
 
 
 class ListsController:
-    def __init__(self, resource_client=None, slack_notification_service=None):
+    def __init__(
+        self, resource_client=None, slack_notification_service=None, lists_service=None
+    ):
         self.resource_client = resource_client or ResourceClient()
         self.slack_notification_service = (
             slack_notification_service or SlackNotificationService()
         )
+        self.lists_service = lists_service or ListsService(self.resource_client)
 
     def create(self) -> Response:
         empty_list = {
@@ -135,33 +150,31 @@ class ListsController:
         )
 
     def get_list_len(self, list_id: str) -> Response:
-        fhir_list = self.resource_client.get_resource(list_id, "List")
-        count = 0 if fhir_list.entry is None else len(fhir_list.entry)
+        queue = self.lists_service.get_snapshot(list_id)
         return Response(
             status=200,
-            response=json.dumps({"data": count}),
+            response=json.dumps({"data": len(queue)}),
         )
 
     def get_patient_position(self, list_id: str, patient_id: str) -> Response:
-        fhir_list = self.resource_client.get_resource(list_id, "List")
-        if not fhir_list:
+        queue = self.lists_service.get_snapshot(list_id)
+        if not queue.fhir_list:
             return Response(status=400, response=f"list does not exist: {list_id}")
-        if entries := fhir_list.entry:
-            for idx, list_entry in enumerate(entries):
-                if (
-                    list_entry
-                    and list_entry.item
-                    and list_entry.item.reference
-                    and patient_id in list_entry.item.reference
-                ):
-                    return Response(
-                        status=200, response=json.dumps({"data": {"position": idx}})
-                    )
-        return Response(status=200, response=json.dumps({"data": {"position": -1}}))
+        return Response(
+            status=200,
+            response=json.dumps({"data": {"position": queue.position(patient_id)}}),
+        )
 
     def get_spot_details(self, list_id: str) -> Response:
-        fhir_list = self.resource_client.get_resource(list_id, "List")
-        count = 0 if fhir_list.entry is None else len(fhir_list.entry)
+        # doctors are shared by all walk-in queues, so spots are taken by all of them
+        list_ids = get_queue_list_ids()
+        if list_id not in list_ids:
+            list_ids.append(list_id)
+        queue_counts = {
+            queue_id: len(self.lists_service.get_snapshot(queue_id))
+            for queue_id in list_ids
+        }
+        count = sum(queue_counts.values())
         jst = pytz.timezone("Asia/Tokyo")
         today = datetime.now().astimezone(jst)
 
@@ -191,27 +204,15 @@ class ListsController:
                 "available_spot": spot_counts,
                 "time": today.isoformat(),
                 "list_id": list_id,
+                "queues": queue_counts,
             }
         )
         return Response(status=200, response=resp)
 
     def create_entry(self, list_id: str, patient_id: str) -> Response:
-        # get the list data
-        fhir_list = self.resource_client.get_resource(list_id, "List")
-        if fhir_list.entry is None:
-            fhir_list.entry = []
-
-        # validate that the patient is not already in the queue
-        for e in fhir_list.entry:
-            if e.item.reference.split("/")[1] == patient_id:
-                return Response(status=400, response="Patient already in the list")
-
-        # update the entry with the patient, use optimistic lock to avoid concurrency update.
-        fhir_list.entry.append({"item": {"reference": f"Patient/{patient_id}"}})
-        lock_header = self.resource_client.last_seen_etag
-        fhir_list = self.resource_client.put_resource(
-            fhir_list.id, fhir_list, lock_header
-        )
+        err, fhir_list = self.lists_service.enqueue(list_id, patient_id)
+        if err is not None:
+            return Response(status=400, response=err.args[0])
 
         self.slack_notification_service.send()
 
@@ -220,28 +221,25 @@ class ListsController:
             response=json.dumps({"data": datetime_encoder(fhir_list.dict())}),
         )
 
-    def delete_entry(self, list_id: str, patient_id: str) -> Response:
-        # get the list data
-        fhir_list = self.resource_client.get_resource(list_id, "List")
+    def create_entry_in_least_loaded_list(self, patient_id: str) -> Response:
+        err, fhir_list = self.lists_service.enqueue_least_loaded(
+            get_queue_list_ids(), patient_id
+        )
+        if err is not None:
+            return Response(status=400, response=err.args[0])
+
+        self.slack_notification_service.send()
 
-        # validate that the patient is already in the queue
-        patient_list_idx = -1
-        for idx, e in enumerate(fhir_list.entry):
-            if e.item.reference.split("/")[1] == patient_id:
-                patient_list_idx = idx
-        if patient_list_idx == -1:
-            return Response(status=400, response="Patient not in the list")
-
-        # remove the item of the patient from the entry
-        entry = fhir_list.entry
-        fhir_list.entry = entry[:patient_list_idx] + entry[patient_list_idx + 1 :]
-
-        # update the entry with the removal of the patient
-        lock_header = self.resource_client.last_seen_etag
-        fhir_list = self.resource_client.put_resource(
-            fhir_list.id, fhir_list, lock_header
+        return Response(
+            status=201,
+            response=json.dumps({"data": datetime_encoder(fhir_list.dict())}),
         )
 
+    def delete_entry(self, list_id: str, patient_id: str) -> Response:
+        err, fhir_list = self.lists_service.remove(list_id, patient_id)
+        if err is not None:
+            return Response(status=400, response=err.args[0])
+
         return Response(
             status=200,
             response=json.dumps({"data": datetime_encoder(fhir_list.dict())}),
@@ -1,21 +1,45 @@
 import os
-from multiprocessing import Process
+import threading
+from typing import Callable
 
+import requests
 import stripe
+import structlog
+from fhir.resources.domainresource import DomainResource
 from flask import Blueprint, Response, json, request
 
-from adapters.fhir_store import ResourceClient
+from adapters.fhir_store import ResourceBundle, ResourceClient
 from adapters.fire_storage import StorageClient
-from adapters.fire_store import FireStoreClient
+from adapters.fire_store import get_firestore_client
 from services.account_service import AccountService
+from services.bulk_payment_service import BulkPaymentService
+from services.bulk_payment_validation_service import BulkPaymentValidator
 from services.invoice_service import InvoiceService
 from services.patient_service import PatientService
 from services.payment_service import PaymentService
+from services.stripe_cache_service import (
+    CUSTOMER,
+    PAYMENT_INTENTS,
+    PAYMENT_METHOD,
+    PAYMENT_METHODS,
+    SETUP_INTENT_WINDOW_SECONDS,
+    StripeReadCache,
+    stripe_read_cache,
+)
 from utils.middleware import jwt_authenticated, jwt_authorized
 
 payments_blueprint = Blueprint("payments", __name__, url_prefix="/payments")
+log = structlog.get_logger()
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 OBJECT_NAME = os.getenv("PROCESSED_BULK_PAYMENT_FILES")
+BULK_PAYMENT_RESULT_FIELDS = [
+    "accountId",
+    "status",
+    "price",
+    "currency",
+    "patientId",
+    "description",
+]
 
 
 @payments_blueprint.route("/customer", methods=["POST"])
@@ -43,6 +67,13 @@ def create_bulk_payments():
     return PaymentsController().create_bulk_payments(request)
 
 
+@payments_blueprint.route("/bulk/validate", methods=["POST"])
+@jwt_authenticated()
+@jwt_authorized("/Patient/*")
+def validate_bulk_payments():
+    return PaymentsController().validate_bulk_payments(request)
+
+
 # TODO: AB#812
 @payments_blueprint.route("/", methods=["POST"])
 @jwt_authenticated()
@@ -143,14 +174,24 @@ class PaymentsController:
         firestore_client=None,
         storage_client=None,
         patient_service=None,
+        bulk_payment_service=None,
+        stripe_cache: StripeReadCache = None,
+        bulk_payment_validator: BulkPaymentValidator = None,
     ):
         self.resource_client = resource_client or ResourceClient()
         self.account_service = account_service or AccountService(self.resource_client)
         self.invoice_service = invoice_service or InvoiceService(self.resource_client)
         self.payment_service = payment_service or PaymentService(self.resource_client)
-        self.firestore_client = firestore_client or FireStoreClient()
+        self.firestore_client = firestore_client or get_firestore_client()
         self.storage_client = storage_client or StorageClient()
         self.patient_service = patient_service or PatientService(self.resource_client)
+        self.bulk_payment_service = bulk_payment_service or BulkPaymentService(
+            self.firestore_client
+        )
+        self.stripe_cache = stripe_cache or stripe_read_cache
+        self.bulk_payment_validator = bulk_payment_validator or BulkPaymentValidator(
+            self.resource_client, self.patient_service
+        )
 
     def create_customer(self, request) -> Response:
         body = json.loads(request.data)
@@ -168,7 +209,9 @@ class PaymentsController:
 
         :rtype: Response
         """
-        customer = stripe.Customer.retrieve(customer_id)
+        customer = self.stripe_cache.get(
+            CUSTOMER, customer_id, lambda: stripe.Customer.retrieve(customer_id)
+        )
         return Response(
             status=200, response=json.dumps(customer), mimetype="application/json"
         )
@@ -177,6 +220,12 @@ class PaymentsController:
         body = json.loads(request.data)
         customer_id = body["customerId"]
         intent = stripe.SetupIntent.create(customer=customer_id)
+        # The new payment method and default of the customer are only known once
+        # the frontend confirms the intent
+        self.stripe_cache.uncache(CUSTOMER, customer_id, SETUP_INTENT_WINDOW_SECONDS)
+        self.stripe_cache.uncache(
+            PAYMENT_METHODS, customer_id, SETUP_INTENT_WINDOW_SECONDS
+        )
         return Response(
             status=201, response=json.dumps(intent), mimetype="application/json"
         )
@@ -189,9 +238,13 @@ class PaymentsController:
 
         :rtype: Response
         """
-        payment_methods = stripe.PaymentMethod.list(
-            customer=customer_id,
-            type="card",
+        payment_methods = self.stripe_cache.get(
+            PAYMENT_METHODS,
+            customer_id,
+            lambda: stripe.PaymentMethod.list(
+                customer=customer_id,
+                type="card",
+            ),
         )
 
         return Response(
@@ -208,7 +261,11 @@ class PaymentsController:
 
         :rtype: Response
         """
-        payment_method = stripe.PaymentMethod.retrieve(payment_method_id)
+        payment_method = self.stripe_cache.get(
+            PAYMENT_METHOD,
+            payment_method_id,
+            lambda: stripe.PaymentMethod.retrieve(payment_method_id),
+        )
 
         return Response(
             status=200, response=json.dumps(payment_method), mimetype="application/json"
@@ -223,6 +280,11 @@ class PaymentsController:
         :rtype: Response
         """
         payment_method = stripe.PaymentMethod.detach(payment_method_id)
+        self.stripe_cache.invalidate(PAYMENT_METHOD, payment_method_id)
+        self.stripe_cache.invalidate_where(
+            PAYMENT_METHODS,
+            lambda methods: any(x["id"] == payment_method_id for x in methods["data"]),
+        )
 
         return Response(
             status=200, response=json.dumps(payment_method), mimetype="application/json"
@@ -265,6 +327,9 @@ class PaymentsController:
                 response=json.dumps(error_payment_intent),
                 mimetype="application/json",
             )
+        finally:
+            # Failed intents are listed as well
+            self.stripe_cache.invalidate(PAYMENT_INTENTS, customer_id)
 
     def get_payment_intents(self, customer_id: str) -> Response:
         """Returns details of payment intents from a customer.
@@ -276,7 +341,11 @@ class PaymentsController:
         """
 
         try:
-            payment_intents = stripe.PaymentIntent.list(customer=customer_id)
+            payment_intents = self.stripe_cache.get(
+                PAYMENT_INTENTS,
+                customer_id,
+                lambda: stripe.PaymentIntent.list(customer=customer_id),
+            )
         except:  # noqa: E722
             error_message = (
                 "There was a problem getting Payment Intents for customer: "
@@ -319,25 +388,29 @@ class PaymentsController:
         description: str = None,
         patient_id: str = None,
     ) -> tuple[Exception, str]:
-        if patient_id is None:
-            # Get Active Account
-            err_account, account = self.account_service.get_account(account_id, True)
-            if err_account is not None:
-                return err_account, None
-            patient_id = account.subject[0].reference.split("/")[1]
+        """Charges the account and records the payment in 2 FHIR calls
 
-        # Create Invoice
-        err_invoice, invoice = self.invoice_service.create_invoice(
-            account_id, patient_id, amount, currency
-        )
-        if err_invoice is not None:
-            return err_invoice, None
+        The account is read with its patient in one search. Once Stripe processed
+        the payment, the invoice is created in its final status in the same
+        transaction as the inactivation of the account, see `_record_payment`.
 
-        # Get Payment Details
+        Returns the payment intent id with the error when the payment was charged
+        but could not be recorded.
+        """
         (
-            err_patient_payment,
-            payment_details,
-        ) = self.patient_service.get_patient_payment_details(patient_id)
+            err_account,
+            account_and_patient,
+        ) = self.account_service.get_account_with_patient(account_id)
+        if err_account is not None:
+            return err_account, None
+        account, patient = account_and_patient
+        if patient_id is None:
+            patient_id = patient.id
+
+        # Get Payment Details
+        err_patient_payment, payment_details = self.patient_service.get_payment_details(
+            patient
+        )
         if err_patient_payment is not None:
             return err_patient_payment, None
 
@@ -346,15 +419,83 @@ class PaymentsController:
         err_payment, payment_intent_id = self.payment_service.create_payment(
             amount, currency, customer_id, payment_method_id, description, account_id
         )
+
+        # Record Invoice
+        invoice = self.invoice_service.get_invoice_bundle(
+            account_id,
+            patient_id,
+            amount,
+            currency,
+            payment_intent_id,
+            err_payment is None,
+            None if err_payment is None else "CC payment failed",
+        )
         if err_payment is not None:
-            self.invoice_service.update_invoice_status(
-                payment_intent_id, invoice.id, False, "CC payment failed"
-            )
+            try:
+                self.resource_client.create_resources([invoice])
+            except requests.RequestException as e:
+                log.error(
+                    f"failed to record cancelled payment {payment_intent_id}: {e}",
+                    account_id=account_id,
+                )
             return err_payment, None
-        self.invoice_service.update_invoice_status(payment_intent_id, invoice.id, True)
-        self.account_service.inactivate_account(account_id)
+
+        err_record = self._record_payment(invoice, account, payment_intent_id)
+        if err_record is not None:
+            return err_record, payment_intent_id
         return None, None
 
+    def _record_payment(
+        self, invoice: ResourceBundle, account: DomainResource, payment_intent_id: str
+    ) -> Exception:
+        """Writes the invoice of a processed payment and inactivates the account
+
+        The invoice and the inactivation are written in one transaction. The
+        account is locked to the version read, so when that transaction fails, e.g.
+        the account was updated meanwhile, the invoice is written on its own and the
+        account is inactivated with a patch. A processed payment always gets its
+        invoice unless FHIR itself fails.
+
+        :param invoice: the bundle of the invoice from `get_invoice_bundle`
+        :type invoice: ResourceBundle
+        :param account: the account as it was read
+        :type account: DomainResource
+        :param payment_intent_id: id for the payment, logged on failures
+        :type payment_intent_id: str
+
+        :rtype: Exception
+        """
+        try:
+            self.resource_client.create_resources(
+                [invoice, self.account_service.get_inactivate_bundle(account)]
+            )
+            return None
+        except requests.RequestException as e:
+            log.warning(
+                f"failed to record payment {payment_intent_id} in one transaction: {e}",
+                account_id=account.id,
+            )
+
+        try:
+            self.resource_client.create_resources([invoice])
+        except requests.RequestException as e:
+            log.error(
+                f"failed to record invoice of payment {payment_intent_id}: {e}",
+                account_id=account.id,
+            )
+            return Exception(f"payment {payment_intent_id} could not be recorded")
+        try:
+            self.account_service.inactivate_account(account.id)
+        except requests.RequestException as e:
+            log.error(
+                f"failed to inactivate account of payment {payment_intent_id}: {e}",
+                account_id=account.id,
+            )
+            return Exception(
+                f"account of payment {payment_intent_id} could not be inactivated"
+            )
+        return None
+
     def create_payment(self, request) -> tuple:
         """Returns the details of a invoice created.
 
@@ -369,8 +510,14 @@ class PaymentsController:
         currency = "jpy"
         account_id = body["accountId"]
 
-        err, _ = self._create_payment(amount, currency, account_id)
+        err, payment_intent_id = self._create_payment(amount, currency, account_id)
 
+        if err is not None and payment_intent_id is not None:
+            return Response(
+                status=500,
+                response=json.dumps(err.args[0]),
+                mimetype="application/json",
+            )
         if err is not None:
             return Response(
                 status=500,
@@ -399,14 +546,12 @@ class PaymentsController:
             return Response(status=400, response=err.args[0])
         patient_id = account.subject[0].reference.split("/")[1]
 
-        err, invoice = self.invoice_service.create_invoice(
-            account_id, patient_id, amount, currency
+        invoice = self.invoice_service.get_invoice_bundle(
+            account_id, patient_id, amount, currency, payment_intent_id, True
         )
+        err = self._record_payment(invoice, account, payment_intent_id)
         if err is not None:
-            return Response(status=400, response=err.args[0])
-
-        self.invoice_service.update_invoice_status(payment_intent_id, invoice.id, True)
-        self.account_service.inactivate_account(account_id)
+            return Response(status=500, response=err.args[0])
         return Response(status=201)
 
     def cancel_payment(self, encounter_id: str) -> Response:
@@ -428,12 +573,15 @@ class PaymentsController:
         contents = request_body.get("contents")
 
         if collection and collection_id and contents:
-            heavy_process = Process(
+            # A thread rather than a forked process, the Firestore and FHIR clients
+            # are not safe to use after a fork. Posting the same collection id again
+            # resumes an interrupted job.
+            thread = threading.Thread(
                 target=self.create_bulk_payment_job,
                 args=(collection, collection_id, contents),
                 daemon=True,
             )
-            heavy_process.start()
+            thread.start()
             return Response(mimetype="application/json", status=202)
 
         if collection and collection_id:
@@ -442,6 +590,21 @@ class PaymentsController:
             )
         return Response(status=400, response="Validation Error")
 
+    def validate_bulk_payments(self, request) -> Response:
+        """
+        Returns response with status 200 and the report of the items that would
+        fail, without charging any of them
+        Returns response with status 400 if there is no content
+        """
+        contents = request.get_json().get("contents")
+        if not contents:
+            return Response(status=400, response="Validation Error")
+
+        report = self.bulk_payment_validator.validate(contents)
+        return Response(
+            status=200, response=json.dumps(report), mimetype="application/json"
+        )
+
     def create_bulk_payment_job(
         self,
         collection: str,
@@ -455,33 +618,82 @@ class PaymentsController:
             collection, collection_id, {"status": "in-progress"}
         )
 
-        output = []
-        for item in contents:
-            account_id = item.get("account")
-            patient_id = item.get("patient")
-            amount = item.get("amount")
-            currency = item.get("currency")
-            description = item.get("description")
-            payment_obj = PaymentObject(
-                account_id, patient_id, amount, currency, description
+        try:
+            # Items that would fail are not charged, so that they do not create
+            # accounts or invoices
+            report = self.bulk_payment_validator.validate(contents)
+            self.firestore_client.update_value(
+                collection,
+                collection_id,
+                {
+                    "validation": {
+                        "valid": report["valid"],
+                        "invalid": report["invalid"],
+                    }
+                },
             )
-            result = self._create_payment_helper(payment_obj)
-            output.append(result)
-
-        # Upload output to gcs
-        base_storage_url = self.storage_client.upload_blob_from_memory(
-            output, bucket_name, object_name, collection_id
-        )
+            contents = list(contents)
+            for invalid in report["items"]:
+                contents[invalid["index"]] = {
+                    **contents[invalid["index"]],
+                    "errors": invalid["errors"],
+                }
+
+            # Results are streamed to gcs as the items are charged
+            writer = self.storage_client.open_csv_writer(
+                bucket_name, object_name, collection_id, BULK_PAYMENT_RESULT_FIELDS
+            )
+            try:
+                self.bulk_payment_service.run(
+                    collection,
+                    collection_id,
+                    contents,
+                    self._charge_bulk_item,
+                    on_result=writer.write,
+                )
+                writer.close()
+            finally:
+                writer.abort()
+        except Exception as e:
+            log.error(f"bulk payment {collection_id} was interrupted: {e}")
+            self.firestore_client.update_value(
+                collection, collection_id, {"status": "error"}
+            )
+            return
 
         # Change the status in firebase store to success
         self.firestore_client.update_value(
-            collection, collection_id, {"processedURL": base_storage_url}
+            collection, collection_id, {"processedURL": writer.url}
         )
         self.firestore_client.update_value(
             collection, collection_id, {"status": "success"}
         )
 
-    def _create_payment_helper(self, payment_obj: PaymentObject):
+    def _charge_bulk_item(
+        self, item: dict, on_account_created: Callable[[str], None] = None
+    ) -> dict:
+        payment_obj = PaymentObject(
+            item.get("account"),
+            item.get("patient"),
+            item.get("amount"),
+            item.get("currency"),
+            item.get("description"),
+        )
+        if payment_obj.is_valid() and item.get("errors"):
+            for error in item["errors"]:
+                payment_obj.error = Exception(error)
+            return payment_obj.get_json()
+        try:
+            return self._create_payment_helper(payment_obj, on_account_created)
+        except Exception as e:
+            payment_obj.error = Exception(str(e))
+            return payment_obj.get_json()
+
+    def _create_payment_helper(
+        self,
+        payment_obj: PaymentObject,
+        on_account_created: Callable[[str], None] = None,
+    ):
         # Check if payment object is valid or not
         if not payment_obj.is_valid():
             payment_obj.error = Exception("Invalid payment input")
@@ -496,6 +708,8 @@ class PaymentsController:
                 payment_obj.error = err_account
             else:
                 payment_obj.account = account.id
+                if on_account_created is not None:
+                    on_account_created(account.id)
 
         # Create Payment
         if not payment_obj.error:
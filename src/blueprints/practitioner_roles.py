@@ -324,6 +324,7 @@ class PractitionerRoleController:
         # Call bulk process
         if resources:
             resp = self.resource_client.create_resources(resources)
+            self.practitioner_role_service.directory.invalidate(practitioner_id_raw)
             return Response(status=200, response=resp.json())
         return Response(status=200, response={})
 
@@ -497,6 +498,7 @@ class PractitionerRoleController:
 
         if resources:
             _ = self.resource_client.create_resources(resources)
+            self.practitioner_role_service.directory.invalidate(practitioner_id)
             return Response(status=204)
         return Response(status=204)
 
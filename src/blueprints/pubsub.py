@@ -1,13 +1,24 @@
 import base64
-import structlog
+import contextvars
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 
+import structlog
 from fhir.resources.bundle import Bundle
 from flask import Blueprint, Response, request
 
 from adapters.fhir_store import ResourceClient
+from services.encounter_sync_debounce_service import EncounterSyncDebounceService
 from services.firestore_service import FireStoreService
+from services.message_ledger_service import (
+    MESSAGE_DUPLICATE,
+    MESSAGE_IN_PROGRESS,
+    MessageLedger,
+    pubsub_message_ledger,
+)
 from services.notion_service import NotionService
 
 pubsub_blueprint = Blueprint("pubsub", __name__, url_prefix="/pubsub")
@@ -18,6 +29,13 @@ log = structlog.get_logger()
 # TODO: AB#1211, this flag is used to enable firestore as well.
 IS_SYNCING_TO_NOTION_ENABLED = os.getenv("IS_SYNCING_TO_NOTION_ENABLED")
 
+INSURANCE_CARD_CODE = "64290-0"  # Custom code for Insurance Card
+MEDICAL_CARD_CODE = "00001-1"  # Custom code for Medical Card
+
+# Notion and Firestore are independent sinks of the same encounter, so they are
+# written concurrently. Shared by all requests of the process.
+_sink_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pubsub-sink")
+
 
 @pubsub_blueprint.route("/fhir", methods=["POST"])
 def fhir() -> Response:
@@ -31,6 +49,8 @@ class PubsubController:
         notion_service: NotionService = None,
         is_syncing_to_notion_enabled: str = None,
         firestore_service: FireStoreService = None,
+        debounce_service: EncounterSyncDebounceService = None,
+        message_ledger: MessageLedger = None,
     ):
         self.resource_client = resource_client or ResourceClient()
         self.notion_service = notion_service or NotionService()
@@ -38,6 +58,8 @@ class PubsubController:
             is_syncing_to_notion_enabled or IS_SYNCING_TO_NOTION_ENABLED
         )
         self.firestore_service = firestore_service or FireStoreService()
+        self.debounce_service = debounce_service or EncounterSyncDebounceService()
+        self.message_ledger = message_ledger or pubsub_message_ledger
 
     def fhir(self, request) -> Response:
         """Receive Pub/Sub message"""
@@ -50,7 +72,6 @@ class PubsubController:
             return Response(status=204)
 
         envelope = request.get_json()
-        log.info(f"Envelope: {envelope}")
 
         if not envelope:
             msg = "no Pub/Sub message received"
@@ -58,7 +79,7 @@ class PubsubController:
             return Response(
                 status=400, response=f"Bad Request: {msg}", mimetype="text/plain"
             )
-        log.info(f"Envelope: {envelope}")
+        log.debug(f"Envelope: {envelope}")
 
         if not isinstance(envelope, dict) or "message" not in envelope:
             msg = "invalid Pub/Sub message format, no message field found"
@@ -67,8 +88,57 @@ class PubsubController:
                 status=400, response=f"Bad Request: {msg}", mimetype="text/plain"
             )
 
-        pubsub_message = envelope["message"]
-        log.info(f"Pub/Sub Message: {pubsub_message}")
+        err, resource = self.parse_notification(envelope["message"])
+        if err is not None:
+            return Response(
+                status=400, response=f"Bad Request: {err}", mimetype="text/plain"
+            )
+        if resource is None:
+            return Response(status=204)
+
+        message_id = envelope["message"].get("messageId")
+        if message_id is not None:
+            claim = self.message_ledger.claim(message_id)
+            if claim == MESSAGE_DUPLICATE:
+                return Response(status=204)
+            if claim == MESSAGE_IN_PROGRESS:
+                # Not acked, so that the message is retried if the first delivery fails
+                return Response(
+                    status=409,
+                    response="Message is already being processed",
+                    mimetype="text/plain",
+                )
+
+        try:
+            response = self._sync_resource(*resource)
+        except Exception:
+            if message_id is not None:
+                self.message_ledger.release(message_id)
+            raise
+        if message_id is not None:
+            self.message_ledger.complete(message_id)
+        return response
+
+    def _sync_resource(self, resource_type: str, resource_id: str) -> Response:
+        encounter_id = self.resolve_encounter_id(resource_type, resource_id)
+        if encounter_id is None:
+            log.info(f"{resource_type}/{resource_id} has no encounter. Skipping.")
+            return Response(status=204)
+        if not self.debounce_service.claim(encounter_id):
+            log.info(f"sync of encounter {encounter_id} is already pending")
+            return Response(status=204)
+        self.debounce_service.wait_and_release(encounter_id)
+        return self._post_encounter(encounter_id)
+
+    def parse_notification(
+        self, pubsub_message
+    ) -> Tuple[Optional[str], Optional[Tuple[str, str]]]:
+        """Returns the type and id of the resource a FHIR store notification is about
+
+        The resource is None when the notification does not need a sync.
+
+        :returns: (error message, (resource type, resource id))
+        """
         if (
             not isinstance(pubsub_message, dict)
             or "data" not in pubsub_message
@@ -76,16 +146,14 @@ class PubsubController:
         ):
             msg = "invalid Pub/Sub message format, no data/attributes field found"
             log.error(f"error: {msg}")
-            return Response(
-                status=400, response=f"Bad Request: {msg}", mimetype="text/plain"
-            )
+            return msg, None
 
         attributes = pubsub_message["attributes"]
         action = attributes["action"]
         payload_type = attributes["payloadType"]
         resource_type = attributes["resourceType"]
         data = base64.b64decode(pubsub_message["data"]).decode("utf-8").strip()
-        log.info(f"Data: {data}")
+        log.info(f"Pub/Sub notification: {action} {data}")
         resource_id = re.findall(rf".*\/fhir\/{resource_type}\/(.*)", data)[0]
 
         if (
@@ -98,13 +166,35 @@ class PubsubController:
             and (action == "CreateResource" or action == "PatchResource")
             and payload_type == "NameOnly"
         ):
-            return self._post_encounter(resource_id)
+            return None, (resource_type, resource_id)
 
         msg = f"No operation for pubsub with the following input: [attributes={attributes}, data={data}]"
         log.warning(f"warn: {msg}")
-        return Response(status=204)
+        return None, None
+
+    def resolve_encounter_id(self, resource_type: str, resource_id: str):
+        """Returns the id of the encounter the notified resource belongs to"""
+        if resource_type == "Encounter":
+            return resource_id
+
+        resource = self.resource_client.get_resource(resource_id, resource_type)
+        if resource_type == "DocumentReference":
+            references = resource.context.encounter if resource.context else None
+            reference = references[0] if references else None
+        else:
+            # MedicationRequest and ServiceRequest
+            reference = resource.encounter
+        if reference is None or reference.reference is None:
+            return None
+        return reference.reference.split("/")[1]
 
     def _post_encounter(self, encounter_id: str) -> Response:
+        encounter_page_id = self.sync_encounter(encounter_id)
+        return Response(status=200, response=encounter_page_id, mimetype="text/plain")
+
+    def sync_encounter(self, encounter_id: str) -> str:
+        """Syncs the encounter to Notion and Firestore and returns the Notion page id"""
+        start = time.perf_counter()
         encounter_search_clause = [
             ("_id", encounter_id),  # encounter
             ("_include", "Encounter:account"),  # account
@@ -122,28 +212,27 @@ class PubsubController:
             "Encounter", search=encounter_search_clause
         )
 
+        fhir_search_done = time.perf_counter()
+
         # Currently there is no way to include the insurance card in encounter
-        # search, so we have to make a separate one.
+        # search, so we have to make a separate one for both card types.
         patient = self._find_resource_in_bundle(encounter_bundle, "Patient")
-        insurance_card_bundle = None
-        medical_card_bundle = None
+        insurance_card = None
+        medical_card = None
         if patient is not None:
-            insurance_card_search_clause = [
+            card_search_clause = [
                 ("patient", patient.id),
                 ("status", "current"),
-                ("type", "64290-0"),  # Custom code for Insurance Card
+                ("type", f"{INSURANCE_CARD_CODE},{MEDICAL_CARD_CODE}"),
             ]
-            insurance_card_bundle = self.resource_client.search(
-                "DocumentReference", search=insurance_card_search_clause
+            card_bundle = self.resource_client.search(
+                "DocumentReference", search=card_search_clause
             )
-            medical_card_search_clause = [
-                ("patient", patient.id),
-                ("status", "current"),
-                ("type", "00001-1"),  # Custom code for Insurance Card
-            ]
-            medical_card_bundle = self.resource_client.search(
-                "DocumentReference", search=medical_card_search_clause
+            insurance_card = self._find_document_by_type(
+                card_bundle, INSURANCE_CARD_CODE
             )
+            medical_card = self._find_document_by_type(card_bundle, MEDICAL_CARD_CODE)
+        card_search_done = time.perf_counter()
 
         encounter = self._find_resource_in_bundle(encounter_bundle, "Encounter")
         account = self._find_resource_in_bundle(encounter_bundle, "Account")
@@ -160,48 +249,66 @@ class PubsubController:
         service_request = self._find_resource_in_bundle(
             encounter_bundle, "ServiceRequest"
         )
-        insurance_card = self._find_resource_in_bundle(
-            insurance_card_bundle, "DocumentReference"
-        )
-        medical_card = self._find_resource_in_bundle(
-            medical_card_bundle, "DocumentReference"
-        )
 
-        notion_encounter_query_results = self.notion_service.query_encounter_page(
-            encounter_id=encounter_id
-        )
-        if len(notion_encounter_query_results["results"]) == 0:
-            encounter_page = self.notion_service.create_encounter_page(
-                encounter_id=encounter_id
+        def sync_notion():
+            sink_start = time.perf_counter()
+            encounter_page_id = self.notion_service.sync_encounter(
+                encounter_id,
+                account=account,
+                appointment=appointment,
+                patient=patient,
+                practitioner_role=practitioner_role,
+                clinical_note=clinical_note,
+                medication_request=medication_request,
+                service_request=service_request,
+                insurance_card=insurance_card,
+                medical_card=medical_card,
             )
-        else:
-            encounter_page = notion_encounter_query_results["results"][0]
-
-        self.notion_service.sync_encounter_to_notion(
-            encounter_page_id=encounter_page["id"],
-            account=account,
-            appointment=appointment,
-            patient=patient,
-            practitioner_role=practitioner_role,
-            clinical_note=clinical_note,
-            medication_request=medication_request,
-            service_request=service_request,
-            insurance_card=insurance_card,
-            medical_card=medical_card,
-        )
+            return encounter_page_id, time.perf_counter() - sink_start
 
-        self.firestore_service.sync_encounter_to_firestore(
-            appointment=appointment,
-            encounter=encounter,
-            patient=patient,
-            medication_request=medication_request,
-            service_request=service_request,
+        def sync_firestore():
+            sink_start = time.perf_counter()
+            self.firestore_service.sync_encounter_to_firestore(
+                appointment=appointment,
+                encounter=encounter,
+                patient=patient,
+                medication_request=medication_request,
+                service_request=service_request,
+            )
+            return time.perf_counter() - sink_start
+
+        # copy the context so that the sinks log with the request_id of the message
+        notion_future = _sink_executor.submit(
+            contextvars.copy_context().run, sync_notion
+        )
+        firestore_future = _sink_executor.submit(
+            contextvars.copy_context().run, sync_firestore
         )
+        encounter_page_id, notion_seconds = notion_future.result()
+        firestore_seconds = firestore_future.result()
 
-        return Response(
-            status=200, response=encounter_page["id"], mimetype="text/plain"
+        log.info(
+            f"synced encounter {encounter_id}",
+            encounter_search_ms=round((fhir_search_done - start) * 1000),
+            card_search_ms=round((card_search_done - fhir_search_done) * 1000),
+            notion_ms=round(notion_seconds * 1000),
+            firestore_ms=round(firestore_seconds * 1000),
+            total_ms=round((time.perf_counter() - start) * 1000),
         )
 
+        return encounter_page_id
+
+    def _find_document_by_type(self, bundle: Bundle, type_code: str):
+        if bundle is None or bundle.entry is None:
+            return None
+        for entry in bundle.entry:
+            document = entry.resource
+            if document.resource_type != "DocumentReference" or document.type is None:
+                continue
+            if any(coding.code == type_code for coding in document.type.coding or []):
+                return document
+        return None
+
     def _find_resource_in_bundle(self, bundle: Bundle, fhir_type: str):
         if bundle is None or bundle.entry is None:
             return None
@@ -0,0 +1,50 @@
+"""Worker pulling the FHIR store notifications instead of receiving pushes
+
+It runs the same sync as the /pubsub/fhir push endpoint on its own instances, so
+that the sync work scales separately from the API latency. Importing the app sets
+up logging, Firebase and the secrets the same way as for the API.
+"""
+import os
+import signal
+import threading
+
+import structlog
+
+import app  # noqa: F401
+from adapters.pubsub_subscriber import PubSubSubscriber
+from blueprints.pubsub import PubsubController
+from services.fhir_notification_worker_service import (
+    WORKER_BATCH_SIZE,
+    WORKER_CONCURRENCY,
+    FhirNotificationWorker,
+)
+
+log = structlog.get_logger()
+
+
+def main():
+    # projects/<project>/subscriptions/<subscription>
+    subscription = os.environ["PUBSUB_SUBSCRIPTION"]
+    concurrency = int(os.getenv("PUBSUB_WORKER_CONCURRENCY", WORKER_CONCURRENCY))
+    batch_size = int(os.getenv("PUBSUB_WORKER_BATCH_SIZE", WORKER_BATCH_SIZE))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    worker = FhirNotificationWorker(
+        PubSubSubscriber(subscription),
+        PubsubController(),
+        concurrency=concurrency,
+        batch_size=batch_size,
+    )
+    log.info(
+        f"pulling FHIR notifications from {subscription}",
+        concurrency=concurrency,
+        batch_size=batch_size,
+    )
+    worker.run(stop)
+
+
+if __name__ == "__main__":
+    main()
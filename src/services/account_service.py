@@ -40,6 +40,52 @@ class AccountService:
 
         return None, account.entry[0].resource
 
+    def get_account_with_patient(
+        self, account_id: str
+    ) -> Tuple[Exception, Tuple[DomainResource, DomainResource]]:
+        """Returns an active account and its patient in a single search
+
+        :param account_id: uuid for account
+        :type account_id: str
+
+        rtype: Tuple[Exception, Tuple[DomainResource, DomainResource]]
+        """
+        search_clause = [
+            ("_id", account_id),
+            ("status", "active"),
+            ("_include", "Account:subject"),
+        ]
+        bundle = self.resource_client.search("Account", search=search_clause)
+        resources = [entry.resource for entry in bundle.entry or []]
+        account = next((x for x in resources if x.resource_type == "Account"), None)
+        patient = next((x for x in resources if x.resource_type == "Patient"), None)
+        if account is None:
+            return Exception(f"Account does not exist. account_id: {account_id}"), None
+        if patient is None:
+            return Exception(f"Account has no patient. account_id: {account_id}"), None
+
+        return None, (account, patient)
+
+    def get_inactivate_bundle(self, account: DomainResource) -> ResourceBundle:
+        """Returns the bundle inactivating the account in a transaction
+
+        The whole account is written back, so the transaction fails with 412 if
+        the account was updated since it was read.
+
+        :param account: the account as it was read
+        :type account: DomainResource
+
+        :rtype: ResourceBundle
+        """
+        account = account.copy(deep=True)
+        account.status = "inactive"
+        if_match = None
+        if account.meta is not None and account.meta.versionId is not None:
+            if_match = f'W/"{account.meta.versionId}"'
+        return self.resource_client.get_put_bundle(
+            account, account.id, if_match=if_match
+        )
+
     def _create_account(self, patient_id: uuid, description: string = None):
         account_jsondict = {
             "resourceType": "Account",
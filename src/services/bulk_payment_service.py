@@ -0,0 +1,205 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+import structlog
+from firebase_admin import firestore
+
+from adapters.fire_store import FireStoreClient, get_firestore_client
+
+log = structlog.get_logger()
+
+# Sub-collection of the bulk payment document holding one result per item
+BULK_PAYMENT_ITEMS = "items"
+
+# Every item makes several FHIR calls and one Stripe call, which are mostly spent
+# waiting on the network. Stripe allows far more requests than this in live mode.
+BULK_PAYMENT_CONCURRENCY = 8
+# Items are not started further than this ahead of the first item without a
+# result, which bounds the results waiting for it in on_result consumers that
+# keep the order of the items.
+BULK_PAYMENT_RESULT_WINDOW = 1000
+
+ITEM_PROCESSING = "processing"
+
+# charge(item, on_account_created) -> result of the item
+Charge = Callable[[dict, Callable[[str], None]], dict]
+# on_result(index, result), called from the worker threads
+OnResult = Callable[[int, dict], None]
+
+
+class BulkPaymentService:
+    """Charges the items of a bulk payment concurrently, resuming where it stopped
+
+    The result of every item is checkpointed in the items sub-collection of the
+    bulk payment document, together with the progress counters of the document,
+    so a run started again for the same document only charges the items without
+    a result. An account created for an item is checkpointed before the charge,
+    so that the retry of the item charges the same account and Stripe drops the
+    second charge by its idempotency key.
+    """
+
+    def __init__(
+        self,
+        firestore_client: FireStoreClient = None,
+        concurrency: int = BULK_PAYMENT_CONCURRENCY,
+        result_window: int = BULK_PAYMENT_RESULT_WINDOW,
+    ):
+        self._firestore_client = firestore_client
+        self.concurrency = concurrency
+        self.result_window = result_window
+
+    @property
+    def firestore_client(self) -> FireStoreClient:
+        if self._firestore_client is None:
+            self._firestore_client = get_firestore_client()
+        return self._firestore_client
+
+    def run(
+        self,
+        collection: str,
+        collection_id: str,
+        contents: list,
+        charge: Charge,
+        on_result: OnResult = None,
+    ) -> dict:
+        """Charges the items and hands the result of each item to on_result
+
+        The results are not kept, so that memory does not grow with the number of
+        items. The results checkpointed by a previous run are handed over in the
+        order of the items, and no item is started more than result_window items
+        after the first one without a result.
+
+        :returns: the processed, succeeded and failed counts
+        """
+        on_result = on_result or (lambda index, result: None)
+        document = self.firestore_client.get_collection(collection).document(
+            collection_id
+        )
+        items = document.collection(BULK_PAYMENT_ITEMS)
+        checkpoints = self._checkpoints(items)
+        progress = _Progress(len(contents))
+        window = _ResultWindow(self.result_window)
+
+        document.set({"total": len(contents)}, merge=True)
+        resumed = sum("result" in x for x in checkpoints.values())
+        if resumed:
+            log.info(
+                f"resuming bulk payment {collection_id}",
+                done=resumed,
+                total=len(contents),
+            )
+
+        def process(index: int, item: dict):
+            try:
+                charge_item(index, item)
+            finally:
+                window.done(index)
+
+        def charge_item(index: int, item: dict):
+            ref = items.document(str(index))
+
+            def on_account_created(account_id: str):
+                ref.set({"status": ITEM_PROCESSING, "accountId": account_id})
+
+            result = charge(item, on_account_created)
+            succeeded = result.get("status") == "success"
+
+            # the result and the counters are committed together, so that the
+            # counters stay right when the run is resumed
+            batch = self.firestore_client.client.batch()
+            batch.set(ref, {"status": result.get("status"), "result": result})
+            batch.update(
+                document,
+                {
+                    "processed": firestore.Increment(1),
+                    "succeeded" if succeeded else "failed": firestore.Increment(1),
+                },
+            )
+            batch.commit()
+            progress.done(result)
+            on_result(index, result)
+
+        with ThreadPoolExecutor(
+            self.concurrency, thread_name_prefix="bulk-payment"
+        ) as executor:
+            futures = []
+            for index, item in enumerate(contents):
+                window.wait_for(index)
+                checkpoint = checkpoints.get(str(index), {})
+                if "result" in checkpoint:
+                    progress.done(checkpoint["result"], resumed=True)
+                    on_result(index, checkpoint["result"])
+                    window.done(index)
+                    continue
+                if checkpoint.get("accountId") and not item.get("account"):
+                    item = {**item, "account": checkpoint["accountId"]}
+                futures.append(executor.submit(process, index, item))
+            for future in futures:
+                future.result()
+
+        report = progress.report()
+        log.info(f"processed bulk payment {collection_id}", **report)
+        return report
+
+    def _checkpoints(self, items) -> Dict[str, dict]:
+        return {snapshot.id: snapshot.to_dict() for snapshot in items.stream()}
+
+
+class _ResultWindow:
+    """Tracks the first index without a result, to hold back the items too far
+    ahead of it
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._condition = threading.Condition()
+        self._done = set()
+        self._first_pending = 0
+
+    def wait_for(self, index: int):
+        with self._condition:
+            self._condition.wait_for(lambda: index - self._first_pending < self.size)
+
+    def done(self, index: int):
+        with self._condition:
+            self._done.add(index)
+            while self._first_pending in self._done:
+                self._done.remove(self._first_pending)
+                self._first_pending += 1
+            self._condition.notify_all()
+
+
+class _Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.processed = 0
+        self.succeeded = 0
+        self.resumed = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def done(self, result: dict, resumed: bool = False):
+        with self._lock:
+            self.processed += 1
+            if result.get("status") == "success":
+                self.succeeded += 1
+            if resumed:
+                self.resumed += 1
+                return
+            processed = self.processed
+        if processed % 100 == 0:
+            log.info("bulk payment progress", **self.report())
+
+    def report(self) -> dict:
+        with self._lock:
+            charged = self.processed - self.resumed
+            elapsed = time.monotonic() - self.started_at
+            return {
+                "processed": self.processed,
+                "succeeded": self.succeeded,
+                "failed": self.processed - self.succeeded,
+                "total": self.total,
+                "per_second": round(charged / elapsed, 2) if elapsed > 0 else 0.0,
+            }
@@ -0,0 +1,161 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List
+
+import structlog
+from fhir.resources.domainresource import DomainResource
+
+from adapters.fhir_store import ResourceClient
+from services.patient_service import PatientService
+
+log = structlog.get_logger()
+
+# Ids per search, a hundred uuids keep the url far below the length limits
+VALIDATION_CHUNK_SIZE = 100
+VALIDATION_CONCURRENCY = 4
+
+
+class BulkPaymentValidator:
+    """Checks every item of a bulk payment before any of them is charged
+
+    The accounts of the batch are fetched with their patients, and the patients of
+    the items without an account, with searches of many comma separated ids, so a
+    batch of thousands of items is checked with a few dozen FHIR calls.
+    """
+
+    def __init__(
+        self,
+        resource_client: ResourceClient,
+        patient_service: PatientService = None,
+        chunk_size: int = VALIDATION_CHUNK_SIZE,
+        concurrency: int = VALIDATION_CONCURRENCY,
+    ):
+        self.resource_client = resource_client
+        self.patient_service = patient_service or PatientService(resource_client)
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    def validate(self, contents: list) -> dict:
+        """Returns the report of the items that would fail
+
+        :returns: the total, valid and invalid counts, and the errors of each
+            invalid item with its index in contents
+        """
+        start = time.perf_counter()
+        account_ids = {x.get("account") for x in contents if x.get("account")}
+        patient_ids = {
+            x.get("patient")
+            for x in contents
+            if x.get("patient") and not x.get("account")
+        }
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            account_bundles = executor.map(
+                lambda ids: self._search("Account", ids, "Account:subject"),
+                self._chunks(account_ids),
+            )
+            patient_bundles = executor.map(
+                lambda ids: self._search("Patient", ids),
+                self._chunks(patient_ids),
+            )
+            resources = [r for rs in account_bundles for r in rs]
+            resources += [r for rs in patient_bundles for r in rs]
+
+        accounts = {x.id: x for x in resources if x.resource_type == "Account"}
+        patients = {x.id: x for x in resources if x.resource_type == "Patient"}
+
+        items = []
+        charged_accounts = set()
+        for index, item in enumerate(contents):
+            errors = self._validate_item(item, accounts, patients, charged_accounts)
+            if errors:
+                items.append(
+                    {
+                        "index": index,
+                        "accountId": item.get("account"),
+                        "patientId": item.get("patient"),
+                        "errors": errors,
+                    }
+                )
+
+        report = {
+            "total": len(contents),
+            "valid": len(contents) - len(items),
+            "invalid": len(items),
+            "items": items,
+        }
+        log.info(
+            "validated bulk payment",
+            total=report["total"],
+            invalid=report["invalid"],
+            elapsed_ms=round((time.perf_counter() - start) * 1000),
+        )
+        return report
+
+    def _validate_item(
+        self,
+        item: dict,
+        accounts: Dict[str, DomainResource],
+        patients: Dict[str, DomainResource],
+        charged_accounts: set,
+    ) -> List[str]:
+        errors = []
+        if not item.get("amount"):
+            errors.append("Missing amount")
+        if not item.get("currency"):
+            errors.append("Missing currency")
+        if not item.get("description"):
+            errors.append("Missing description")
+
+        account_id = item.get("account")
+        patient_id = item.get("patient")
+        if not account_id and not patient_id:
+            errors.append("Missing account and patient")
+            return errors
+
+        if account_id:
+            account = accounts.get(account_id)
+            if account is None:
+                errors.append(f"Account does not exist. account_id: {account_id}")
+                return errors
+            if account.status != "active":
+                errors.append(f"Account is not active. account_id: {account_id}")
+            if account_id in charged_accounts:
+                errors.append(f"Account is charged twice. account_id: {account_id}")
+            charged_accounts.add(account_id)
+            subject = account.subject[0].reference if account.subject else ""
+            account_patient_id = subject.split("/")[-1]
+            if patient_id and patient_id != account_patient_id:
+                errors.append(
+                    f"Account is not of the patient. account_id: {account_id}"
+                )
+            patient_id = account_patient_id
+
+        patient = patients.get(patient_id)
+        if patient is None:
+            errors.append(f"Patient does not exist. patient_id: {patient_id}")
+            return errors
+        err, _ = self.patient_service.get_payment_details(patient)
+        if err is not None:
+            errors.append(err.args[0])
+        return errors
+
+    def _search(
+        self, resource_type: str, ids: List[str], include: str = None
+    ) -> List[DomainResource]:
+        search = [("_id", ",".join(ids))]
+        if include:
+            search.append(("_include", include))
+        resources = []
+        bundle = self.resource_client.search(resource_type, search=search)
+        while bundle is not None:
+            resources += [entry.resource for entry in bundle.entry or []]
+            next_link = next(
+                (x.url for x in bundle.link or [] if x.relation == "next"), None
+            )
+            bundle = self.resource_client.link(next_link) if next_link else None
+        return resources
+
+    def _chunks(self, ids: set) -> Iterator[List[str]]:
+        ids = sorted(ids)
+        for i in range(0, len(ids), self.chunk_size):
+            yield ids[i : i + self.chunk_size]
@@ -0,0 +1,198 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import structlog
+
+from adapters.fhir_store import ResourceClient
+from adapters.fire_store import FireStoreClient, get_firestore_client
+
+log = structlog.get_logger()
+
+ENCOUNTER_BACKFILLS = "encounter_backfills"
+
+# Notion requests are throttled by the shared writer anyway, more workers only
+# overlap the FHIR searches with the Notion round trips.
+BACKFILL_CONCURRENCY = 4
+BACKFILL_PAGE_SIZE = 100
+
+
+class EncounterBackfillService:
+    """Syncs every encounter of a date range again, resuming where it stopped
+
+    The range is processed one day at a time. The day the next run starts from is
+    checkpointed in Firestore once all encounters of a day are synced, so an
+    interrupted run only syncs again the encounters of the day it was in, which
+    is harmless since syncing is idempotent. The encounters that failed are kept in
+    the checkpoint and retried first by the next run of the same range.
+    """
+
+    def __init__(
+        self,
+        resource_client: ResourceClient,
+        sync_encounter: Callable[[str], str],
+        firestore_client: FireStoreClient = None,
+        concurrency: int = BACKFILL_CONCURRENCY,
+        page_size: int = BACKFILL_PAGE_SIZE,
+    ):
+        self.resource_client = resource_client
+        self.sync_encounter = sync_encounter
+        self._firestore_client = firestore_client
+        self.concurrency = concurrency
+        self.page_size = page_size
+
+    @property
+    def firestore_client(self) -> FireStoreClient:
+        if self._firestore_client is None:
+            self._firestore_client = get_firestore_client()
+        return self._firestore_client
+
+    def run(self, start: date, end: date) -> dict:
+        """Syncs the encounters from start to end, both included
+
+        :returns: the checkpoint of the backfill with the synced and failed counts
+        """
+        ref = self.firestore_client.get_collection(ENCOUNTER_BACKFILLS).document(
+            f"{start.isoformat()}_{end.isoformat()}"
+        )
+        snapshot = ref.get()
+        checkpoint = (
+            snapshot.to_dict()
+            if snapshot.exists
+            else {"next_day": start.isoformat(), "synced": 0, "failed": 0}
+        )
+        checkpoint.setdefault("failed_ids", [])
+        day = date.fromisoformat(checkpoint["next_day"])
+        if day > start:
+            log.info(
+                f"resuming backfill from {day}",
+                synced=checkpoint["synced"],
+                failed=checkpoint["failed"],
+            )
+
+        retried_ids = checkpoint["failed_ids"]
+        total = self._count(day, end + timedelta(days=1))
+        progress = _Progress(total + len(retried_ids) if total is not None else None)
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            if retried_ids:
+                failed_ids = self._sync(executor, retried_ids, progress)
+                checkpoint["synced"] += progress.batch_synced
+                checkpoint["failed"] -= progress.batch_synced
+                checkpoint["failed_ids"] = failed_ids
+                self._save(ref, checkpoint)
+                log.info("retried failed encounters", **progress.report())
+
+            while day <= end:
+                failed_ids = self._sync(
+                    executor,
+                    self._encounter_ids(day, day + timedelta(days=1)),
+                    progress,
+                )
+                day += timedelta(days=1)
+                checkpoint["next_day"] = day.isoformat()
+                checkpoint["synced"] += progress.batch_synced
+                checkpoint["failed"] += len(failed_ids)
+                checkpoint["failed_ids"] += failed_ids
+                self._save(ref, checkpoint)
+                log.info(
+                    f"backfilled encounters of {day - timedelta(days=1)}",
+                    **progress.report(),
+                )
+
+        return checkpoint
+
+    @staticmethod
+    def _save(ref, checkpoint: dict):
+        checkpoint["updated_at"] = datetime.now(timezone.utc)
+        ref.set(dict(checkpoint, failed_ids=list(checkpoint["failed_ids"])))
+
+    def _sync(
+        self, executor, encounter_ids: Iterable[str], progress: "_Progress"
+    ) -> List[str]:
+        """Syncs the encounters and returns the ids of the ones that failed"""
+        progress.batch_synced = 0
+        failed_ids = []
+        # bounds the encounters waiting in the executor to a page
+        slots = threading.BoundedSemaphore(self.page_size)
+
+        def sync(encounter_id: str):
+            try:
+                self.sync_encounter(encounter_id)
+                progress.done()
+            except Exception as e:
+                log.warning(f"failed to backfill encounter {encounter_id}: {e}")
+                failed_ids.append(encounter_id)
+                progress.done(failed=True)
+            finally:
+                slots.release()
+
+        futures = []
+        for encounter_id in encounter_ids:
+            slots.acquire()
+            futures.append(executor.submit(sync, encounter_id))
+        for future in futures:
+            future.result()
+        return failed_ids
+
+    def _encounter_ids(self, start: date, end: date) -> Iterator[str]:
+        bundle = self.resource_client.search(
+            "Encounter",
+            search=[
+                ("date", f"ge{start.isoformat()}"),
+                ("date", f"lt{end.isoformat()}"),
+                ("_count", str(self.page_size)),
+            ],
+        )
+        while bundle is not None:
+            for entry in bundle.entry or []:
+                yield entry.resource.id
+            next_link = next(
+                (x.url for x in bundle.link or [] if x.relation == "next"), None
+            )
+            bundle = self.resource_client.link(next_link) if next_link else None
+
+    def _count(self, start: date, end: date) -> Optional[int]:
+        bundle = self.resource_client.search(
+            "Encounter",
+            search=[
+                ("date", f"ge{start.isoformat()}"),
+                ("date", f"lt{end.isoformat()}"),
+                ("_summary", "count"),
+            ],
+        )
+        return bundle.total
+
+
+class _Progress:
+    def __init__(self, total: Optional[int]):
+        self.total = total
+        self.synced = 0
+        self.failed = 0
+        self.batch_synced = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def done(self, failed: bool = False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.synced += 1
+                self.batch_synced += 1
+
+    def report(self) -> dict:
+        with self._lock:
+            processed = self.synced + self.failed
+            elapsed = time.monotonic() - self.started_at
+        throughput = processed / elapsed if elapsed > 0 else 0.0
+        report = {
+            "synced": self.synced,
+            "failed": self.failed,
+            "total": self.total,
+            "per_second": round(throughput, 2),
+        }
+        if self.total is not None and throughput > 0:
+            report["eta_seconds"] = round(max(self.total - processed, 0) / throughput)
+        return report
@@ -0,0 +1,88 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import structlog
+from firebase_admin import firestore
+
+from adapters.fire_store import FireStoreClient, get_firestore_client
+
+log = structlog.get_logger()
+
+PENDING_ENCOUNTER_SYNCS = "pending_encounter_syncs"
+
+# One visit creates and patches several resources of the same encounter within a few
+# seconds. Notifications inside the window are coalesced into a single sync of the
+# latest state. 0 disables coalescing. The wait holds a thread per encounter, which
+# is meant for the pull worker (src/pubsub_worker.py) rather than the push endpoint.
+COALESCE_WINDOW_SECONDS = float(os.getenv("PUBSUB_COALESCE_WINDOW_SECONDS", "0"))
+
+# A claim older than this is considered abandoned (e.g. the instance was recycled)
+# and can be taken over by the next notification.
+STALE_CLAIM_FACTOR = 3
+
+
+class EncounterSyncDebounceService:
+    """Coalesces bursts of notifications for the same encounter across instances.
+
+    The first notification of a burst claims the encounter in Firestore and waits
+    until the window closes, the following ones find the claim and are dropped.
+    The claim is released before syncing so that a notification arriving during
+    the sync starts a new window and the latest state is always synced.
+    """
+
+    def __init__(
+        self,
+        window: float = COALESCE_WINDOW_SECONDS,
+        firestore_client: FireStoreClient = None,
+    ):
+        self.window = window
+        self._firestore_client = firestore_client
+
+    @property
+    def firestore_client(self) -> FireStoreClient:
+        if self._firestore_client is None:
+            self._firestore_client = get_firestore_client()
+        return self._firestore_client
+
+    def claim(self, encounter_id: str) -> bool:
+        """Returns True if the caller is responsible for syncing the encounter,
+        False if a sync of the encounter is already pending.
+        """
+        if self.window <= 0:
+            return True
+
+        ref = self.firestore_client.get_collection(PENDING_ENCOUNTER_SYNCS).document(
+            encounter_id
+        )
+        now = datetime.now(timezone.utc)
+        due_at = now + timedelta(seconds=self.window)
+        stale_before = now - timedelta(seconds=self.window * STALE_CLAIM_FACTOR)
+
+        @firestore.transactional
+        def claim_in_transaction(transaction) -> bool:
+            snapshot = ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.get("due_at") > stale_before:
+                transaction.update(ref, {"coalesced": firestore.Increment(1)})
+                return False
+            transaction.set(ref, {"due_at": due_at, "coalesced": 0})
+            return True
+
+        return claim_in_transaction(self.firestore_client.client.transaction())
+
+    def wait_and_release(self, encounter_id: str):
+        """Waits for the window to close and releases the claim of the encounter"""
+        if self.window <= 0:
+            return
+
+        time.sleep(self.window)
+        ref = self.firestore_client.get_collection(PENDING_ENCOUNTER_SYNCS).document(
+            encounter_id
+        )
+        snapshot = ref.get()
+        if snapshot.exists:
+            log.info(
+                f"coalesced notifications of encounter {encounter_id}",
+                coalesced=snapshot.to_dict().get("coalesced", 0),
+            )
+        ref.delete()
@@ -0,0 +1,208 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import structlog
+
+from adapters.pubsub_subscriber import PubSubSubscriber
+from services.message_ledger_service import MESSAGE_CLAIMED, MESSAGE_DUPLICATE
+
+log = structlog.get_logger()
+
+# Messages pulled at once. The next batch is only pulled once every message of the
+# current one is acked or nacked, which bounds the outstanding messages.
+WORKER_BATCH_SIZE = 100
+WORKER_CONCURRENCY = 8
+PULL_ERROR_BACKOFF_SECONDS = 5.0
+# The debounce and the Notion throttling can hold a batch longer than the ack
+# deadline of the subscription, so the deadline of the messages of the batch is
+# extended right after the pull and then periodically until they are acked.
+ACK_DEADLINE_EXTENSION_SECONDS = 60
+ACK_EXTENSION_INTERVAL_SECONDS = 20.0
+
+
+class FhirNotificationWorker:
+    """Pulls FHIR store notifications in batches and syncs their encounters
+
+    Notifications of a batch are grouped by resource, then by the encounter the
+    resource belongs to, so an encounter touched by several messages is synced
+    once. Encounters also go through the debounce of the push endpoint, so that
+    bursts spanning several batches or instances are coalesced, and the window
+    only holds the threads of the worker. Messages are acked once their encounter
+    is synced or already has a pending sync, and nacked for redelivery when the
+    sync fails. Malformed and irrelevant messages are acked right away, as the
+    push endpoint does by answering 4xx or 204. Redeliveries of processed
+    messages are acked without any work, those still being processed elsewhere
+    are left to their ack deadline. The ack deadline of a batch is extended while
+    it is processed, so that slow syncs are not redelivered meanwhile.
+    """
+
+    def __init__(
+        self,
+        subscriber: PubSubSubscriber,
+        controller,
+        concurrency: int = WORKER_CONCURRENCY,
+        batch_size: int = WORKER_BATCH_SIZE,
+        ack_extension_interval: float = ACK_EXTENSION_INTERVAL_SECONDS,
+    ):
+        self.subscriber = subscriber
+        self.controller = controller
+        self.batch_size = batch_size
+        self.ack_extension_interval = ack_extension_interval
+        self._executor = ThreadPoolExecutor(
+            concurrency, thread_name_prefix="pubsub-worker"
+        )
+
+    def run(self, stop: threading.Event = None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.process_batch()
+            except Exception as e:
+                log.error(f"failed to pull FHIR notifications: {e}")
+                stop.wait(PULL_ERROR_BACKOFF_SECONDS)
+
+    def process_batch(self) -> int:
+        """Pulls and processes one batch, returns the number of messages pulled"""
+        received = self.subscriber.pull(self.batch_size)
+        if not received:
+            return 0
+
+        start = time.perf_counter()
+        done = threading.Event()
+        extender = threading.Thread(
+            target=self._extend_ack_deadlines,
+            args=([x["ackId"] for x in received], done),
+            name="pubsub-ack-extender",
+            daemon=True,
+        )
+        extender.start()
+        try:
+            ack_ids, nack_ids, stats = self._process(received)
+        finally:
+            done.set()
+            extender.join()
+        self.subscriber.acknowledge(ack_ids)
+        self.subscriber.nack(nack_ids)
+        log.info(
+            "processed FHIR notifications",
+            messages=len(received),
+            **stats,
+            acked=len(ack_ids),
+            nacked=len(nack_ids),
+            elapsed_ms=round((time.perf_counter() - start) * 1000),
+        )
+        return len(received)
+
+    def _process(self, received: list) -> Tuple[List[str], List[str], dict]:
+        """Syncs the encounters of the messages, returns the ack ids to ack and to
+        nack with the stats of the batch
+        """
+        ack_ids, by_resource, claimed = self._group_by_resource(received)
+
+        by_encounter: Dict[str, List[str]] = {}
+        nack_ids = []
+        resources = list(by_resource)
+        results = self._executor.map(self._resolve, resources)
+        for resource, (err, encounter_id) in zip(resources, results):
+            if err is not None:
+                nack_ids += by_resource[resource]
+            elif encounter_id is None:
+                ack_ids += by_resource[resource]
+            else:
+                by_encounter.setdefault(encounter_id, []).extend(by_resource[resource])
+
+        encounter_ids = list(by_encounter)
+        results = self._executor.map(self._sync, encounter_ids)
+        failed = 0
+        for encounter_id, err in zip(encounter_ids, results):
+            if err is None:
+                ack_ids += by_encounter[encounter_id]
+            else:
+                failed += 1
+                nack_ids += by_encounter[encounter_id]
+
+        ledger = self.controller.message_ledger
+        for ack_id in ack_ids:
+            if ack_id in claimed:
+                ledger.complete(claimed[ack_id])
+        for ack_id in nack_ids:
+            if ack_id in claimed:
+                ledger.release(claimed[ack_id])
+        stats = {
+            "resources": len(by_resource),
+            "encounters": len(by_encounter),
+            "failed_encounters": failed,
+        }
+        return ack_ids, nack_ids, stats
+
+    def _extend_ack_deadlines(self, ack_ids: List[str], done: threading.Event):
+        """Extends the ack deadline of the messages until done is set"""
+        while True:
+            try:
+                self.subscriber.modify_ack_deadline(
+                    ack_ids, ACK_DEADLINE_EXTENSION_SECONDS
+                )
+            except Exception as e:
+                log.warning(f"failed to extend the ack deadline of a batch: {e}")
+            if done.wait(self.ack_extension_interval):
+                return
+
+    def _group_by_resource(
+        self, received: list
+    ) -> Tuple[List[str], Dict[Tuple[str, str], List[str]], Dict[str, str]]:
+        """Returns the ack ids to ack right away, the ack ids by resource to sync
+        and the message ids claimed in the ledger by ack id
+        """
+        ack_ids = []
+        by_resource: Dict[Tuple[str, str], List[str]] = {}
+        claimed: Dict[str, str] = {}
+        enabled = self.controller.is_syncing_to_notion_enabled not in (None, "false")
+        for received_message in received:
+            ack_id = received_message["ackId"]
+            if not enabled:
+                ack_ids.append(ack_id)
+                continue
+            try:
+                err, resource = self.controller.parse_notification(
+                    received_message["message"]
+                )
+            except Exception as e:
+                log.error(f"error: invalid FHIR notification: {e}")
+                err, resource = str(e), None
+            if err is not None or resource is None:
+                ack_ids.append(ack_id)
+                continue
+
+            message_id = received_message["message"].get("messageId")
+            if message_id is not None:
+                claim = self.controller.message_ledger.claim(message_id)
+                if claim == MESSAGE_DUPLICATE:
+                    ack_ids.append(ack_id)
+                    continue
+                if claim != MESSAGE_CLAIMED:
+                    continue
+                claimed[ack_id] = message_id
+            by_resource.setdefault(resource, []).append(ack_id)
+        return ack_ids, by_resource, claimed
+
+    def _resolve(self, resource: Tuple[str, str]):
+        try:
+            return None, self.controller.resolve_encounter_id(*resource)
+        except Exception as e:
+            log.warning(f"failed to resolve encounter of {'/'.join(resource)}: {e}")
+            return e, None
+
+    def _sync(self, encounter_id: str):
+        try:
+            debounce_service = self.controller.debounce_service
+            if not debounce_service.claim(encounter_id):
+                log.info(f"sync of encounter {encounter_id} is already pending")
+                return None
+            debounce_service.wait_and_release(encounter_id)
+            self.controller.sync_encounter(encounter_id)
+            return None
+        except Exception as e:
+            log.warning(f"failed to sync encounter {encounter_id}: {e}")
+            return e
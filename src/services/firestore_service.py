@@ -6,7 +6,7 @@ from fhir.resources.medicationrequest import MedicationRequest
 from fhir.resources.patient import Patient
 from fhir.resources.servicerequest import ServiceRequest
 
-from adapters.fire_store import FireStoreClient
+from adapters.fire_store import FireStoreBatchWriter, get_batch_writer
 from services.appointment_service import AppointmentService
 from services.medication_request_service import MedicationRequestService
 from services.patient_service import PatientService
@@ -60,6 +60,15 @@ class EncounterCollection:
 
 
 class FireStoreService:
+    def __init__(self, writer: FireStoreBatchWriter = None):
+        self._writer = writer
+
+    @property
+    def writer(self) -> FireStoreBatchWriter:
+        if self._writer is None:
+            self._writer = get_batch_writer()
+        return self._writer
+
     def sync_encounter_to_firestore(
         self,
         appointment: Appointment = None,
@@ -74,8 +83,7 @@ class FireStoreService:
                 appointment, service_request, patient, medication_request
             )
             output = encounter_collection.to_fire_store()
-            fire_store_client = FireStoreClient()
-            fire_store_client.add_value(COLLECTION, output, encounter.id)
+            self.writer.set(COLLECTION, encounter.id, output).result()
 
 
 def get_today() -> str:
@@ -1,10 +1,10 @@
 from typing import Optional, Tuple
+from uuid import uuid1
 
 from fhir.resources import construct_fhir_element
 from fhir.resources.domainresource import DomainResource
-from flask import Response
 
-from adapters.fhir_store import ResourceClient
+from adapters.fhir_store import ResourceBundle, ResourceClient
 from utils.system_code import SystemCode
 
 
@@ -12,14 +12,28 @@ class InvoiceService:
     def __init__(self, resource_client: ResourceClient) -> None:
         self.resource_client = resource_client
 
-    def create_invoice(
+    def get_invoice_bundle(
         self,
         account_id: str,
         patient_id: str,
         amount: int,
         currency: str,
-    ) -> Tuple[Exception, DomainResource]:
-        """Returns invoice after creating invoice"""
+        payment_intent_id: Optional[str],
+        is_successful: bool,
+        reason: Optional[str] = None,
+    ) -> ResourceBundle:
+        """Returns the bundle creating the invoice of a processed payment
+
+        The invoice is created in its final status, so that it is written once
+        the payment is processed, in the same transaction as the account.
+
+        :param payment_intent_id: id for the payment
+        :type payment_intent_id: str
+        :param is_successful: if payment is successfully processed or not.
+        :type is_successful: bool
+
+        :rtype: ResourceBundle
+        """
         invoice = {
             "resourceType": "Invoice",
             "status": "issued",
@@ -28,44 +42,26 @@ class InvoiceService:
             "totalGross": {"value": amount, "currency": currency},
         }
         invoice_construct = construct_fhir_element(invoice["resourceType"], invoice)
+        self._set_status(invoice_construct, payment_intent_id, is_successful, reason)
+        return self.resource_client.get_post_bundle(invoice_construct, uuid1().urn)
 
-        invoice = self.resource_client.create_resource(invoice_construct)
-        return None, invoice
-
-    def update_invoice_status(
+    def _set_status(
         self,
+        invoice: DomainResource,
         payment_intent_id: Optional[str],
-        invoice_id: str,
         is_successful: bool,
-        reason: Optional[str] = None,
-    ) -> Tuple[Exception, DomainResource]:
-        """Update invoice status
-
-        :param payment_intent_id: id for the payment
-        :type payment_intent_id: str
-        :param invoice_id: uuid for invoice
-        :type invoice_id: str
-        :param is_successful: if payment is successfully processed or not.
-        :type is_successful: bool
-
-        :rtype: Tuple[Exception, DomainResource]
-        """
-        err, invoice = self.get_invoice(invoice_id)
-        if err is not None:
-            return Response(status=400, response=err.args[0])
-        construct_invoice = construct_fhir_element("Invoice", invoice)
+        reason: Optional[str],
+    ):
         if is_successful:
-            construct_invoice.status = "balanced"
-            construct_invoice.extension = [SystemCode.payment_intent(payment_intent_id)]
+            invoice.status = "balanced"
+            invoice.extension = [SystemCode.payment_intent(payment_intent_id)]
         elif payment_intent_id is not None:
-            construct_invoice.status = "cancelled"
-            construct_invoice.cancelledReason = reason
-            construct_invoice.extension = [SystemCode.payment_intent(payment_intent_id)]
+            invoice.status = "cancelled"
+            invoice.cancelledReason = reason
+            invoice.extension = [SystemCode.payment_intent(payment_intent_id)]
         else:  # There is an error where payment_intent_id is not created by Stripe
-            construct_invoice.status = "cancelled"
-            construct_invoice.cancelledReason = reason
-        invoice = self.resource_client.put_resource(invoice_id, construct_invoice)
-        return None, invoice
+            invoice.status = "cancelled"
+            invoice.cancelledReason = reason
 
     def get_invoice(self, invoice_id: str) -> Tuple[Exception, DomainResource]:
         """Returns invoice by invoice id
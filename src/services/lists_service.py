@@ -1,25 +1,358 @@
-import json
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
-from adapters.fhir_store import ResourceClient
+import requests
+import structlog
+from fhir.resources.domainresource import DomainResource
+from fhir.resources.fhirtypes import BundleType
+
+from adapters.fhir_store import ResourceBundle, ResourceClient, is_version_conflict
+
+log = structlog.get_logger()
+
+# Every queue mutation is a read-modify-write of the FHIR List guarded by If-Match.
+# On a version conflict the mutation is replayed on a fresh copy of the List
+# with jittered exponential backoff, so walk-in bursts no longer surface as 503.
+MAX_CONFLICT_RETRIES = 10
+CONFLICT_BACKOFF_SECONDS = 0.05
+MAX_CONFLICT_BACKOFF_SECONDS = 2.0
+
+# Patients poll their position every few seconds. Snapshots written by this process
+# are refreshed on every mutation, the TTL bounds staleness for mutations made by
+# other instances.
+QUEUE_SNAPSHOT_TTL_SECONDS = 5.0
+
+
+def entry_patient_id(entry) -> Optional[str]:
+    """Returns the patient id referenced by an entry of the List, None if it has none"""
+    if entry and entry.item and entry.item.reference:
+        return entry.item.reference.split("/")[1]
+    return None
+
+
+class PatientQueue:
+    """Ordered view of the patients in a FHIR List with a patient -> position index.
+
+    The index is built once per fetched List so that membership and position
+    lookups are O(1) instead of a scan of `entry` for every check.
+    """
+
+    def __init__(self, fhir_list: DomainResource):
+        self.fhir_list = fhir_list
+        self.patient_ids: List[str] = []
+        for entry in fhir_list.entry or []:
+            patient_id = entry_patient_id(entry)
+            if patient_id is not None:
+                self.patient_ids.append(patient_id)
+        self._positions: Dict[str, int] = {}
+        for idx, patient_id in enumerate(self.patient_ids):
+            self._positions.setdefault(patient_id, idx)
+
+    def __len__(self) -> int:
+        return len(self.patient_ids)
+
+    def __contains__(self, patient_id: str) -> bool:
+        return patient_id in self._positions
+
+    def position(self, patient_id: str) -> int:
+        """Returns the 0-based position of the patient, -1 if not in the queue"""
+        return self._positions.get(patient_id, -1)
+
+    def head(self) -> Optional[str]:
+        """Returns the patient id at the top of the queue"""
+        return self.patient_ids[0] if self.patient_ids else None
+
+
+class QueueSnapshotCache:
+    """Process wide cache of the latest known PatientQueue per list id.
+
+    Concurrent misses for the same list are collapsed into a single load.
+    """
+
+    def __init__(self, ttl: float = QUEUE_SNAPSHOT_TTL_SECONDS, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, Tuple[float, PatientQueue]] = {}
+        self._loading: Dict[str, threading.Lock] = {}
+
+    def get(self, list_id: str) -> Optional[PatientQueue]:
+        with self._lock:
+            snapshot = self._snapshots.get(list_id)
+        if snapshot is None or self._clock() - snapshot[0] > self._ttl:
+            return None
+        return snapshot[1]
+
+    def put(self, list_id: str, queue: PatientQueue):
+        with self._lock:
+            self._snapshots[list_id] = (self._clock(), queue)
+
+    def invalidate(self, list_id: str):
+        with self._lock:
+            self._snapshots.pop(list_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+
+    def get_or_load(
+        self, list_id: str, load: Callable[[], PatientQueue]
+    ) -> PatientQueue:
+        if (queue := self.get(list_id)) is not None:
+            return queue
+        with self._lock:
+            loading = self._loading.setdefault(list_id, threading.Lock())
+        with loading:
+            try:
+                if (queue := self.get(list_id)) is not None:
+                    return queue
+                queue = load()
+                self.put(list_id, queue)
+                return queue
+            finally:
+                # list ids come from requests, so the lock is only kept while
+                # loading. Callers still waiting on it find the snapshot put.
+                with self._lock:
+                    if self._loading.get(list_id) is loading:
+                        del self._loading[list_id]
+
+
+queue_snapshots = QueueSnapshotCache()
+
+
+def get_queue_list_ids() -> List[str]:
+    """Returns the ids of the walk-in queues.
+    `LIST_IDS` holds comma separated ids when the walk-in line is split into
+    several queues (e.g. per clinic or doctor pool), otherwise `LIST_ID` is the only queue.
+    """
+    if list_ids := os.getenv("LIST_IDS"):
+        return [list_id.strip() for list_id in list_ids.split(",") if list_id.strip()]
+    if list_id := os.getenv("LIST_ID"):
+        return [list_id]
+    return []
 
 
 class ListsService:
-    def __init__(self, resource_client: ResourceClient) -> None:
+    def __init__(
+        self,
+        resource_client: ResourceClient,
+        max_retries: int = MAX_CONFLICT_RETRIES,
+        backoff: float = CONFLICT_BACKOFF_SECONDS,
+        snapshots: QueueSnapshotCache = None,
+    ) -> None:
         self.resource_client = resource_client
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.snapshots = snapshots or queue_snapshots
 
-    def dequeue(self, list_id: str):
-        "for get top patient in the list"
+    def get_queue(self, list_id: str) -> PatientQueue:
+        """Returns the queue of the list, `last_seen_etag` of the client is the version of it"""
         fhir_list = self.resource_client.get_resource(list_id, "List")
-        if fhir_list.entry is None:
+        return PatientQueue(fhir_list)
+
+    def get_snapshot(self, list_id: str) -> PatientQueue:
+        """Returns the cached queue of the list for read only use such as
+        position and count polling. FHIR is only read when the snapshot is stale.
+        """
+        return self.snapshots.get_or_load(list_id, lambda: self.get_queue(list_id))
+
+    def invalidate(self, list_id: str):
+        """Drops the cached snapshot, to be called after the list was updated elsewhere"""
+        self.snapshots.invalidate(list_id)
+
+    def find_patient(self, list_ids: List[str], patient_id: str) -> Optional[str]:
+        """Returns the id of the list the patient is waiting in, based on snapshots"""
+        for list_id in list_ids:
+            if patient_id in self.get_snapshot(list_id):
+                return list_id
+        return None
+
+    def least_loaded(self, list_ids: List[str]) -> str:
+        """Returns the list with the fewest patients, the first one on ties"""
+        return min(list_ids, key=lambda list_id: len(self.get_snapshot(list_id)))
+
+    def longest(self, list_ids: List[str]) -> str:
+        """Returns the list with the most patients, the first one on ties"""
+        return max(list_ids, key=lambda list_id: len(self.get_snapshot(list_id)))
+
+    def enqueue_least_loaded(
+        self, list_ids: List[str], patient_id: str
+    ) -> Tuple[Optional[Exception], Optional[DomainResource]]:
+        """Puts the patient at the end of the shortest of the given lists.
+        Spreading patients over several lists keeps the contention on each
+        List version bounded.
+
+        :param list_ids: uuids of the candidate lists
+        :type list_ids: List[str]
+        :param patient_id: uuid for the patient
+        :type patient_id: str
+
+        :rtype: Tuple[Exception, DomainResource]
+        """
+        if not list_ids:
+            return Exception("No list is configured"), None
+        if self.find_patient(list_ids, patient_id) is not None:
+            return Exception("Patient already in the list"), None
+        list_id = self.least_loaded(list_ids)
+        other_list_ids = [x for x in list_ids if x != list_id]
+        return self.enqueue(list_id, patient_id, other_list_ids)
+
+    def enqueue(
+        self, list_id: str, patient_id: str, other_list_ids: List[str] = None
+    ) -> Tuple[Optional[Exception], Optional[DomainResource]]:
+        """Puts the patient at the end of the queue
+
+        :param list_id: uuid for the list
+        :type list_id: str
+        :param patient_id: uuid for the patient
+        :type patient_id: str
+        :param other_list_ids: uuids of lists the patient must not be waiting in,
+            read again right before every write of the list
+        :type other_list_ids: List[str]
+
+        :rtype: Tuple[Exception, DomainResource]
+        """
+
+        def append(queue: PatientQueue) -> Optional[Exception]:
+            if patient_id in queue:
+                return Exception("Patient already in the list")
+            if queue.fhir_list.entry is None:
+                queue.fhir_list.entry = []
+            queue.fhir_list.entry.append(
+                {"item": {"reference": f"Patient/{patient_id}"}}
+            )
+            return None
+
+        def check_other_lists() -> Optional[Exception]:
+            # snapshots may be seconds old, a double tap could pass them twice
+            for other_list_id in other_list_ids or []:
+                if patient_id in self.get_queue(other_list_id):
+                    return Exception("Patient already in the list")
+            return None
+
+        return self._update_with_retry(list_id, append, check_other_lists)
+
+    def remove(
+        self, list_id: str, patient_id: str
+    ) -> Tuple[Optional[Exception], Optional[DomainResource]]:
+        """Removes the patient from the queue
+
+        :param list_id: uuid for the list
+        :type list_id: str
+        :param patient_id: uuid for the patient
+        :type patient_id: str
+
+        :rtype: Tuple[Exception, DomainResource]
+        """
+
+        def drop(queue: PatientQueue) -> Optional[Exception]:
+            if patient_id not in queue:
+                return Exception("Patient not in the list")
+            queue.fhir_list.entry = [
+                e for e in queue.fhir_list.entry if entry_patient_id(e) != patient_id
+            ]
+            return None
+
+        return self._update_with_retry(list_id, drop)
+
+    def dequeue(self, list_id: str) -> Tuple[Optional[str], Optional[ResourceBundle]]:
+        """Returns the top patient in the list and the PUT bundle of the list without it.
+        The bundle is conditional on the version read, and `invalidate` has to be
+        called once it is committed.
+        """
+        queue = self.get_queue(list_id)
+        first_patient = queue.head()
+        if first_patient is None:
             return None, None
-        queue = json.loads(fhir_list.json())
-        first_patient = queue["entry"][0]["item"]["reference"].split("/")[1]
-        for idx, e in enumerate(fhir_list.entry):
-            if e.item.reference.split("/")[1] == first_patient:
-                patient_list_idx = idx
-        # remove the item of the patient from the entry
-        entry = fhir_list.entry
-        fhir_list.entry = entry[:patient_list_idx] + entry[patient_list_idx + 1 :]
-        lists = self.resource_client.get_put_bundle(fhir_list, fhir_list.id)
+        fhir_list = queue.fhir_list
+        fhir_list.entry = fhir_list.entry[1:]
+        lists = self.resource_client.get_put_bundle(
+            fhir_list, fhir_list.id, if_match=self.resource_client.last_seen_etag
+        )
 
         return first_patient, lists
+
+    def dequeue_into_transaction(
+        self,
+        list_id: str,
+        build: Callable[[str], Tuple[Optional[Exception], List[ResourceBundle]]],
+    ) -> Tuple[Optional[Exception], Optional[str], Optional[BundleType]]:
+        """Removes the top patient of the list and commits the bundles returned by
+        `build(patient_id)` in the same transaction, so that the patient leaves the
+        queue if and only if the resources are created.
+        The transaction is replayed on version conflicts like the other mutations.
+
+        :param list_id: uuid for the list
+        :type list_id: str
+        :param build: returns the bundles to commit for the dequeued patient
+        :type build: Callable[[str], Tuple[Exception, List[ResourceBundle]]]
+
+        :rtype: Tuple[Exception, str, BundleType]
+        """
+        attempt = 0
+        while True:
+            patient_id, list_bundle = self.dequeue(list_id)
+            if patient_id is None:
+                return Exception("No Patient in list"), None, None
+            lock_header = self.resource_client.last_seen_etag
+            err, bundles = build(patient_id)
+            if err is not None:
+                return err, None, None
+
+            try:
+                resp = self.resource_client.create_resources(
+                    [list_bundle] + bundles, lock_header
+                )
+                self.invalidate(list_id)
+                return None, patient_id, resp
+            except requests.HTTPError as err:
+                if not is_version_conflict(err) or attempt >= self.max_retries:
+                    raise
+                self._backoff(list_id, attempt)
+                attempt += 1
+
+    def _update_with_retry(
+        self,
+        list_id: str,
+        mutate: Callable[[PatientQueue], Optional[Exception]],
+        check: Callable[[], Optional[Exception]] = None,
+    ) -> Tuple[Optional[Exception], Optional[DomainResource]]:
+        """Applies `mutate` on the latest version of the list and writes it back with
+        optimistic locking, replaying the mutation on version conflicts.
+        `check` runs before every read of the list and aborts the update on error.
+        The last conflict is raised once `max_retries` is exhausted.
+        """
+        attempt = 0
+        while True:
+            if check is not None and (err := check()) is not None:
+                return err, None
+            queue = self.get_queue(list_id)
+            if (err := mutate(queue)) is not None:
+                return err, None
+
+            lock_header = self.resource_client.last_seen_etag
+            try:
+                fhir_list = self.resource_client.put_resource(
+                    queue.fhir_list.id, queue.fhir_list, lock_header
+                )
+                self.snapshots.put(list_id, PatientQueue(fhir_list))
+                return None, fhir_list
+            except requests.HTTPError as err:
+                if not is_version_conflict(err) or attempt >= self.max_retries:
+                    raise
+                self._backoff(list_id, attempt)
+                attempt += 1
+
+    def _backoff(self, list_id: str, attempt: int):
+        delay = (
+            min(self.backoff * (2**attempt), MAX_CONFLICT_BACKOFF_SECONDS)
+            * random.random()
+        )
+        log.info(
+            f"version conflict on List/{list_id}, retrying in {delay:.3f}s",
+            attempt=attempt + 1,
+        )
+        time.sleep(delay)
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import structlog
+from firebase_admin import firestore
+
+from adapters.fire_store import FireStoreClient, get_firestore_client
+
+log = structlog.get_logger()
+
+PROCESSED_PUBSUB_MESSAGES = "processed_pubsub_messages"
+
+# Pub/Sub does not redeliver a message after its retention, 7 days at most.
+# The expire_at field of the entries can be used as a Firestore TTL policy.
+LEDGER_TTL_SECONDS = 7 * 24 * 60 * 60
+# A claim older than this is considered abandoned by a recycled instance
+CLAIM_TIMEOUT_SECONDS = 10 * 60
+LEDGER_CACHE_SIZE = 4096
+
+MESSAGE_CLAIMED = "claimed"
+MESSAGE_DUPLICATE = "duplicate"
+MESSAGE_IN_PROGRESS = "in_progress"
+
+PROCESSING = "processing"
+DONE = "done"
+
+
+class MessageLedger:
+    """Records the Pub/Sub messages that were processed, to drop redeliveries
+
+    Pub/Sub redelivers a message with the same message id when it is not acked in
+    time. A message is claimed before any work and completed once processed, so a
+    redelivery of a completed message is a duplicate, and a redelivery of a message
+    still being processed is reported in progress to be retried later. Completed
+    ids are also kept in an in-process LRU in front of Firestore.
+    """
+
+    def __init__(
+        self,
+        firestore_client: FireStoreClient = None,
+        ttl: float = LEDGER_TTL_SECONDS,
+        claim_timeout: float = CLAIM_TIMEOUT_SECONDS,
+        max_size: int = LEDGER_CACHE_SIZE,
+    ):
+        self._firestore_client = firestore_client
+        self._ttl = ttl
+        self._claim_timeout = claim_timeout
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._done: "OrderedDict[str, float]" = OrderedDict()
+        self._messages = 0
+        self._duplicates = 0
+
+    @property
+    def firestore_client(self) -> FireStoreClient:
+        if self._firestore_client is None:
+            self._firestore_client = get_firestore_client()
+        return self._firestore_client
+
+    def claim(self, message_id: str) -> str:
+        """Claims the message for processing
+
+        :returns: MESSAGE_CLAIMED, MESSAGE_DUPLICATE or MESSAGE_IN_PROGRESS
+        """
+        with self._lock:
+            self._messages += 1
+            done_at = self._done.get(message_id)
+            if done_at is not None and time.monotonic() - done_at < self._ttl:
+                return self._duplicate(message_id, MESSAGE_DUPLICATE)
+
+        ref = self._ref(message_id)
+        now = datetime.now(timezone.utc)
+        expired_before = now - timedelta(seconds=self._ttl)
+        abandoned_before = now - timedelta(seconds=self._claim_timeout)
+
+        @firestore.transactional
+        def claim_in_transaction(transaction) -> str:
+            snapshot = ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.get("claimed_at") > expired_before:
+                if snapshot.get("status") == DONE:
+                    return MESSAGE_DUPLICATE
+                if snapshot.get("claimed_at") > abandoned_before:
+                    return MESSAGE_IN_PROGRESS
+            transaction.set(
+                ref,
+                {
+                    "status": PROCESSING,
+                    "claimed_at": now,
+                    "expire_at": now + timedelta(seconds=self._ttl),
+                },
+            )
+            return MESSAGE_CLAIMED
+
+        result = claim_in_transaction(self.firestore_client.client.transaction())
+        if result == MESSAGE_DUPLICATE:
+            self._remember(message_id)
+        if result != MESSAGE_CLAIMED:
+            with self._lock:
+                return self._duplicate(message_id, result)
+        return result
+
+    def complete(self, message_id: str):
+        self._ref(message_id).update({"status": DONE})
+        self._remember(message_id)
+
+    def release(self, message_id: str):
+        """Forgets the claim so that the redelivery of a failed message is processed"""
+        self._ref(message_id).delete()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "messages": self._messages,
+                "duplicates": self._duplicates,
+                "duplicate_rate": round(self._duplicates / self._messages, 4)
+                if self._messages
+                else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._done.clear()
+            self._messages = 0
+            self._duplicates = 0
+
+    def _duplicate(self, message_id: str, result: str) -> str:
+        self._duplicates += 1
+        log.info(
+            f"pub/sub message {message_id} is a redelivery",
+            result=result,
+            messages=self._messages,
+            duplicates=self._duplicates,
+            duplicate_rate=round(self._duplicates / self._messages, 4),
+        )
+        return result
+
+    def _ref(self, message_id: str):
+        return self.firestore_client.get_collection(PROCESSED_PUBSUB_MESSAGES).document(
+            message_id
+        )
+
+    def _remember(self, message_id: str):
+        with self._lock:
+            self._done[message_id] = time.monotonic()
+            self._done.move_to_end(message_id)
+            while len(self._done) > self._max_size:
+                self._done.popitem(last=False)
+
+
+pubsub_message_ledger = MessageLedger()
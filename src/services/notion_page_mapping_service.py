@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from adapters.fire_store import FireStoreClient, get_firestore_client
+
+NOTION_ENCOUNTER_PAGES = "notion_encounter_pages"
+
+# Page ids never change once created, so the mapping is only bounded by memory.
+# Recent encounters are the ones that keep getting notifications.
+ENCOUNTER_PAGE_CACHE_SIZE = 2048
+
+
+class EncounterPageMapping:
+    """Mapping from encounter id to the id of its Notion page
+
+    Lookups hit an in-process LRU first and fall back to Firestore, which is shared
+    by all instances and survives restarts. Documents are keyed by database and
+    encounter so that environments sharing a Firestore project do not see or
+    overwrite each other's pages.
+    """
+
+    def __init__(
+        self,
+        firestore_client: FireStoreClient = None,
+        max_size: int = ENCOUNTER_PAGE_CACHE_SIZE,
+    ):
+        self._firestore_client = firestore_client
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[tuple, str]" = OrderedDict()
+
+    @property
+    def firestore_client(self) -> FireStoreClient:
+        if self._firestore_client is None:
+            self._firestore_client = get_firestore_client()
+        return self._firestore_client
+
+    def get(self, database_id: str, encounter_id: str) -> Optional[str]:
+        key = (database_id, encounter_id)
+        with self._lock:
+            page_id = self._pages.get(key)
+            if page_id is not None:
+                self._pages.move_to_end(key)
+                return page_id
+
+        snapshot = (
+            self.firestore_client.get_collection(NOTION_ENCOUNTER_PAGES)
+            .document(_document_id(database_id, encounter_id))
+            .get()
+        )
+        if not snapshot.exists:
+            return None
+        value = snapshot.to_dict()
+        self._remember(key, value["page_id"])
+        return value["page_id"]
+
+    def put(self, database_id: str, encounter_id: str, page_id: str):
+        self.firestore_client.add_value(
+            NOTION_ENCOUNTER_PAGES,
+            {
+                "database_id": database_id,
+                "encounter_id": encounter_id,
+                "page_id": page_id,
+            },
+            _document_id(database_id, encounter_id),
+        )
+        self._remember((database_id, encounter_id), page_id)
+
+    def invalidate(self, database_id: str, encounter_id: str):
+        with self._lock:
+            self._pages.pop((database_id, encounter_id), None)
+        self.firestore_client.get_collection(NOTION_ENCOUNTER_PAGES).document(
+            _document_id(database_id, encounter_id)
+        ).delete()
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def _remember(self, key: tuple, page_id: str):
+        with self._lock:
+            self._pages[key] = page_id
+            self._pages.move_to_end(key)
+            while len(self._pages) > self._max_size:
+                self._pages.popitem(last=False)
+
+
+def _document_id(database_id: str, encounter_id: str) -> str:
+    return f"{database_id}_{encounter_id}"
+
+
+encounter_page_mapping = EncounterPageMapping()
@@ -1,8 +1,14 @@
 import base64
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from enum import Enum, auto
-from typing import Optional
+from typing import Callable, Dict, Optional, Tuple
 
+import structlog
 from fhir.resources.account import Account
 from fhir.resources.appointment import Appointment
 from fhir.resources.documentreference import DocumentReference
@@ -10,12 +16,24 @@ from fhir.resources.medicationrequest import MedicationRequest
 from fhir.resources.patient import Patient
 from fhir.resources.practitionerrole import PractitionerRole
 from fhir.resources.servicerequest import ServiceRequest
-from notion_client import Client
-
+from notion_client import APIErrorCode, APIResponseError, Client
+
+from adapters.notion_writer import NotionWriter, get_notion_writer
+from services.notion_page_mapping_service import (
+    ENCOUNTER_PAGE_CACHE_SIZE,
+    EncounterPageMapping,
+    encounter_page_mapping,
+)
 from utils.notion_setup import NotionSingleton
 
+log = structlog.get_logger()
+
 ENCOUNTER_DATABASE_ID = os.getenv("NOTION_ENCOUNTER_DATABASE_ID")
 
+# Long enough to cover the notifications of one update of an encounter, short
+# enough that a page changed by another instance or by hand is soon rewritten.
+SYNCED_PROPERTY_HASH_TTL_SECONDS = 60
+
 
 class NotionClientDoesNotExistException(Exception):
     pass
@@ -25,11 +43,65 @@ class NotionDBDoesNotExistException(Exception):
     pass
 
 
+class SyncedPropertyHashes:
+    """Hashes of the property values last written to each page, bounded as LRU
+
+    The hashes are only a hint of this process: another instance or a manual edit
+    may have changed the page since. Entries expire after the TTL, so a page that
+    was changed elsewhere is fully written again by the next sync after it, and
+    the hashes still skip the unchanged properties of a burst of notifications.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SYNCED_PROPERTY_HASH_TTL_SECONDS,
+        max_size: int = ENCOUNTER_PAGE_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[str, Tuple[float, Dict[str, str]]]" = OrderedDict()
+
+    def get(self, page_id: str) -> Dict[str, str]:
+        with self._lock:
+            entry = self._pages.get(page_id)
+            if entry is None:
+                return {}
+            if self._clock() >= entry[0]:
+                del self._pages[page_id]
+                return {}
+            self._pages.move_to_end(page_id)
+            return dict(entry[1])
+
+    def put(self, page_id: str, hashes: Dict[str, str]):
+        with self._lock:
+            self._pages[page_id] = (self._clock() + self._ttl, hashes)
+            self._pages.move_to_end(page_id)
+            while len(self._pages) > self._max_size:
+                self._pages.popitem(last=False)
+
+    def invalidate(self, page_id: str):
+        with self._lock:
+            self._pages.pop(page_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+synced_property_hashes = SyncedPropertyHashes()
+
+
 class NotionService:
     def __init__(
         self,
         client: Client = None,
         encounter_database_id: str = None,
+        page_mapping: EncounterPageMapping = None,
+        writer: NotionWriter = None,
+        synced_hashes: SyncedPropertyHashes = None,
     ) -> None:
         self._client = client or NotionSingleton.client()
         if self._client is None:
@@ -39,15 +111,18 @@ class NotionService:
             raise NotionDBDoesNotExistException(
                 "Notion encounter database ID cannot be None"
             )
+        self._page_mapping = page_mapping or encounter_page_mapping
+        self._writer = writer or get_notion_writer(self._client)
+        self._synced_hashes = synced_hashes or synced_property_hashes
 
     def query_encounter_page(self, encounter_id: str):
-        return self._client.databases.query(
+        return self._writer.query_database(
             database_id=self._encounter_database_id,
             filter={"property": "encounter_id", "rich_text": {"equals": encounter_id}},
         )
 
     def create_encounter_page(self, encounter_id: str):
-        return self._client.pages.create(
+        return self._writer.create_page(
             parent={"database_id": self._encounter_database_id},
             properties={
                 "encounter_id": {
@@ -56,6 +131,41 @@ class NotionService:
             },
         )
 
+    def get_encounter_page_id(self, encounter_id: str) -> str:
+        """Returns the id of the page of the encounter, creating the page if needed
+
+        Notion database queries are slow and rate limited, so the page id is
+        looked up in the page mapping first and only queried once per encounter.
+        """
+        database_id = self._encounter_database_id
+        page_id = self._page_mapping.get(database_id, encounter_id)
+        if page_id is not None:
+            return page_id
+
+        results = self.query_encounter_page(encounter_id=encounter_id)["results"]
+        if len(results) == 0:
+            page = self.create_encounter_page(encounter_id=encounter_id)
+        else:
+            page = results[0]
+        self._page_mapping.put(database_id, encounter_id, page["id"])
+        return page["id"]
+
+    def sync_encounter(self, encounter_id: str, **resources) -> str:
+        """Syncs the resources to the page of the encounter and returns the page id"""
+        page_id = self.get_encounter_page_id(encounter_id)
+        try:
+            self.sync_encounter_to_notion(encounter_page_id=page_id, **resources)
+        except APIResponseError as e:
+            if e.code != APIErrorCode.ObjectNotFound:
+                raise
+            # the page was deleted in Notion since it was mapped
+            self._synced_hashes.invalidate(page_id)
+            self._page_mapping.invalidate(self._encounter_database_id, encounter_id)
+            page_id = self.get_encounter_page_id(encounter_id)
+            self.sync_encounter_to_notion(encounter_page_id=page_id, **resources)
+        log.info(f"synced notion page {page_id}", **self._writer.stats())
+        return page_id
+
     def sync_encounter_to_notion(
         self,
         encounter_page_id: str,
@@ -98,7 +208,6 @@ class NotionService:
         )
         properties["dob"] = get_propery_value(dob)
         properties["address"] = get_propery_value(self._render_address(patient))
-        properties["emr"] = get_propery_value(self._render_emr(clinical_note))
 
         # We use PractitionerRole instead of the Practitioner since the result
         # from the search bundle is only PractitionerRole. The "practitioner"
@@ -114,15 +223,6 @@ class NotionService:
             else self._find_attachment(insurance_card, "front").url
         )
         properties["insurance_card_front"] = get_propery_value(insurance_card_front)
-        medical_card_attachments = ""
-        if medical_card is not None:
-            page = 0
-            attachment = self._find_attachment(medical_card, f"Page {page}")
-            while attachment:
-                medical_card_attachments += attachment.url + "\n"
-                page += 1
-                attachment = self._find_attachment(medical_card, f"Page {page}")
-        properties["medical_card"] = get_propery_value(medical_card_attachments)
         account_id = "" if account is None else account.id
         properties["account_id"] = get_propery_value(account_id)
         properties["prescription"] = get_propery_value(
@@ -132,9 +232,39 @@ class NotionService:
             self._render_service_codes(service_request)
         )
 
-        return self._client.pages.update(
-            page_id=encounter_page_id, properties=properties
-        )
+        # Documents are fingerprinted instead of rendered, so that the clinical
+        # note is only decoded when it changed since the last sync of the page.
+        documents = {
+            "emr": (clinical_note, self._render_emr),
+            "medical_card": (medical_card, self._render_medical_card),
+        }
+
+        synced = self._synced_hashes.get(encounter_page_id)
+        hashes = {name: _hash_value(value) for name, value in properties.items()}
+        changed = {
+            name: value
+            for name, value in properties.items()
+            if synced.get(name) != hashes[name]
+        }
+        for name, (document, render) in documents.items():
+            hashes[name] = _fingerprint_document(document)
+            if synced.get(name) != hashes[name]:
+                changed[name] = get_propery_value(render(document))
+
+        if not changed:
+            log.info(f"notion page {encounter_page_id} is up to date")
+            return None
+
+        try:
+            response = self._writer.update_page(
+                page_id=encounter_page_id, properties=changed
+            )
+        except Exception:
+            # the page may be partly written, the next sync sends every property
+            self._synced_hashes.invalidate(encounter_page_id)
+            raise
+        self._synced_hashes.put(encounter_page_id, hashes)
+        return response
 
     def _render_email(self, patient: Optional[Patient]):
         if patient is None:
@@ -212,6 +342,19 @@ class NotionService:
             ]
         )
 
+    def _render_medical_card(self, medical_card: Optional[DocumentReference]):
+        if medical_card is None:
+            return ""
+
+        medical_card_attachments = ""
+        page = 0
+        attachment = self._find_attachment(medical_card, f"Page {page}")
+        while attachment:
+            medical_card_attachments += attachment.url + "\n"
+            page += 1
+            attachment = self._find_attachment(medical_card, f"Page {page}")
+        return medical_card_attachments
+
     def _find_attachment(self, document_reference: DocumentReference, title: str):
         attachment = next(
             (
@@ -245,6 +388,25 @@ class NotionService:
         return "\n".join([x.display for x in coding_list])
 
 
+def _hash_value(value) -> str:
+    serialized = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _fingerprint_document(document: Optional[DocumentReference]) -> str:
+    """Identifies the content of a document without decoding its attachments"""
+    if document is None:
+        return ""
+    if document.meta is not None and document.meta.versionId is not None:
+        return f"{document.id}/{document.meta.versionId}"
+    return _hash_value(
+        [
+            [x.attachment.title, x.attachment.url, str(x.attachment.data)]
+            for x in document.content
+        ]
+    )
+
+
 class PropertyType(Enum):
     Text = auto()
     Date = auto()
@@ -1,7 +1,14 @@
 from datetime import datetime
 from uuid import UUID
 
-from adapters.fire_store import FireStoreClient
+from google.api_core.exceptions import NotFound
+
+from adapters.fire_store import (
+    FireStoreBatchWriter,
+    FireStoreClient,
+    get_batch_writer,
+    get_firestore_client,
+)
 
 CALLING_STATUS = "calling"
 CREATED_STATUS = "created"
@@ -9,32 +16,47 @@ PATIENT_CALL_LOGS = "patient_call_logs"
 
 
 class PatientCallLogsService:
-    def __init__(self, firestore_client=None):
-        self.firestore_client = firestore_client or FireStoreClient()
+    def __init__(
+        self,
+        firestore_client: FireStoreClient = None,
+        writer: FireStoreBatchWriter = None,
+    ):
+        if firestore_client is None:
+            self.firestore_client = get_firestore_client()
+            self.writer = writer or get_batch_writer()
+        else:
+            self.firestore_client = firestore_client
+            self.writer = writer or FireStoreBatchWriter(firestore_client)
+
+    def upsert_call_docs(
+        self, appointment_id: UUID, patient_id: UUID, status: str = CREATED_STATUS
+    ) -> tuple:
+        """Writes the call log of the appointment in a single write
 
-    def upsert_call_docs(self, appointment_id: UUID, patient_id: UUID) -> tuple:
-        call_ref = self.firestore_client.get_collection(PATIENT_CALL_LOGS)
-        call_log_collection = call_ref.where(
-            "appointment_id", "==", appointment_id
-        ).stream()
-        call_log_data = [{**doc.to_dict(), "id": doc.id} for doc in call_log_collection]
+        The log document id is the appointment id, so the log is written without
+        looking it up first. The log of a new appointment is timestamped, calls
+        update the log and keep the timestamp of the booking, unless the
+        appointment has no log yet and the log is created with the call.
+        """
+        value = {
+            "patient_id": patient_id,
+            "status": status,
+            "appointment_id": appointment_id,
+        }
 
         try:
-            if call_log_data:
-                for log in call_log_data:
-                    self.firestore_client.update_value(
-                        PATIENT_CALL_LOGS, log["id"], {"status": CALLING_STATUS}
-                    )
-            else:
-                value = {
-                    "patient_id": patient_id,
-                    "status": CREATED_STATUS,
-                    "appointment_id": appointment_id,
-                    "timestamp": datetime.now(),
-                }
-                self.firestore_client.add_value(
-                    PATIENT_CALL_LOGS, value, appointment_id
-                )
+            if status != CREATED_STATUS:
+                try:
+                    self.writer.update(
+                        PATIENT_CALL_LOGS, appointment_id, value
+                    ).result()
+                    return None, "Successfully saved call logs."
+                except NotFound:
+                    pass
+            value["timestamp"] = datetime.now()
+            self.writer.set(
+                PATIENT_CALL_LOGS, appointment_id, value, merge=True
+            ).result()
             return None, "Successfully saved call logs."
         except Exception as err:
             return f"Error while saving call logs: {err}", None
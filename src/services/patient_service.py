@@ -79,17 +79,16 @@ class PatientService:
 
         return None, voip_token_value
 
-    def get_patient_payment_details(
-        self, patient_id: UUID
+    def get_payment_details(
+        self, patient: DomainResource
     ) -> tuple[Optional[Exception], Optional[tuple]]:
-        """Returns patient payment detaisl
+        """Returns the stripe customer and payment method ids of a fetched patient
 
-        :param patient_id: uuid for patient
-        :type patient_id: uuid
+        :param patient: the patient resource
+        :type patient: DomainResource
 
         :rtype: tuple
         """
-        patient = self.resource_client.get_resource(patient_id, "Patient")
         if patient.extension is None:
             return Exception(f"No extension is added with patient: {patient.id}"), None
         customer_ids = list(
@@ -251,7 +250,9 @@ class PatientService:
             return address.postalCode
         return ""
 
-    def put_orca_id_for_patient(self, orca_id: str, patient_id: UUID) -> Tuple[Optional[Exception], DomainResource]:
+    def put_orca_id_for_patient(
+        self, orca_id: str, patient_id: UUID
+    ) -> Tuple[Optional[Exception], DomainResource]:
         resource = self.resource_client.get_resource(patient_id, "Patient")
         patient = Patient(**resource.dict())
         patient.extension = [
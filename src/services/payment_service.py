@@ -4,6 +4,7 @@ from typing import Optional
 import stripe
 
 from adapters.fhir_store import ResourceClient
+from services.stripe_cache_service import PAYMENT_INTENTS, stripe_read_cache
 
 log = structlog.get_logger()
 
@@ -49,3 +50,6 @@ class PaymentService:
         ) as e:
             err = e.error
             return Exception(err.message), None
+        finally:
+            # the new intent is listed in the payment history of the customer
+            stripe_read_cache.invalidate(PAYMENT_INTENTS, customer_id)
@@ -1,23 +1,66 @@
-import json
+import threading
+import time
 import uuid
 from datetime import datetime
 from typing import Dict, List, Optional, Set, Tuple, TypedDict
 
-import pandas as pd
 from fhir.resources import construct_fhir_element
 from fhir.resources.domainresource import DomainResource
 
 from adapters.fhir_store import ResourceClient
 from utils.system_code import ServiceURL, SystemCode
 
+# Roles change rarely (schedule edits by staff) while walk-in booking reads them on
+# every dequeue, so the lookups by practitioner are cached for a short while.
+PRACTITIONER_ROLE_TTL_SECONDS = 60.0
+
 
 class AvailableTime(TypedDict):
     ...
 
 
+class PractitionerRoleDirectory:
+    """Process wide cache of PractitionerRole resources by practitioner id"""
+
+    def __init__(
+        self, ttl: float = PRACTITIONER_ROLE_TTL_SECONDS, clock=time.monotonic
+    ):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._roles: Dict[str, Tuple[float, DomainResource]] = {}
+
+    def get(self, practitioner_id: str) -> Optional[DomainResource]:
+        with self._lock:
+            cached = self._roles.get(practitioner_id)
+        if cached is None or self._clock() - cached[0] > self._ttl:
+            return None
+        return cached[1]
+
+    def put(self, practitioner_id: str, role: DomainResource):
+        with self._lock:
+            self._roles[practitioner_id] = (self._clock(), role)
+
+    def invalidate(self, practitioner_id: str):
+        with self._lock:
+            self._roles.pop(practitioner_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._roles.clear()
+
+
+practitioner_role_directory = PractitionerRoleDirectory()
+
+
 class PractitionerRoleService:
-    def __init__(self, resource_client: ResourceClient) -> None:
+    def __init__(
+        self,
+        resource_client: ResourceClient,
+        directory: PractitionerRoleDirectory = None,
+    ) -> None:
         self.resource_client = resource_client
+        self.directory = directory or practitioner_role_directory
 
     def create_practitioner_role(
         self,
@@ -179,25 +222,62 @@ class PractitionerRoleService:
                 return None, practitioner_name_list[0].dict()
         return Exception("No item found"), None
 
-    def schedule_is_available_for_doctor(
-        self, role_id: uuid, start_time: datetime, end_time: datetime
-    ):
-        search_clause = [
-            ("_id", role_id),
-            ("active", str(True)),
-            ("coding", "walk-in"),
-        ]
-        practitioner_role = self.resource_client.search(
-            "PractitionerRole", search_clause
-        )
-        practitioner_role_json = json.loads(practitioner_role.json())
-        available_time = practitioner_role_json["entry"][0]["resource"]["availableTime"]
-        available_time_start = datetime.strftime(
-            pd.to_datetime(available_time[0]["availableStartTime"]), "%H:%M:00"
-        )
-        available_time_end = datetime.strftime(
-            pd.to_datetime(available_time[0]["availableEndTime"]), "%H:%M:00"
+    def get_role_by_practitioner(
+        self, practitioner_id: str
+    ) -> Optional[DomainResource]:
+        """Returns the practitioner role of the practitioner, served from the directory
+        when it was looked up within `PRACTITIONER_ROLE_TTL_SECONDS`.
+
+        :param practitioner_id: uuid for practitioner
+        :type practitioner_id: str
+
+        :rtype: Optional[DomainResource]
+        """
+        if (role := self.directory.get(practitioner_id)) is not None:
+            return role
+
+        practitioner_roles = self.resource_client.search(
+            "PractitionerRole", [("practitioner", practitioner_id)]
         )
+        if not practitioner_roles.entry:
+            return None
+        role = practitioner_roles.entry[0].resource
+        self.directory.put(practitioner_id, role)
+        return role
+
+    @staticmethod
+    def is_available_for_walk_in(
+        practitioner_role: DomainResource, start_time: datetime, end_time: datetime
+    ) -> bool:
+        """Returns True if both start and end fall in the first available time
+        of an active practitioner role with the walk-in visit type, compared at
+        minute precision.
+
+        :param practitioner_role: practitioner role to check
+        :type practitioner_role: DomainResource
+        :param start_time: start of the walk-in appointment
+        :type start_time: datetime
+        :param end_time: end of the walk-in appointment
+        :type end_time: datetime
+
+        :rtype: bool
+        """
+        if not practitioner_role.active or not practitioner_role.availableTime:
+            return False
+        if not any(
+            coding.code == "walk-in"
+            for code in practitioner_role.code or []
+            for coding in code.coding or []
+        ):
+            return False
+        available_time = practitioner_role.availableTime[0]
+        if (
+            available_time.availableStartTime is None
+            or available_time.availableEndTime is None
+        ):
+            return False
+        available_time_start = available_time.availableStartTime.strftime("%H:%M:00")
+        available_time_end = available_time.availableEndTime.strftime("%H:%M:00")
         start_time_str = start_time.strftime("%H:%M:00")
         end_time_str = end_time.strftime("%H:%M:00")
         return (
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# The checkout page reads the same customer, payment methods and intents several
+# times within a few seconds. Anything changed by this backend is invalidated
+# explicitly, the TTL only bounds changes made elsewhere (dashboard, webhooks).
+STRIPE_CACHE_TTL_SECONDS = 30
+STRIPE_CACHE_SIZE = 1024
+# A setup intent is confirmed by the frontend, so the payment methods of its
+# customer are not cached until it had time to complete.
+SETUP_INTENT_WINDOW_SECONDS = 15 * 60
+
+CUSTOMER = "customer"
+PAYMENT_METHODS = "payment_methods"
+PAYMENT_METHOD = "payment_method"
+PAYMENT_INTENTS = "payment_intents"
+
+
+class StripeReadCache:
+    """Short lived LRU of Stripe objects read by the payment endpoints
+
+    Entries are keyed by (kind, Stripe object id), lists by the id of their
+    customer. Loads that fail are not cached.
+    """
+
+    def __init__(
+        self,
+        ttl: float = STRIPE_CACHE_TTL_SECONDS,
+        max_size: int = STRIPE_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = (
+            OrderedDict()
+        )
+        self._uncached_until: Dict[Tuple[str, Hashable], float] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, kind: str, object_id: Hashable, load: Callable[[], Any]) -> Any:
+        key = (kind, object_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() < entry[0]:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+
+        value = load()
+        with self._lock:
+            now = self._clock()
+            if self._uncached_until.get(key, 0) > now:
+                return value
+            self._uncached_until.pop(key, None)
+            self._entries[key] = (now + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, kind: str, object_id: Hashable):
+        with self._lock:
+            self._entries.pop((kind, object_id), None)
+
+    def invalidate_where(self, kind: str, predicate: Callable[[Any], bool]):
+        """Invalidates the entries of the kind whose value matches the predicate"""
+        with self._lock:
+            keys = [
+                key
+                for key, (_, value) in self._entries.items()
+                if key[0] == kind and predicate(value)
+            ]
+            for key in keys:
+                del self._entries[key]
+
+    def uncache(self, kind: str, object_id: Hashable, seconds: float):
+        """Invalidates the entry and does not cache it for the given time"""
+        with self._lock:
+            now = self._clock()
+            self._entries.pop((kind, object_id), None)
+            for key in [k for k, t in self._uncached_until.items() if t <= now]:
+                del self._uncached_until[key]
+            self._uncached_until[(kind, object_id)] = now + seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._uncached_until.clear()
+            self._hits = 0
+            self._misses = 0
+
+
+stripe_read_cache = StripeReadCache()
@@ -8,11 +8,21 @@ from firebase_admin import auth as firebase_auth
 from flask import Response, request
 
 from utils import role_auth
+from utils.token_cache import verified_token_cache
 
 default_app = firebase_admin.initialize_app()
 log = structlog.get_logger()
 
 
+def verify_id_token(token: str) -> dict:
+    """Verifies the token and that its user is neither disabled nor revoked
+
+    Checking the revocation reads the user from Firebase, which the token cache
+    limits to once per token and TTL.
+    """
+    return firebase_auth.verify_id_token(token, check_revoked=True)
+
+
 def jwt_authenticated(email_validation: bool = False):
     """Decorator function to authenticate the user.
 
@@ -25,12 +35,11 @@ def jwt_authenticated(email_validation: bool = False):
     def decorator(func: Callable[..., int]) -> Callable[..., int]:
         @wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
-
             header = request.headers.get("Authorization", None)
             if header:
                 token = header.split(" ")[1]
                 try:
-                    decoded_token = firebase_auth.verify_id_token(token)
+                    decoded_token = verified_token_cache.verify(token, verify_id_token)
                 except Exception as e:
                     log.error(e)
                     return Response(
@@ -0,0 +1,309 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ADDRESS_DATA_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "address")
+)
+POSTAL_INDEX_PATH = os.path.join(ADDRESS_DATA_PATH, "postal_index.bin")
+
+MAGIC = b"KZIPIDX1"
+NO_STRING = 0xFFFFFFFF
+AREA_ONLY = 0x80000000
+
+# Sections of the index, in file order, with the array type of their items.
+# zips: sorted postal codes as integers
+# prefs: prefecture id of each postal code
+# cities/areas/streets: string id of each postal code, NO_STRING when missing
+# names: first position of each city + area and each area name, preferring the
+#     codes without a street, sorted by the normalized name. AREA_ONLY is set on
+#     the entries of the area names.
+# places: every position, sorted by prefecture, normalized city and area without
+#     its parenthesized note, then postal code
+# string_offsets/strings: interned utf-8 strings, string i is
+#     strings[string_offsets[i]:string_offsets[i + 1]]
+SECTIONS = [
+    ("zips", "I"),
+    ("prefs", "B"),
+    ("cities", "I"),
+    ("areas", "I"),
+    ("streets", "I"),
+    ("names", "I"),
+    ("places", "I"),
+    ("string_offsets", "I"),
+    ("strings", "B"),
+]
+
+# magic, number of sections, then (name, offset, length in bytes) per section
+_HEADER = struct.Struct("<8sI")
+_SECTION = struct.Struct("<16sII")
+
+Address = Tuple[int, str, str, Optional[str]]
+
+
+class PostalIndex:
+    """Postal codes to addresses, read in place from a compact binary buffer
+
+    Postal codes are a sorted array of integers, so a lookup is a binary search
+    with no parsing and no file I/O once the buffer is mapped. Every city, area
+    and street name is stored once in an interned string table.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("not a postal index")
+        self._sections = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(
+                view, _HEADER.size + i * _SECTION.size
+            )
+            self._sections[name.rstrip(b"\0").decode()] = (offset, length)
+        for name, item_type in SECTIONS:
+            offset, length = self._sections[name]
+            setattr(self, f"_{name}", view[offset : offset + length].cast(item_type))
+
+    @classmethod
+    def load(cls, path: str = POSTAL_INDEX_PATH) -> "PostalIndex":
+        """Maps the prebuilt index file, its pages are shared by all processes"""
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_source(cls, source_path: str = ADDRESS_DATA_PATH) -> "PostalIndex":
+        return cls(build_postal_index(source_path))
+
+    def __len__(self) -> int:
+        return len(self._zips)
+
+    def lookup(self, code: str) -> Optional[Address]:
+        """Returns the prefecture id, city, area and street of a 7 digit code"""
+        i = self.position(code)
+        if i is None:
+            return None
+        return self.address_at(i)
+
+    def position(self, code: str) -> Optional[int]:
+        value = int(code)
+        i = bisect_left(self._zips, value)
+        if i == len(self._zips) or self._zips[i] != value:
+            return None
+        return i
+
+    def address_at(self, i: int) -> Address:
+        street = self._streets[i]
+        return (
+            self._prefs[i],
+            self.string(self._cities[i]),
+            self.string(self._areas[i]),
+            None if street == NO_STRING else self.string(street),
+        )
+
+    def code_at(self, i: int) -> str:
+        return f"{self._zips[i]:07d}"
+
+    def pref_at(self, i: int) -> int:
+        return self._prefs[i]
+
+    def codes_with_prefix(self, digits: str) -> range:
+        """Returns the positions of the postal codes starting with the digits"""
+        scale = 10 ** (7 - len(digits))
+        low = int(digits) * scale
+        return range(bisect_left(self._zips, low), bisect_left(self._zips, low + scale))
+
+    def names_with_prefix(self, prefix: str) -> Iterator[Tuple[int, bool]]:
+        """Yields the first position of each city and area name starting with the
+        prefix in the order of the names, and whether only the area name matched
+        """
+        prefix = normalize_name(prefix)
+        low, high = 0, len(self._names)
+        while low < high:
+            middle = (low + high) // 2
+            if self._name(self._names[middle]) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        for i in range(low, len(self._names)):
+            entry = self._names[i]
+            if not self._name(entry).startswith(prefix):
+                return
+            yield entry & ~AREA_ONLY, bool(entry & AREA_ONLY)
+
+    def codes_in(self, pref_id: int, city: str, area: str = None) -> List[int]:
+        """Returns the positions of the postal codes of a city, or of an area of the
+        city, in postal code order within each area
+        """
+        key = (pref_id, normalize_name(city))
+        if area is not None:
+            key += (place_area(area),)
+        low, high = 0, len(self._places)
+        while low < high:
+            middle = (low + high) // 2
+            if self._place(self._places[middle])[: len(key)] < key:
+                low = middle + 1
+            else:
+                high = middle
+        positions = []
+        for i in range(low, len(self._places)):
+            row = self._places[i]
+            if self._place(row)[: len(key)] != key:
+                break
+            positions.append(row)
+        return positions
+
+    def _place(self, row: int) -> Tuple[int, str, str]:
+        return (
+            self._prefs[row],
+            normalize_name(self.string(self._cities[row])),
+            place_area(self.string(self._areas[row])),
+        )
+
+    def _name(self, entry: int) -> str:
+        row = entry & ~AREA_ONLY
+        area = self.string(self._areas[row])
+        if entry & AREA_ONLY:
+            return normalize_name(area)
+        return normalize_name(self.string(self._cities[row]) + area)
+
+    def string(self, string_id: int) -> str:
+        start = self._string_offsets[string_id]
+        end = self._string_offsets[string_id + 1]
+        return bytes(self._strings[start:end]).decode("utf-8")
+
+
+def normalize_name(name: str) -> str:
+    """Folds full and half width characters, the data has full width digits"""
+    return unicodedata.normalize("NFKC", name)
+
+
+def place_area(area: str) -> str:
+    """Drops the note of an area name, 丸の内（次のビルを除く） is 丸の内"""
+    return normalize_name(area).split("(")[0]
+
+
+def read_source(source_path: str = ADDRESS_DATA_PATH) -> Dict[str, list]:
+    """Returns the records of every zip-XXX.json file by postal code"""
+    records = {}
+    for path in sorted(glob.glob(os.path.join(source_path, "zip-*.json"))):
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        if content.strip():
+            records.update(json.loads(content))
+    return records
+
+
+def build_postal_index(source_path: str = ADDRESS_DATA_PATH) -> bytes:
+    """Builds the binary index from the zip-XXX.json files"""
+    records = read_source(source_path)
+    string_ids: Dict[str, int] = {}
+    encoded: List[bytes] = []
+
+    def intern(value: Optional[str]) -> int:
+        if value is None:
+            return NO_STRING
+        if value not in string_ids:
+            string_ids[value] = len(encoded)
+            encoded.append(value.encode("utf-8"))
+        return string_ids[value]
+
+    codes = sorted(records)
+    columns = {name: [] for name in ("prefs", "cities", "areas", "streets")}
+    for code in codes:
+        record = records[code]
+        columns["prefs"].append(record[0])
+        columns["cities"].append(intern(record[1]))
+        columns["areas"].append(intern(record[2]))
+        columns["streets"].append(intern(record[3] if len(record) > 3 else None))
+
+    # the first postal code of each city and area, searched by prefix. Area names
+    # are kept once per city, the same area name is found in many cities. The
+    # codes of single buildings, which have a street, are only kept when the area
+    # has no other code.
+    names: Dict[Tuple[str, str], int] = {}
+    for row, code in enumerate(codes):
+        pref, city, area = records[code][:3]
+        has_street = len(records[code]) > 3
+        for name, entry in ((city + area, row), (area, row | AREA_ONLY)):
+            key = (normalize_name(name), f"{pref}{city}")
+            if not key[0]:
+                continue
+            first = names.get(key)
+            if first is None or (
+                columns["streets"][first & ~AREA_ONLY] != NO_STRING and not has_street
+            ):
+                names[key] = entry
+    columns["names"] = [names[key] for key in sorted(names)]
+    columns["places"] = sorted(
+        range(len(codes)),
+        key=lambda row: (
+            records[codes[row]][0],
+            normalize_name(records[codes[row]][1]),
+            place_area(records[codes[row]][2]),
+            row,
+        ),
+    )
+
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    arrays = {
+        "zips": [int(code) for code in codes],
+        "string_offsets": string_offsets,
+        **columns,
+    }
+    payloads = []
+    for name, item_type in SECTIONS:
+        if name == "strings":
+            payloads.append(b"".join(encoded))
+        else:
+            payloads.append(_pack(item_type, arrays[name]))
+    return _assemble(payloads)
+
+
+def _pack(item_type: str, values: list) -> bytes:
+    # arrays are read back in native order, which is little endian on our hosts
+    return array(item_type, values).tobytes()
+
+
+def _assemble(payloads: List[bytes]) -> bytes:
+    offset = _HEADER.size + len(payloads) * _SECTION.size
+    header = [_HEADER.pack(MAGIC, len(payloads))]
+    body = []
+    for (name, _), payload in zip(SECTIONS, payloads):
+        # keeps every section aligned for its array type
+        padding = -offset % 4
+        body.append(b"\0" * padding)
+        offset += padding
+        header.append(_SECTION.pack(name.encode(), offset, len(payload)))
+        body.append(payload)
+        offset += len(payload)
+    return b"".join(header + body)
+
+
+_postal_index = None
+_postal_index_lock = threading.Lock()
+
+
+def get_postal_index() -> PostalIndex:
+    """Returns the postal index of the process, built from the source data when
+    the prebuilt file is missing
+    """
+    global _postal_index
+    if _postal_index is None:
+        with _postal_index_lock:
+            if _postal_index is None:
+                if os.path.exists(POSTAL_INDEX_PATH):
+                    _postal_index = PostalIndex.load()
+                else:
+                    _postal_index = PostalIndex.from_source()
+    return _postal_index
@@ -1,3 +1,12 @@
+import requests
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+# Connections kept alive to Stripe, enough for the request threads of gunicorn
+# and the bulk payment workers to charge at the same time.
+STRIPE_CONNECTION_POOL_SIZE = 16
+
+
 class StripeSingleton:
     """Returns singleton object for stripe.
     This is just meant to be called once to complete the setup for stripe
@@ -20,3 +29,14 @@ class StripeSingleton:
             file_system = open(f"{base_path}/stripe_key", "r")
             key = file_system.readlines()[0].strip()
             stripe.api_key = key
+            stripe.default_http_client = RequestsClient(session=_keep_alive_session())
+
+
+def _keep_alive_session() -> requests.Session:
+    """Returns a session shared by all threads, so that the connections to Stripe
+    are reused instead of opened per thread
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_CONNECTION_POOL_SIZE)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,80 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+# The apps send the same ID token with every call of a screen, a token lives for
+# an hour. Entries also expire after the TTL, so a token is verified again within
+# minutes and a user disabled in Firebase, or whose tokens were revoked, is
+# rejected then when the verification checks revocation.
+TOKEN_CACHE_TTL_SECONDS = 5 * 60
+TOKEN_CACHE_SIZE = 4096
+
+
+class VerifiedTokenCache:
+    """LRU of the claims of the Firebase ID tokens already verified
+
+    Entries are keyed by the sha256 of the token, so tokens are not kept in
+    memory, and expire at the earliest of the token exp and the TTL. Tokens that
+    fail verification are not cached. Every call returns its own copy of the
+    claims, since the role helpers update them in place.
+    """
+
+    def __init__(
+        self,
+        ttl: float = TOKEN_CACHE_TTL_SECONDS,
+        max_size: int = TOKEN_CACHE_SIZE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def verify(self, token: str, verify: Callable[[str], dict]) -> dict:
+        """Returns the claims of the token, verified with verify on a miss"""
+        key = hashlib.sha256(token.encode()).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() < entry[0]:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return copy.deepcopy(entry[1])
+            self._misses += 1
+
+        claims = verify(token)
+        with self._lock:
+            expires_at = self._clock() + self._ttl
+            if claims.get("exp"):
+                expires_at = min(expires_at, claims["exp"])
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return copy.deepcopy(claims)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+
+verified_token_cache = VerifiedTokenCache()
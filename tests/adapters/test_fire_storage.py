@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from adapters.fire_storage import CsvResultWriter
+
+FIELDS = ["accountId", "status"]
+
+
+class FakeFile(io.StringIO):
+    def close(self):
+        self.closed_value = self.getvalue()
+        super().close()
+
+
+def test_write_streams_rows_in_index_order():
+    file = FakeFile()
+    writer = CsvResultWriter(file, FIELDS, "url")
+
+    writer.write(1, {"accountId": "b", "status": "error"})
+    # row 1 waits for row 0
+    assert file.getvalue() == ",accountId,status\n"
+    writer.write(0, {"accountId": "a", "status": "success"})
+    assert file.getvalue() == ",accountId,status\n0,a,success\n1,b,error\n"
+
+    assert writer.close() == 2
+    assert file.closed
+
+
+def test_write_quotes_values_and_leaves_missing_values_empty():
+    file = FakeFile()
+    writer = CsvResultWriter(file, FIELDS, "url")
+
+    writer.write(0, {"accountId": None, "status": "error, retry"})
+    writer.close()
+
+    assert file.closed_value == ',accountId,status\n0,,"error, retry"\n'
+
+
+def test_close_fails_when_a_row_is_missing():
+    file = FakeFile()
+    writer = CsvResultWriter(file, FIELDS, "url")
+    writer.write(1, {"accountId": "b", "status": "success"})
+
+    with pytest.raises(ValueError):
+        writer.close()
+    assert not file.closed
+
+
+def test_abort_closes_the_file_with_rows_missing():
+    file = FakeFile()
+    writer = CsvResultWriter(file, FIELDS, "url")
+    writer.write(1, {"accountId": "b", "status": "success"})
+
+    writer.abort()
+
+    assert file.closed_value == ",accountId,status\n"
+    # does nothing once the writer is closed
+    writer.abort()
@@ -0,0 +1,110 @@
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from adapters.fire_store import FireStoreBatchWriter
+
+
+@pytest.fixture
+def firestore_client():
+    firestore_client = Mock()
+    firestore_client.get_collection.return_value.document.side_effect = (
+        lambda document_id: f"ref-{document_id}"
+    )
+    yield firestore_client
+
+
+class CommitGate:
+    """Holds the first commit until released, so that writes pile up meanwhile"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        if not self.started.is_set():
+            self.started.set()
+            assert self.released.wait(5)
+
+
+def _hold_first_commit(batch) -> CommitGate:
+    gate = CommitGate()
+    batch.commit.side_effect = gate
+    return gate
+
+
+def test_writes_during_a_commit_share_the_next_one(firestore_client):
+    batch = firestore_client.client.batch.return_value
+    gate = _hold_first_commit(batch)
+    writer = FireStoreBatchWriter(firestore_client)
+
+    first = writer.set("collection", "first", {"value": 0})
+    assert gate.started.wait(5)
+    futures = []
+
+    def write(i):
+        futures.append(writer.set("collection", str(i), {"value": i}))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    gate.released.set()
+    for future in [first] + futures:
+        future.result(5)
+
+    assert batch.commit.call_count == 2
+    assert batch.set.call_count == 11
+    batch.set.assert_any_call("ref-3", {"value": 3}, merge=False)
+
+
+def test_pending_writes_are_split_by_max_batch_size(firestore_client):
+    batch = firestore_client.client.batch.return_value
+    gate = _hold_first_commit(batch)
+    writer = FireStoreBatchWriter(firestore_client, max_batch_size=2)
+
+    futures = [writer.update("collection", "first", {"value": 0})]
+    assert gate.started.wait(5)
+    futures += [writer.update("collection", str(i), {"value": i}) for i in range(4)]
+    gate.released.set()
+    for future in futures:
+        future.result(5)
+
+    assert batch.commit.call_count == 3
+
+
+def test_failing_write_does_not_fail_the_batch(firestore_client):
+    gate = CommitGate()
+    batches = []
+
+    def new_batch():
+        batch = Mock()
+        batch.writes = []
+        batch.update.side_effect = lambda ref, value: batch.writes.append(ref)
+
+        def commit():
+            if "ref-first" in batch.writes:
+                gate()
+            if "ref-missing" in batch.writes:
+                raise ValueError("No document to update")
+
+        batch.commit.side_effect = commit
+        batches.append(batch)
+        return batch
+
+    firestore_client.client.batch.side_effect = new_batch
+    writer = FireStoreBatchWriter(firestore_client)
+
+    first = writer.update("collection", "first", {"value": 0})
+    assert gate.started.wait(5)
+    ok = writer.update("collection", "ok", {"value": 1})
+    missing = writer.update("collection", "missing", {"value": 2})
+    gate.released.set()
+
+    assert first.result(5) is None
+    assert ok.result(5) is None
+    with pytest.raises(ValueError):
+        missing.result(5)
+    assert len(batches) == 4
@@ -0,0 +1,145 @@
+import threading
+from unittest.mock import Mock
+
+import httpx
+import pytest
+from notion_client import APIErrorCode, APIResponseError
+
+from adapters.notion_writer import NotionWriter, TokenBucket, get_notion_writer
+
+
+class GatedBucket:
+    """Bucket that hands out tokens only once opened, so requests pile up"""
+
+    def __init__(self):
+        self.opened = threading.Event()
+        self.taking = threading.Event()
+        self.paused = []
+
+    def take(self):
+        self.taking.set()
+        self.opened.wait(5)
+        return 0.0
+
+    def pause(self, seconds):
+        self.paused.append(seconds)
+
+
+def _rate_limited(retry_after=None):
+    headers = {} if retry_after is None else {"retry-after": retry_after}
+    response = httpx.Response(429, headers=headers)
+    return APIResponseError(response, "rate limited", APIErrorCode.RateLimited)
+
+
+def _wait_for(writer, stat, value):
+    for _ in range(500):
+        if writer.stats()[stat] >= value:
+            return
+        threading.Event().wait(0.01)
+
+
+def test_token_bucket_waits_for_refill():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+
+    bucket.pause(3)
+    assert bucket.take() == pytest.approx(3.5)
+
+
+def test_updates_of_the_same_page_are_collapsed():
+    client = Mock()
+    client.pages.update.side_effect = lambda **kwargs: {"id": kwargs["page_id"]}
+    bucket = GatedBucket()
+    writer = NotionWriter(client, bucket)
+    results = []
+
+    def update(properties):
+        results.append(writer.update_page("page-id", properties))
+
+    # the first update is taken by the dispatcher, the next ones wait in the queue
+    threads = [threading.Thread(target=update, args=({"a": 1},))]
+    threads[0].start()
+    bucket.taking.wait(5)
+    threads.append(threading.Thread(target=update, args=({"a": 2, "b": 1},)))
+    threads[-1].start()
+    _wait_for(writer, "queue_depth", 1)
+    threads.append(threading.Thread(target=update, args=({"a": 3},)))
+    threads[-1].start()
+    _wait_for(writer, "collapsed_updates", 1)
+    bucket.opened.set()
+    for t in threads:
+        t.join()
+
+    assert client.pages.update.call_count == 2
+    assert client.pages.update.call_args.kwargs == {
+        "page_id": "page-id",
+        "properties": {"a": 3, "b": 1},
+    }
+    assert results == [{"id": "page-id"}] * 3
+    assert writer.stats()["collapsed_updates"] == 1
+
+
+def test_creates_run_before_queued_updates():
+    client = Mock()
+    calls = []
+    client.pages.update.side_effect = lambda **kwargs: calls.append("update")
+    client.pages.create.side_effect = lambda **kwargs: calls.append("create")
+    bucket = GatedBucket()
+    writer = NotionWriter(client, bucket)
+
+    threads = [
+        threading.Thread(target=writer.update_page, args=(f"page-{i}", {}))
+        for i in range(3)
+    ]
+    for t in threads:
+        t.start()
+        bucket.taking.wait(5)
+    _wait_for(writer, "queue_depth", 2)
+    threads.append(threading.Thread(target=writer.create_page))
+    threads[-1].start()
+    _wait_for(writer, "queue_depth", 3)
+    bucket.opened.set()
+    for t in threads:
+        t.join()
+
+    assert calls == ["update", "create", "update", "update"]
+
+
+def test_rate_limited_request_is_retried_after_retry_after():
+    client = Mock()
+    client.pages.update.side_effect = [_rate_limited("2"), {"id": "page-id"}]
+    bucket = GatedBucket()
+    bucket.opened.set()
+    writer = NotionWriter(client, bucket, backoff=0.5)
+
+    assert writer.update_page("page-id", {"a": 1}) == {"id": "page-id"}
+    assert bucket.paused == [2.0]
+    assert writer.stats()["rate_limited"] == 1
+
+
+def test_rate_limited_request_fails_when_retries_are_exhausted():
+    client = Mock()
+    client.databases.query.side_effect = _rate_limited()
+    bucket = GatedBucket()
+    bucket.opened.set()
+    writer = NotionWriter(client, bucket, max_retries=2, backoff=0.5)
+
+    with pytest.raises(APIResponseError):
+        writer.query_database(database_id="database-id")
+    assert client.databases.query.call_count == 3
+    assert bucket.paused == [0.5, 1.0]
+
+
+def test_get_notion_writer_is_shared_per_client():
+    client = Mock()
+
+    assert get_notion_writer(client) is get_notion_writer(client)
+    assert get_notion_writer(Mock()) is not get_notion_writer(client)
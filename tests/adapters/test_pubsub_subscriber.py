@@ -0,0 +1,39 @@
+from unittest.mock import Mock
+
+from adapters.pubsub_subscriber import PubSubSubscriber
+
+SUBSCRIPTION = "projects/unit-test/subscriptions/fhir"
+
+
+def test_pull_from_emulator(monkeypatch):
+    monkeypatch.setenv("PUBSUB_EMULATOR_HOST", "localhost:8085")
+    session = Mock()
+    session.post.return_value.json.return_value = {
+        "receivedMessages": [{"ackId": "1", "message": {}}]
+    }
+
+    subscriber = PubSubSubscriber(SUBSCRIPTION, session)
+
+    assert subscriber.pull(10) == [{"ackId": "1", "message": {}}]
+    assert session.post.call_args.args[0] == (
+        f"http://localhost:8085/v1/{SUBSCRIPTION}:pull"
+    )
+    assert session.post.call_args.kwargs["json"] == {"maxMessages": 10}
+
+
+def test_acknowledge_and_nack(monkeypatch):
+    monkeypatch.delenv("PUBSUB_EMULATOR_HOST", raising=False)
+    session = Mock()
+    subscriber = PubSubSubscriber(SUBSCRIPTION, session)
+
+    subscriber.acknowledge(["1", "2"])
+    subscriber.nack(["3"])
+    subscriber.nack([])
+
+    assert session.post.call_count == 2
+    ack, nack = session.post.call_args_list
+    assert ack.args[0] == (
+        f"https://pubsub.googleapis.com/v1/{SUBSCRIPTION}:acknowledge"
+    )
+    assert ack.kwargs["json"] == {"ackIds": ["1", "2"]}
+    assert nack.kwargs["json"] == {"ackIds": ["3"], "ackDeadlineSeconds": 0}
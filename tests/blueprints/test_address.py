@@ -4,6 +4,7 @@ from unittest import TestCase
 from pytest import raises
 
 from src.blueprints.address import (
+    MAX_BATCH_SIZE,
     AddressController,
     get_prefecture_by_id,
     get_region_by_id,
@@ -134,3 +135,116 @@ class TestGetAddressByZip:
 
         # Then
         assert expected_output == json.loads(actual_output)
+
+
+class TestGetAddressesByZips:
+    def test_get_addresses_by_zips(self):
+        # Given
+        zipcodes = ["１００ー０００１", "9999999", "123", "1000001"]
+
+        # When
+        actual_output = AddressController.get_addresses_by_zips(zipcodes).response[0]
+
+        # Then
+        output = json.loads(actual_output)
+        assert [x["zipcode"] for x in output] == zipcodes
+        assert output[0]["code"] == "1000001"
+        assert output[0]["area"] == "千代田"
+        assert output[1]["error"] == "valid postal code"
+        assert output[2]["error"] == "code needs to be length of 7: 3"
+        assert output[3]["area"] == "千代田"
+
+    def test_too_many_zipcodes(self):
+        # Given
+        zipcodes = ["1000001"] * (MAX_BATCH_SIZE + 1)
+
+        # When and Then
+        with raises(Exception):
+            _ = AddressController.get_addresses_by_zips(zipcodes)
+
+
+class TestGetZipsByPlace:
+    def test_get_zips_by_city(self):
+        # When
+        actual_output = AddressController.get_zips_by_place("東京都", "千代田区")
+        output = json.loads(actual_output.response[0])
+
+        # Then
+        zipcodes = [x["zipcode"] for x in output]
+        assert len(zipcodes) == len(set(zipcodes))
+        assert {"1000001", "1000005", "1010003"} <= set(zipcodes)
+
+    def test_get_zips_by_area(self):
+        # When
+        actual_output = AddressController.get_zips_by_place("13", "千代田区", "丸の内")
+        output = json.loads(actual_output.response[0])
+
+        # Then
+        assert output[0] == {
+            "zipcode": "1000005",
+            "area": "丸の内（次のビルを除く）",
+            "street": None,
+        }
+        assert {x["area"] for x in output} == {"丸の内", "丸の内（次のビルを除く）"}
+
+    def test_get_zips_by_empty_area(self):
+        # When
+        actual_output = AddressController.get_zips_by_place("東京都", "千代田区", "")
+        output = json.loads(actual_output.response[0])
+
+        # Then
+        expected_output = AddressController.get_zips_by_place("東京都", "千代田区")
+        assert output == json.loads(expected_output.response[0])
+
+    def test_unknown_prefecture(self):
+        # When and Then
+        with raises(Exception):
+            _ = AddressController.get_zips_by_place("nowhere", "千代田区")
+
+
+class TestSuggest:
+    def test_suggest_by_partial_zipcode(self):
+        # When
+        actual_output = AddressController.suggest("100-000", 2).response[0]
+
+        # Then
+        assert [x["zipcode"] for x in json.loads(actual_output)] == [
+            "1000000",
+            "1000001",
+        ]
+
+    def test_suggest_by_city_and_area(self):
+        # When
+        actual_output = AddressController.suggest("東京都千代田区千代田", 1).response[0]
+
+        # Then
+        assert json.loads(actual_output) == [
+            {
+                "zipcode": "1000001",
+                "region": "関東",
+                "prefecture": "東京都",
+                "city": "千代田区",
+                "area": "千代田",
+                "street": None,
+            }
+        ]
+
+    def test_suggest_prefecture_by_kana(self):
+        # When
+        actual_output = AddressController.suggest("かながわ", 10).response[0]
+
+        # Then
+        output = json.loads(actual_output)
+        assert output[0]["prefecture"] == "神奈川県"
+        assert output[0]["zipcode"] is None
+
+    def test_suggest_without_query(self):
+        # When and Then
+        with raises(Exception):
+            _ = AddressController.suggest("", 10)
+
+    def test_suggest_with_limit_not_positive(self):
+        # When and Then
+        for limit in [0, -1]:
+            with raises(Exception):
+                _ = AddressController.suggest("100", limit)
@@ -10,6 +10,7 @@ from fhir.resources.slot import Slot
 from helper import FakeRequest, MockResourceClient
 
 from blueprints.appointments import AppointmentController
+from utils.system_code import SystemCode
 
 BOOKED_APPOINTMENT_DATA = {
     "resourceType": "Appointment",
@@ -497,3 +498,91 @@ def test_search_appointment_pagination_returns_next_link():
 
     assert resp.status_code == 200
     assert json.loads(resp_data)["next_link"] == expected_url
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return pytz.timezone("Asia/Tokyo").localize(datetime(2023, 1, 2, 10, 0))
+
+
+def _walk_in_role(visit_type="walk-in"):
+    return construct_fhir_element(
+        "PractitionerRole",
+        {
+            "resourceType": "PractitionerRole",
+            "id": "role-1",
+            "active": True,
+            "availableTime": [
+                {"availableStartTime": "09:00:00", "availableEndTime": "20:00:00"}
+            ],
+            "code": [{"coding": [SystemCode.visit_type_code(visit_type)]}],
+        },
+    )
+
+
+def test_create_appointment_on_queue(mocker):
+    # Given
+    mocker.patch("blueprints.appointments.datetime", FixedDatetime)
+    appointment = Appointment.parse_obj({**BOOKED_APPOINTMENT_DATA, "id": "appt-1"})
+    practitioner_role_service = mocker.Mock()
+    practitioner_role_service.get_role_by_practitioner.return_value = _walk_in_role()
+    appointment_service = mocker.Mock()
+    appointment_service.create_appointment_for_practitioner_role.return_value = (
+        None,
+        {"resource": appointment},
+    )
+    lists_service = mocker.Mock()
+
+    def dequeue_into_transaction(list_id, build):
+        err, bundles = build("patient-1")
+        assert err is None and bundles == [{"resource": appointment}]
+        return None, "patient-1", mocker.Mock(entry=[mocker.Mock(resource=appointment)])
+
+    lists_service.dequeue_into_transaction.side_effect = dequeue_into_transaction
+    patient_call_logs_service = mocker.Mock()
+    patient_call_logs_service.upsert_call_docs.return_value = (None, None)
+    controller = AppointmentController(
+        MockResourceClient(),
+        appointment_service=appointment_service,
+        practitioner_role_service=practitioner_role_service,
+        lists_service=lists_service,
+        patient_call_logs_serivce=patient_call_logs_service,
+    )
+
+    # When
+    resp = controller.create_appointment_on_queue("list-1", "practitioner-1")
+
+    # Then
+    assert resp.status_code == 201
+    assert json.loads(resp.data)["id"] == "appt-1"
+    args = appointment_service.create_appointment_for_practitioner_role.call_args[0]
+    assert args[0] == "PractitionerRole/role-1"
+    assert args[4] == "Patient/patient-1"
+    patient_call_logs_service.upsert_call_docs.assert_called_once_with(
+        "appt-1", "patient-1"
+    )
+
+
+def test_create_appointment_on_queue_requires_walk_in_doctor(mocker):
+    # Given
+    mocker.patch("blueprints.appointments.datetime", FixedDatetime)
+    practitioner_role_service = mocker.Mock()
+    practitioner_role_service.get_role_by_practitioner.return_value = _walk_in_role(
+        "appointment"
+    )
+    lists_service = mocker.Mock()
+    controller = AppointmentController(
+        MockResourceClient(),
+        practitioner_role_service=practitioner_role_service,
+        lists_service=lists_service,
+        patient_call_logs_serivce=mocker.Mock(),
+    )
+
+    # When
+    resp = controller.create_appointment_on_queue("list-1", "practitioner-1")
+
+    # Then
+    assert resp.status_code == 400
+    assert resp.data == b"Doctor is not available"
+    lists_service.dequeue_into_transaction.assert_not_called()
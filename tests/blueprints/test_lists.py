@@ -8,6 +8,7 @@ from fhir.resources import construct_fhir_element
 from helper import MockResourceClient
 
 from blueprints.lists import ListsController, get_spot_counts
+from services.lists_service import queue_snapshots
 
 LIST_DATA = {
     "resourceType": "List",
@@ -149,6 +150,12 @@ PRACTITIONER_ROLE_DATA = {
 }
 
 
+@pytest.fixture(autouse=True)
+def clear_queue_snapshots():
+    yield
+    queue_snapshots.clear()
+
+
 def test_create_list():
     def mock_create_resource(fhir_list):
         assert fhir_list.status == "current"
@@ -399,3 +406,24 @@ def test_get_position_of_nonexisting_patient():
     # Then
     assert response.status_code == 200
     assert response.data == b'{"data": {"position": -1}}'
+
+
+def test_get_position_of_patient_is_served_from_snapshot():
+    # Given
+    test_list = copy.deepcopy(LIST_DATA_WITH_TWO_ITEMS)
+    list_id = "test-id-98712653"
+    mock_get_resource = Mock(return_value=construct_fhir_element("List", test_list))
+
+    resource_client = MockResourceClient()
+    resource_client.get_resource = mock_get_resource
+
+    # When
+    controller = ListsController(resource_client)
+    controller.get_patient_position(list_id, "1")
+    response = controller.get_patient_position(list_id, "2")
+    count_response = controller.get_list_len(list_id)
+
+    # Then
+    assert response.data == b'{"data": {"position": 1}}'
+    assert json.loads(count_response.data)["data"] == 2
+    mock_get_resource.assert_called_once_with(list_id, "List")
@@ -1,9 +1,19 @@
 import json
 from unittest.mock import Mock, call, patch
 
+import requests
+from fhir.resources import construct_fhir_element
 from helper import FakeRequest, MockResourceClient
 
-from blueprints.payments import PaymentObject, PaymentsController
+from blueprints.payments import (
+    BULK_PAYMENT_RESULT_FIELDS,
+    PaymentObject,
+    PaymentsController,
+)
+from services.account_service import AccountService
+from services.invoice_service import InvoiceService
+from services.patient_service import PatientService
+from services.stripe_cache_service import StripeReadCache
 
 CUSTOMER_DATA = json.dumps(
     {
@@ -346,15 +356,30 @@ class TestBulkPayment:
         contents = [{"patient": "id"}]
         firestore_mock = Mock()
         firestore_mock.update_value = Mock()
+        firestore_mock.get_collection().document().collection().stream.return_value = []
         storage_mock = Mock()
         storage_name = "storage name"
         bucket_name = "bucket"
         object_name = "object"
+        writer = Mock(url=storage_name)
+        storage_mock.open_csv_writer = Mock(return_value=writer)
+        validator = Mock()
+        validator.validate.return_value = {
+            "total": 1,
+            "valid": 0,
+            "invalid": 1,
+            "items": [{"index": 0, "errors": ["Missing amount"]}],
+        }
 
         # When
-        storage_mock.upload_blob_from_memory = Mock(return_value=storage_name)
         payment_controller = PaymentsController(
-            MockResourceClient(), Mock(), Mock(), Mock(), firestore_mock, storage_mock
+            MockResourceClient(),
+            Mock(),
+            Mock(),
+            Mock(),
+            firestore_mock,
+            storage_mock,
+            bulk_payment_validator=validator,
         )
         payment_controller.create_bulk_payment_job(
             collection, collection_id, contents, bucket_name, object_name
@@ -369,21 +394,333 @@ class TestBulkPayment:
             ],
             any_order=True,
         )
-        storage_mock.upload_blob_from_memory.assert_called_once_with(
-            [
-                {
-                    "accountId": None,
-                    "currency": None,
-                    "description": "Invalid payment input",
-                    "patientId": "id",
-                    "price": None,
-                    "status": "error",
-                }
-            ],
-            bucket_name,
-            object_name,
-            collection_id,
+        storage_mock.open_csv_writer.assert_called_once_with(
+            bucket_name, object_name, collection_id, BULK_PAYMENT_RESULT_FIELDS
+        )
+        writer.write.assert_called_once_with(
+            0,
+            {
+                "accountId": None,
+                "currency": None,
+                "description": "Invalid payment input",
+                "patientId": "id",
+                "price": None,
+                "status": "error",
+            },
+        )
+        writer.close.assert_called_once()
+
+    def test_create_bulk_payment_job_error_when_interrupted(self):
+        # Given
+        collection = "collection"
+        collection_id = "collection id"
+        firestore_mock = Mock()
+        bulk_payment_service = Mock()
+        bulk_payment_service.run.side_effect = Exception("instance recycled")
+        storage_mock = Mock()
+        validator = Mock()
+        validator.validate.return_value = {"valid": 1, "invalid": 0, "items": []}
+        payment_controller = PaymentsController(
+            MockResourceClient(),
+            Mock(),
+            Mock(),
+            Mock(),
+            firestore_mock,
+            storage_mock,
+            Mock(),
+            bulk_payment_service,
+            bulk_payment_validator=validator,
+        )
+
+        # When
+        payment_controller.create_bulk_payment_job(
+            collection, collection_id, [{"patient": "id"}], "bucket", "object"
+        )
+
+        # Then
+        firestore_mock.update_value.assert_called_with(
+            collection, collection_id, {"status": "error"}
+        )
+        storage_mock.open_csv_writer.return_value.close.assert_not_called()
+        storage_mock.open_csv_writer.return_value.abort.assert_called_once()
+
+
+ACCOUNT_AND_PATIENT_DATA = {
+    "resourceType": "Bundle",
+    "type": "searchset",
+    "total": 1,
+    "entry": [
+        {
+            "resource": {
+                "resourceType": "Account",
+                "id": "account-id",
+                "status": "active",
+                "subject": [{"reference": "Patient/patient-id"}],
+            }
+        },
+        {
+            "resource": {
+                "resourceType": "Patient",
+                "id": "patient-id",
+                "extension": [
+                    {"url": "stripe-customer-id", "valueString": "customer-id"},
+                    {"url": "stripe-payment-method-id", "valueString": "method-id"},
+                ],
+            }
+        },
+    ],
+}
+
+
+class TestBulkPaymentValidation:
+    def test_validate_bulk_payments_without_contents(self):
+        # Given
+        validator = Mock()
+        controller = PaymentsController(
+            Mock(), Mock(), Mock(), Mock(), Mock(), bulk_payment_validator=validator
+        )
+
+        # When
+        response = controller.validate_bulk_payments(MockRequest())
+
+        # Then
+        assert response.status_code == 400
+        validator.validate.assert_not_called()
+
+    def test_validate_bulk_payments_returns_report(self):
+        # Given
+        report = {"total": 1, "valid": 1, "invalid": 0, "items": []}
+        validator = Mock()
+        validator.validate.return_value = report
+        controller = PaymentsController(
+            Mock(), Mock(), Mock(), Mock(), Mock(), bulk_payment_validator=validator
+        )
+
+        # When
+        response = controller.validate_bulk_payments(
+            MockRequest(contents=[{"account": "id"}])
+        )
+
+        # Then
+        assert response.status_code == 200
+        assert json.loads(response.data) == report
+
+    def test_charge_bulk_item_skips_items_that_failed_validation(self):
+        # Given
+        account_service = Mock()
+        controller = PaymentsController(Mock(), account_service, Mock(), Mock(), Mock())
+        item = {
+            "patient": "patient-id",
+            "amount": 1000,
+            "currency": "jpy",
+            "description": "fee",
+            "errors": ["No extension is added with patient: patient-id"],
+        }
+
+        # When
+        result = controller._charge_bulk_item(item)
+
+        # Then
+        assert result["status"] == "error"
+        assert result["description"] == item["errors"][0]
+        account_service.create_account_resource.assert_not_called()
+
+
+class TestCreatePayment:
+    def _controller(self, payment_service):
+        resource_client = Mock()
+        resource_client.search.return_value = construct_fhir_element(
+            "Bundle", ACCOUNT_AND_PATIENT_DATA
+        )
+        resource_client.get_post_bundle.side_effect = lambda resource, url: {
+            "resource": resource,
+            "fullUrl": url,
+        }
+        resource_client.get_put_bundle.side_effect = (
+            lambda resource, uid, if_match=None: {
+                "resource": resource,
+                "uid": uid,
+            }
+        )
+        controller = PaymentsController(
+            resource_client,
+            AccountService(resource_client),
+            InvoiceService(resource_client),
+            payment_service,
+            Mock(),
+            Mock(),
+            PatientService(resource_client),
+            Mock(),
         )
+        return controller, resource_client
+
+    def test_records_invoice_and_inactivates_account_in_one_transaction(self):
+        # Given
+        payment_service = Mock()
+        payment_service.create_payment.return_value = (None, "intent-id")
+        controller, resource_client = self._controller(payment_service)
+
+        # When
+        err, _ = controller._create_payment("1000", "jpy", "account-id")
+
+        # Then
+        assert err is None
+        payment_service.create_payment.assert_called_once_with(
+            "1000", "jpy", "customer-id", "method-id", None, "account-id"
+        )
+        resource_client.search.assert_called_once()
+        resource_client.create_resources.assert_called_once()
+        invoice, account = resource_client.create_resources.call_args.args[0]
+        assert invoice["fullUrl"].startswith("urn:uuid:")
+        assert invoice["resource"].status == "balanced"
+        assert invoice["resource"].subject.reference == "Patient/patient-id"
+        assert account["uid"] == "account-id"
+        assert account["resource"].status == "inactive"
+        resource_client.create_resource.assert_not_called()
+        resource_client.put_resource.assert_not_called()
+        resource_client.patch_resource.assert_not_called()
+
+    def test_records_cancelled_invoice_and_keeps_account_when_payment_fails(self):
+        # Given
+        payment_service = Mock()
+        payment_service.create_payment.return_value = (
+            Exception("card declined"),
+            "intent-id",
+        )
+        controller, resource_client = self._controller(payment_service)
+
+        # When
+        err, _ = controller._create_payment("1000", "jpy", "account-id")
+
+        # Then
+        assert err.args[0] == "card declined"
+        (invoice,) = resource_client.create_resources.call_args.args[0]
+        assert invoice["resource"].status == "cancelled"
+        assert invoice["resource"].cancelledReason == "CC payment failed"
+
+    def test_records_invoice_alone_when_account_was_updated(self):
+        # Given
+        payment_service = Mock()
+        payment_service.create_payment.return_value = (None, "intent-id")
+        controller, resource_client = self._controller(payment_service)
+        resource_client.create_resources.side_effect = [
+            requests.HTTPError("412 Precondition Failed"),
+            None,
+        ]
+
+        # When
+        err, _ = controller._create_payment("1000", "jpy", "account-id")
+
+        # Then
+        assert err is None
+        assert resource_client.create_resources.call_count == 2
+        (invoice,) = resource_client.create_resources.call_args.args[0]
+        assert invoice["resource"].status == "balanced"
+        resource_client.patch_resource.assert_called_once_with(
+            "account-id",
+            "Account",
+            [{"op": "add", "path": "/status", "value": "inactive"}],
+        )
+
+    def test_returns_payment_intent_when_payment_is_not_recorded(self):
+        # Given
+        payment_service = Mock()
+        payment_service.create_payment.return_value = (None, "intent-id")
+        controller, resource_client = self._controller(payment_service)
+        resource_client.create_resources.side_effect = requests.HTTPError("500")
+
+        # When
+        resp = controller.create_payment(
+            FakeRequest(data=json.dumps({"amount": "1000", "accountId": "account-id"}))
+        )
+
+        # Then
+        assert resp.status_code == 500
+        assert json.loads(resp.data) == "payment intent-id could not be recorded"
+        resource_client.patch_resource.assert_not_called()
+
+
+class TestStripeReadCache:
+    def _controller(self):
+        return PaymentsController(
+            Mock(),
+            Mock(),
+            Mock(),
+            Mock(),
+            Mock(),
+            Mock(),
+            Mock(),
+            Mock(),
+            StripeReadCache(),
+        )
+
+    @patch("blueprints.payments.stripe")
+    def test_get_payment_methods_is_read_once(self, mock_stripe):
+        # Given
+        mock_stripe.PaymentMethod.list.return_value = {"data": [{"id": "pm_1"}]}
+        controller = self._controller()
+
+        # When
+        controller.get_payment_methods("cus_1")
+        result = controller.get_payment_methods("cus_1")
+
+        # Then
+        assert json.loads(result.data) == {"data": [{"id": "pm_1"}]}
+        mock_stripe.PaymentMethod.list.assert_called_once()
+
+    @patch("blueprints.payments.stripe")
+    def test_detach_payment_method_invalidates_payment_methods(self, mock_stripe):
+        # Given
+        mock_stripe.PaymentMethod.list.side_effect = [
+            {"data": [{"id": "pm_1"}]},
+            {"data": []},
+        ]
+        mock_stripe.PaymentMethod.detach.return_value = {"id": "pm_1"}
+        controller = self._controller()
+        controller.get_payment_methods("cus_1")
+
+        # When
+        controller.detach_payment_method("pm_1")
+        result = controller.get_payment_methods("cus_1")
+
+        # Then
+        assert json.loads(result.data) == {"data": []}
+
+    @patch("blueprints.payments.stripe")
+    def test_create_setup_intent_bypasses_cache_of_customer(self, mock_stripe):
+        # Given
+        mock_stripe.SetupIntent.create.return_value = {"id": "seti_1"}
+        mock_stripe.PaymentMethod.list.return_value = {"data": []}
+        controller = self._controller()
+        request = FakeRequest(data=json.dumps({"customerId": "cus_1"}))
+
+        # When
+        controller.create_setup_intent(request)
+        controller.get_payment_methods("cus_1")
+        controller.get_payment_methods("cus_1")
+
+        # Then
+        assert mock_stripe.PaymentMethod.list.call_count == 2
+
+    @patch("blueprints.payments.stripe")
+    def test_create_payment_intent_invalidates_payment_intents(self, mock_stripe):
+        # Given
+        mock_stripe.PaymentIntent.list.return_value = {"data": []}
+        mock_stripe.PaymentIntent.create.return_value = {"id": "pi_1"}
+        controller = self._controller()
+        request = FakeRequest(
+            data=json.dumps(
+                {"customerId": "cus_1", "paymentMethodId": "pm_1", "amount": 1000}
+            )
+        )
+        controller.get_payment_intents("cus_1")
+
+        # When
+        controller.create_payment_intent(request)
+        controller.get_payment_intents("cus_1")
+
+        # Then
+        assert mock_stripe.PaymentIntent.list.call_count == 2
 
 
 class TestPaymentObject:
@@ -4,9 +4,15 @@ from unittest import mock
 from unittest.mock import Mock
 
 import pytest
+from fhir.resources import construct_fhir_element
 from fhir.resources.bundle import Bundle
 
 from blueprints.pubsub import PubsubController
+from services.message_ledger_service import (
+    MESSAGE_CLAIMED,
+    MESSAGE_DUPLICATE,
+    MESSAGE_IN_PROGRESS,
+)
 from tests.blueprints.helper import FakeRequest, MockResourceClient
 
 ENCOUNTER_BUNDLE_DATA = {
@@ -573,7 +579,7 @@ TEST_ENCOUNTER_PAGE_ID = "test-encounter-page-id"
 
 
 def test_fhir_when_no_envelope_then_return_204(
-    resource_client, notion_service, firestore_service
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
 ):
     request = FakeRequest(
         data=_generate_pubsub_message(
@@ -588,6 +594,8 @@ def test_fhir_when_no_envelope_then_return_204(
         notion_service,
         is_syncing_to_notion_enabled="false",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
@@ -596,7 +604,7 @@ def test_fhir_when_no_envelope_then_return_204(
 
 
 def test_fhir_when_no_envelope_then_return_400(
-    resource_client, notion_service, firestore_service
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
 ):
     request = FakeRequest(data={})
     controller = PubsubController(
@@ -604,6 +612,8 @@ def test_fhir_when_no_envelope_then_return_400(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
@@ -612,7 +622,7 @@ def test_fhir_when_no_envelope_then_return_400(
 
 
 def test_fhir_when_no_message_in_envelope_then_return_400(
-    resource_client, notion_service, firestore_service
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
 ):
     request = FakeRequest(data={"invalid": "data"})
     controller = PubsubController(
@@ -620,6 +630,8 @@ def test_fhir_when_no_message_in_envelope_then_return_400(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
@@ -628,7 +640,7 @@ def test_fhir_when_no_message_in_envelope_then_return_400(
 
 
 def test_fhir_when_no_attributes_in_message_then_return_400(
-    resource_client, notion_service, firestore_service
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
 ):
     request = FakeRequest(data={"message": {"data": "data"}})
     controller = PubsubController(
@@ -636,6 +648,8 @@ def test_fhir_when_no_attributes_in_message_then_return_400(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
@@ -644,7 +658,7 @@ def test_fhir_when_no_attributes_in_message_then_return_400(
 
 
 def test_fhir_when_no_data_in_message_then_return_400(
-    resource_client, notion_service, firestore_service
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
 ):
     request = FakeRequest(data={"message": {"attributes": "attributes"}})
     controller = PubsubController(
@@ -652,6 +666,8 @@ def test_fhir_when_no_data_in_message_then_return_400(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
@@ -663,7 +679,12 @@ def test_fhir_when_no_data_in_message_then_return_400(
     "resource", ["Appointment", "Patient", "Practitioner", "PractitionerRole"]
 )
 def test_fhir_when_no_operation_match_then_return_204(
-    resource_client, notion_service, firestore_service, resource
+    resource_client,
+    notion_service,
+    firestore_service,
+    debounce_service,
+    resource,
+    message_ledger,
 ):
     request = FakeRequest(
         data=_generate_pubsub_message(
@@ -678,6 +699,8 @@ def test_fhir_when_no_operation_match_then_return_204(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
@@ -689,11 +712,15 @@ def test_fhir_when_no_operation_match_then_return_204(
     "resource",
     ["Encounter", "MedicationRequest", "ServiceRequest", "DocumentReference"],
 )
-def test_post_encounter_when_no_existing_page_then_create_page_and_return_200(
-    resource_client, notion_service, firestore_service, resource
+def test_post_encounter_then_sync_encounter_and_return_200(
+    resource_client,
+    notion_service,
+    firestore_service,
+    debounce_service,
+    resource,
+    message_ledger,
 ):
-    notion_service.query_encounter_page.return_value = {"results": []}
-    notion_service.create_encounter_page.return_value = {"id": TEST_ENCOUNTER_PAGE_ID}
+    notion_service.sync_encounter.return_value = TEST_ENCOUNTER_PAGE_ID
     request = FakeRequest(
         data=_generate_pubsub_message(
             action="CreateResource",
@@ -707,20 +734,17 @@ def test_post_encounter_when_no_existing_page_then_create_page_and_return_200(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
 
     assert response.status_code == 200
     assert response.data.decode("utf-8") == TEST_ENCOUNTER_PAGE_ID
-    notion_service.query_encounter_page.assert_called_once_with(
-        encounter_id=TEST_ENCOUNTER_ID
-    )
-    notion_service.create_encounter_page.assert_called_once_with(
-        encounter_id=TEST_ENCOUNTER_ID
-    )
-    notion_service.sync_encounter_to_notion.assert_called_once_with(
-        encounter_page_id=TEST_ENCOUNTER_PAGE_ID,
+    message_ledger.complete.assert_called_once_with("test-message-id")
+    notion_service.sync_encounter.assert_called_once_with(
+        TEST_ENCOUNTER_ID,
         account=mock.ANY,
         appointment=mock.ANY,
         patient=mock.ANY,
@@ -741,22 +765,81 @@ def test_post_encounter_when_no_existing_page_then_create_page_and_return_200(
     )
 
 
+def test_post_encounter_splits_cards_from_single_search(
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
+):
+    notion_service.sync_encounter.return_value = TEST_ENCOUNTER_PAGE_ID
+    controller = PubsubController(
+        resource_client,
+        notion_service,
+        is_syncing_to_notion_enabled="true",
+        firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
+    )
+
+    controller._post_encounter(TEST_ENCOUNTER_ID)
+
+    kwargs = notion_service.sync_encounter.call_args.kwargs
+    assert (
+        kwargs["insurance_card"].id
+        == INSURANCE_CARD_BUNDLE_DATA["entry"][0]["resource"]["id"]
+    )
+    assert (
+        kwargs["medical_card"].id
+        == MEDICAL_CARD_BUNDLE_DATA["entry"][0]["resource"]["id"]
+    )
+
+
+def test_fhir_when_encounter_sync_is_pending_then_return_204(
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
+):
+    debounce_service.claim.return_value = False
+    request = FakeRequest(
+        data=_generate_pubsub_message(
+            action="CreateResource",
+            payload_type="NameOnly",
+            resource_type="MedicationRequest",
+            resource_id="test-medication-request-id",
+        )
+    )
+    controller = PubsubController(
+        resource_client,
+        notion_service,
+        is_syncing_to_notion_enabled="true",
+        firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
+    )
+
+    response = controller.fhir(request)
+
+    assert response.status_code == 204
+    debounce_service.claim.assert_called_once_with(TEST_ENCOUNTER_ID)
+    assert not notion_service.sync_encounter.called
+
+
 @pytest.mark.parametrize(
-    "resource",
-    ["Encounter", "MedicationRequest", "ServiceRequest", "DocumentReference"],
+    "claim, status_code",
+    [(MESSAGE_DUPLICATE, 204), (MESSAGE_IN_PROGRESS, 409)],
 )
-def test_post_encounter_when_page_exists_then_update_page_and_return_200(
-    resource_client, notion_service, firestore_service, resource
+def test_fhir_when_message_is_redelivered_then_skip_sync(
+    resource_client,
+    notion_service,
+    firestore_service,
+    debounce_service,
+    message_ledger,
+    claim,
+    status_code,
 ):
-    notion_service.query_encounter_page.return_value = {
-        "results": [{"id": TEST_ENCOUNTER_PAGE_ID}]
-    }
+    message_ledger.claim.return_value = claim
+    resource_client.get_resource = Mock()
     request = FakeRequest(
         data=_generate_pubsub_message(
             action="CreateResource",
             payload_type="NameOnly",
-            resource_type=resource,
-            resource_id=TEST_ENCOUNTER_ID,
+            resource_type="MedicationRequest",
+            resource_id="test-medication-request-id",
         )
     )
     controller = PubsubController(
@@ -764,36 +847,44 @@ def test_post_encounter_when_page_exists_then_update_page_and_return_200(
         notion_service,
         is_syncing_to_notion_enabled="true",
         firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
     response = controller.fhir(request)
 
-    assert response.status_code == 200
-    assert response.data.decode("utf-8") == TEST_ENCOUNTER_PAGE_ID
-    notion_service.query_encounter_page.assert_called_once_with(
-        encounter_id=TEST_ENCOUNTER_ID
+    assert response.status_code == status_code
+    message_ledger.claim.assert_called_once_with("test-message-id")
+    assert not resource_client.get_resource.called
+    assert not message_ledger.complete.called
+
+
+def test_fhir_when_sync_fails_then_release_message(
+    resource_client, notion_service, firestore_service, debounce_service, message_ledger
+):
+    notion_service.sync_encounter.side_effect = Exception("notion is down")
+    request = FakeRequest(
+        data=_generate_pubsub_message(
+            action="CreateResource",
+            payload_type="NameOnly",
+            resource_type="Encounter",
+            resource_id=TEST_ENCOUNTER_ID,
+        )
     )
-    assert not notion_service.create_encounter_page.called
-    notion_service.sync_encounter_to_notion.assert_called_once_with(
-        encounter_page_id=TEST_ENCOUNTER_PAGE_ID,
-        account=mock.ANY,
-        appointment=mock.ANY,
-        patient=mock.ANY,
-        practitioner_role=mock.ANY,
-        clinical_note=mock.ANY,
-        medication_request=mock.ANY,
-        service_request=mock.ANY,
-        insurance_card=mock.ANY,
-        medical_card=mock.ANY,
+    controller = PubsubController(
+        resource_client,
+        notion_service,
+        is_syncing_to_notion_enabled="true",
+        firestore_service=firestore_service,
+        debounce_service=debounce_service,
+        message_ledger=message_ledger,
     )
 
-    firestore_service.sync_encounter_to_firestore.assert_called_once_with(
-        appointment=mock.ANY,
-        encounter=mock.ANY,
-        patient=mock.ANY,
-        medication_request=mock.ANY,
-        service_request=mock.ANY,
-    )
+    with pytest.raises(Exception):
+        controller.fhir(request)
+
+    message_ledger.release.assert_called_once_with("test-message-id")
+    assert not message_ledger.complete.called
 
 
 def _generate_pubsub_message(
@@ -835,23 +926,36 @@ def resource_client(mocker):
             assert search == [
                 ("patient", TEST_PATIENT_ID),
                 ("status", "current"),
-                ("type", "64290-0"),
-            ] or search == [
-                ("patient", TEST_PATIENT_ID),
-                ("status", "current"),
-                ("type", "00001-1"),
+                ("type", "64290-0,00001-1"),
             ]
-            if search == [
-                ("patient", TEST_PATIENT_ID),
-                ("status", "current"),
-                ("type", "64290-0"),
-            ]:
-                return Bundle(**INSURANCE_CARD_BUNDLE_DATA)
-            else:
-                return Bundle(**MEDICAL_CARD_BUNDLE_DATA)
+            return Bundle(
+                **{
+                    **INSURANCE_CARD_BUNDLE_DATA,
+                    "entry": INSURANCE_CARD_BUNDLE_DATA["entry"]
+                    + MEDICAL_CARD_BUNDLE_DATA["entry"],
+                    "total": 2,
+                }
+            )
+
+    def mock_get_resource(resource_id, resource_type):
+        encounter = {"reference": f"Encounter/{TEST_ENCOUNTER_ID}"}
+        resource = {"resourceType": resource_type, "id": resource_id}
+        if resource_type == "DocumentReference":
+            resource["status"] = "current"
+            resource["content"] = [{"attachment": {"data": ""}}]
+            resource["context"] = {"encounter": [encounter]}
+        else:
+            resource["status"] = "active"
+            resource["intent"] = "order"
+            resource["subject"] = {"reference": f"Patient/{TEST_PATIENT_ID}"}
+            resource["encounter"] = encounter
+            if resource_type == "MedicationRequest":
+                resource["medicationCodeableConcept"] = {"text": "medication"}
+        return construct_fhir_element(resource_type, resource)
 
     mock_resouce_client = MockResourceClient()
     mock_resouce_client.search = mock_search
+    mock_resouce_client.get_resource = mock_get_resource
 
     yield mock_resouce_client
 
@@ -864,3 +968,17 @@ def notion_service(mocker):
 @pytest.fixture
 def firestore_service(mocker):
     yield Mock()
+
+
+@pytest.fixture
+def message_ledger(mocker):
+    mock_message_ledger = Mock()
+    mock_message_ledger.claim.return_value = MESSAGE_CLAIMED
+    yield mock_message_ledger
+
+
+@pytest.fixture
+def debounce_service(mocker):
+    mock_debounce_service = Mock()
+    mock_debounce_service.claim.return_value = True
+    yield mock_debounce_service
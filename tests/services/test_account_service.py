@@ -1,6 +1,9 @@
 import pytest
+from fhir.resources import construct_fhir_element
 
+from adapters.fhir_store import ResourceClient
 from blueprints.accounts import AccountController
+from services.account_service import AccountService
 from tests.blueprints.helper import FakeRequest
 
 
@@ -179,3 +182,26 @@ def test_get_account_when_roles_are_staff_and_practitioner(
 
     # Then
     response.status_code == 401
+
+
+def test_get_inactivate_bundle_locks_the_version_read(mocker):
+    # Given
+    account = construct_fhir_element(
+        "Account",
+        {
+            "resourceType": "Account",
+            "id": "account-id",
+            "meta": {"versionId": "MTY2MjM4Mzc1NzI3NzI0MDAwMA"},
+            "status": "active",
+        },
+    )
+    account_service = AccountService(ResourceClient(session=mocker.Mock(), url="url"))
+
+    # When
+    bundle = account_service.get_inactivate_bundle(account)
+
+    # Then
+    assert bundle["resource"].status == "inactive"
+    assert bundle["request"]["method"] == "PUT"
+    assert bundle["request"]["ifMatch"] == 'W/"MTY2MjM4Mzc1NzI3NzI0MDAwMA"'
+    assert account.status == "active"
@@ -0,0 +1,146 @@
+import threading
+from unittest.mock import Mock
+
+from services.bulk_payment_service import BulkPaymentService
+
+
+def _snapshot(doc_id, value):
+    snapshot = Mock(id=doc_id)
+    snapshot.to_dict.return_value = value
+    return snapshot
+
+
+def _firestore_client(checkpoints=None):
+    firestore_client = Mock()
+    document = firestore_client.get_collection.return_value.document.return_value
+    items = document.collection.return_value
+    items.stream.return_value = [
+        _snapshot(doc_id, value) for doc_id, value in (checkpoints or {}).items()
+    ]
+    items.document.side_effect = lambda doc_id: Mock(id=doc_id)
+    return firestore_client, document
+
+
+def _result(item, status="success"):
+    return {"accountId": item.get("account"), "status": status}
+
+
+def test_run_charges_items_concurrently_and_keeps_their_order():
+    firestore_client, document = _firestore_client()
+    contents = [{"account": str(i)} for i in range(4)]
+    barrier = threading.Barrier(4, timeout=5)
+
+    def charge(item, on_account_created):
+        # every item waits for the others, so this only passes when they overlap
+        barrier.wait()
+        return _result(item, "error" if item["account"] == "2" else "success")
+
+    results = {}
+    service = BulkPaymentService(firestore_client, concurrency=4)
+    report = service.run("bulk", "job", contents, charge, results.__setitem__)
+
+    assert [results[i]["accountId"] for i in range(4)] == ["0", "1", "2", "3"]
+    assert report["succeeded"] == 3 and report["failed"] == 1
+    document.set.assert_called_once_with({"total": 4}, merge=True)
+    batch = firestore_client.client.batch.return_value
+    assert batch.commit.call_count == 4
+    counters = [c.args[1] for c in batch.update.call_args_list]
+    assert sum("failed" in c for c in counters) == 1
+    assert sum("succeeded" in c for c in counters) == 3
+
+
+def test_run_resumes_from_checkpointed_items():
+    firestore_client, _ = _firestore_client(
+        {
+            "0": {"status": "success", "result": _result({"account": "a"})},
+            "1": {"status": "processing", "accountId": "created"},
+        }
+    )
+    contents = [{"account": "a"}, {"patient": "p"}, {"account": "c"}]
+    charged = []
+
+    def charge(item, on_account_created):
+        charged.append(item)
+        return _result(item)
+
+    results = {}
+    report = BulkPaymentService(firestore_client).run(
+        "bulk", "job", contents, charge, results.__setitem__
+    )
+
+    # the item with a created account is charged again with the same account
+    assert sorted(i.get("account") for i in charged) == ["c", "created"]
+    assert [results[i]["accountId"] for i in range(3)] == ["a", "created", "c"]
+    assert report["processed"] == 3
+
+
+def test_run_checkpoints_created_account_before_the_charge():
+    firestore_client, _ = _firestore_client()
+    item_refs = {}
+    items = firestore_client.get_collection().document().collection.return_value
+    items.document.side_effect = lambda doc_id: item_refs.setdefault(doc_id, Mock())
+
+    def charge(item, on_account_created):
+        on_account_created("new-account")
+        item_refs["0"].set.assert_called_once_with(
+            {"status": "processing", "accountId": "new-account"}
+        )
+        return _result({"account": "new-account"})
+
+    results = {}
+    BulkPaymentService(firestore_client).run(
+        "bulk", "job", [{"patient": "p"}], charge, results.__setitem__
+    )
+
+    assert results == {0: {"accountId": "new-account", "status": "success"}}
+
+
+def test_run_holds_back_items_too_far_ahead_of_the_first_pending_one():
+    firestore_client, _ = _firestore_client()
+    contents = [{"account": str(i)} for i in range(5)]
+    release = threading.Event()
+    started = []
+
+    def charge(item, on_account_created):
+        started.append(item["account"])
+        if item["account"] == "0":
+            assert release.wait(5)
+        return _result(item)
+
+    service = BulkPaymentService(firestore_client, concurrency=4, result_window=2)
+    run = threading.Thread(
+        target=service.run, args=("bulk", "job", contents, charge, None)
+    )
+    run.start()
+    run.join(0.2)
+
+    assert sorted(started) == ["0", "1"]
+    release.set()
+    run.join(5)
+    assert sorted(started) == ["0", "1", "2", "3", "4"]
+
+
+def test_run_fails_when_an_item_fails_before_the_window_moves():
+    firestore_client, _ = _firestore_client()
+    contents = [{"account": str(i)} for i in range(3)]
+    errors = []
+
+    def charge(item, on_account_created):
+        if item["account"] == "0":
+            raise Exception("firestore is down")
+        return _result(item)
+
+    def run():
+        try:
+            BulkPaymentService(firestore_client, result_window=1).run(
+                "bulk", "job", contents, charge
+            )
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert str(errors[0]) == "firestore is down"
@@ -0,0 +1,112 @@
+from unittest.mock import Mock
+
+from fhir.resources import construct_fhir_element
+
+from services.bulk_payment_validation_service import BulkPaymentValidator
+
+STRIPE_EXTENSIONS = [
+    {"url": "stripe-customer-id", "valueString": "cus_1"},
+    {"url": "stripe-payment-method-id", "valueString": "pm_1"},
+]
+
+
+def _account(account_id, patient_id, status="active"):
+    return {
+        "resourceType": "Account",
+        "id": account_id,
+        "status": status,
+        "subject": [{"reference": f"Patient/{patient_id}"}],
+    }
+
+
+def _patient(patient_id, extension=STRIPE_EXTENSIONS):
+    patient = {"resourceType": "Patient", "id": patient_id}
+    if extension:
+        patient["extension"] = extension
+    return patient
+
+
+def _resource_client(resources):
+    resource_client = Mock()
+
+    def search(resource_type, search):
+        params = dict(search)
+        ids = params["_id"].split(",")
+        entries = [x for x in resources if x["resourceType"] == resource_type]
+        entries = [x for x in entries if x["id"] in ids]
+        if params.get("_include") == "Account:subject":
+            subjects = [x["subject"][0]["reference"].split("/")[1] for x in entries]
+            entries += [
+                x
+                for x in resources
+                if x["resourceType"] == "Patient" and x["id"] in subjects
+            ]
+        return construct_fhir_element(
+            "Bundle",
+            {
+                "resourceType": "Bundle",
+                "type": "searchset",
+                "entry": [{"resource": x} for x in entries],
+            },
+        )
+
+    resource_client.search.side_effect = search
+    return resource_client
+
+
+def _item(**kwargs):
+    return {"amount": 1000, "currency": "jpy", "description": "fee", **kwargs}
+
+
+def test_validate_reports_invalid_items():
+    resource_client = _resource_client(
+        [
+            _account("a1", "p1"),
+            _account("a2", "p2", status="inactive"),
+            _account("a3", "p3"),
+            _patient("p1"),
+            _patient("p2"),
+            _patient("p3", extension=None),
+            _patient("p4"),
+        ]
+    )
+    contents = [
+        _item(account="a1"),
+        _item(account="a2"),
+        _item(account="a3"),
+        _item(patient="p4"),
+        _item(patient="missing"),
+        _item(account="a1"),
+        {"account": "a1"},
+    ]
+
+    report = BulkPaymentValidator(resource_client).validate(contents)
+
+    assert report["total"] == 7
+    assert report["valid"] == 2
+    errors = {x["index"]: x["errors"] for x in report["items"]}
+    assert errors[1] == ["Account is not active. account_id: a2"]
+    assert errors[2] == ["No extension is added with patient: p3"]
+    assert errors[4] == ["Patient does not exist. patient_id: missing"]
+    assert errors[5] == ["Account is charged twice. account_id: a1"]
+    assert errors[6][:3] == [
+        "Missing amount",
+        "Missing currency",
+        "Missing description",
+    ]
+
+
+def test_validate_searches_ids_in_chunks():
+    resources = [_account(f"a{i}", f"p{i}") for i in range(5)]
+    resources += [_patient(f"p{i}") for i in range(5)]
+    resource_client = _resource_client(resources)
+    contents = [_item(account=f"a{i}") for i in range(5)]
+
+    report = BulkPaymentValidator(resource_client, chunk_size=2).validate(contents)
+
+    assert report["invalid"] == 0
+    assert resource_client.search.call_count == 3
+    searched = [
+        dict(c.kwargs["search"])["_id"] for c in resource_client.search.mock_calls
+    ]
+    assert sorted(searched) == ["a0,a1", "a2,a3", "a4"]
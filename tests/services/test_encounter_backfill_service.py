@@ -0,0 +1,125 @@
+from datetime import date
+from unittest.mock import Mock
+
+from fhir.resources import construct_fhir_element
+
+from services.encounter_backfill_service import EncounterBackfillService
+
+
+def _encounter_bundle(encounter_ids, next_url=None):
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "entry": [
+            {
+                "resource": {
+                    "resourceType": "Encounter",
+                    "id": encounter_id,
+                    "status": "finished",
+                    "class": {"code": "HH"},
+                }
+            }
+            for encounter_id in encounter_ids
+        ],
+    }
+    if next_url:
+        bundle["link"] = [{"relation": "next", "url": next_url}]
+    return construct_fhir_element("Bundle", bundle)
+
+
+def _resource_client(encounters_by_day):
+    resource_client = Mock()
+
+    def search(resource_type, search):
+        params = dict(search)
+        if params.get("_summary") == "count":
+            total = sum(len(ids) for ids in encounters_by_day.values())
+            return construct_fhir_element(
+                "Bundle",
+                {"resourceType": "Bundle", "type": "searchset", "total": total},
+            )
+        day = search[0][1][2:]
+        ids = encounters_by_day.get(day, [])
+        return _encounter_bundle(ids[:1], f"next/{day}" if len(ids) > 1 else None)
+
+    resource_client.search.side_effect = search
+    resource_client.link.side_effect = lambda url: _encounter_bundle(
+        encounters_by_day[url.split("/")[1]][1:]
+    )
+    return resource_client
+
+
+def _firestore_client(checkpoint=None):
+    firestore_client = Mock()
+    ref = firestore_client.get_collection.return_value.document.return_value
+    ref.get.return_value = Mock(exists=checkpoint is not None)
+    ref.get.return_value.to_dict.return_value = checkpoint
+    return firestore_client, ref
+
+
+def test_run_syncs_every_page_and_checkpoints_each_day():
+    resource_client = _resource_client(
+        {"2023-01-01": ["a", "b", "c"], "2023-01-02": ["d"]}
+    )
+    firestore_client, ref = _firestore_client()
+    synced = []
+    service = EncounterBackfillService(resource_client, synced.append, firestore_client)
+
+    checkpoint = service.run(date(2023, 1, 1), date(2023, 1, 2))
+
+    assert sorted(synced) == ["a", "b", "c", "d"]
+    assert checkpoint["next_day"] == "2023-01-03"
+    assert checkpoint["synced"] == 4
+    assert [c.args[0]["next_day"] for c in ref.set.call_args_list] == [
+        "2023-01-02",
+        "2023-01-03",
+    ]
+
+
+def test_run_resumes_from_checkpoint_and_records_failures():
+    resource_client = _resource_client({"2023-01-01": ["a"], "2023-01-02": ["b", "c"]})
+    firestore_client, ref = _firestore_client(
+        {"next_day": "2023-01-02", "synced": 1, "failed": 0}
+    )
+
+    def sync_encounter(encounter_id):
+        if encounter_id == "c":
+            raise Exception("notion is down")
+
+    service = EncounterBackfillService(
+        resource_client, sync_encounter, firestore_client
+    )
+
+    checkpoint = service.run(date(2023, 1, 1), date(2023, 1, 2))
+
+    assert checkpoint["synced"] == 2
+    assert checkpoint["failed"] == 1
+    value = ref.set.call_args.args[0]
+    assert value["failed_ids"] == ["c"]
+    assert ("date", "ge2023-01-01") not in [
+        c.kwargs["search"][0] for c in resource_client.search.call_args_list
+    ]
+
+
+def test_run_retries_failed_encounters_on_resume():
+    resource_client = _resource_client({"2023-01-01": ["a"], "2023-01-02": ["b"]})
+    firestore_client, ref = _firestore_client(
+        {"next_day": "2023-01-03", "synced": 1, "failed": 2, "failed_ids": ["c", "d"]}
+    )
+    synced = []
+
+    def sync_encounter(encounter_id):
+        if encounter_id == "d":
+            raise Exception("notion is down")
+        synced.append(encounter_id)
+
+    service = EncounterBackfillService(
+        resource_client, sync_encounter, firestore_client
+    )
+
+    checkpoint = service.run(date(2023, 1, 1), date(2023, 1, 2))
+
+    assert synced == ["c"]
+    assert checkpoint["synced"] == 2
+    assert checkpoint["failed"] == 1
+    assert ref.set.call_args.args[0]["failed_ids"] == ["d"]
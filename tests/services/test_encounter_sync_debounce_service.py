@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+
+import pytest
+
+from services.encounter_sync_debounce_service import EncounterSyncDebounceService
+
+
+@pytest.fixture
+def firestore_client(mocker):
+    mocker.patch(
+        "services.encounter_sync_debounce_service.firestore.transactional",
+        lambda func: func,
+    )
+    document = Mock()
+    firestore_client = Mock()
+    firestore_client.get_collection.return_value.document.return_value = document
+    yield firestore_client
+
+
+def test_claim_without_window_does_not_use_firestore():
+    firestore_client = Mock()
+    service = EncounterSyncDebounceService(0, firestore_client)
+
+    assert service.claim("encounter-id")
+    service.wait_and_release("encounter-id")
+    firestore_client.get_collection.assert_not_called()
+
+
+def test_claim_when_no_pending_sync(firestore_client):
+    document = firestore_client.get_collection.return_value.document.return_value
+    document.get.return_value = Mock(exists=False)
+    transaction = firestore_client.client.transaction.return_value
+    service = EncounterSyncDebounceService(5, firestore_client)
+
+    assert service.claim("encounter-id")
+    transaction.set.assert_called_once()
+
+
+def test_claim_when_sync_is_pending(firestore_client):
+    document = firestore_client.get_collection.return_value.document.return_value
+    document.get.return_value = Mock(exists=True)
+    document.get.return_value.get.return_value = datetime.now(timezone.utc) + timedelta(
+        seconds=3
+    )
+    transaction = firestore_client.client.transaction.return_value
+    service = EncounterSyncDebounceService(5, firestore_client)
+
+    assert not service.claim("encounter-id")
+    transaction.set.assert_not_called()
+    transaction.update.assert_called_once()
+
+
+def test_claim_takes_over_stale_pending_sync(firestore_client):
+    document = firestore_client.get_collection.return_value.document.return_value
+    document.get.return_value = Mock(exists=True)
+    document.get.return_value.get.return_value = datetime.now(timezone.utc) - timedelta(
+        minutes=5
+    )
+    service = EncounterSyncDebounceService(5, firestore_client)
+
+    assert service.claim("encounter-id")
@@ -0,0 +1,206 @@
+import base64
+import time
+from unittest.mock import Mock
+
+from blueprints.pubsub import PubsubController
+from services.fhir_notification_worker_service import (
+    ACK_DEADLINE_EXTENSION_SECONDS,
+    FhirNotificationWorker,
+)
+from services.message_ledger_service import (
+    MESSAGE_CLAIMED,
+    MESSAGE_DUPLICATE,
+    MESSAGE_IN_PROGRESS,
+)
+
+TEST_ENCOUNTER_ID = "test-encounter-id"
+
+
+class FakeSubscriber:
+    """Stand-in for a pull subscription that records acks, nacks and extensions"""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.acked = []
+        self.nacked = []
+        self.extended = []
+
+    def pull(self, max_messages):
+        pulled = self.messages[:max_messages]
+        self.messages = self.messages[max_messages:]
+        return pulled
+
+    def acknowledge(self, ack_ids):
+        self.acked += ack_ids
+
+    def nack(self, ack_ids):
+        self.nacked += ack_ids
+
+    def modify_ack_deadline(self, ack_ids, seconds):
+        self.extended.append((tuple(ack_ids), seconds))
+
+
+def _received_message(ack_id, resource_type, resource_id, action="PatchResource"):
+    data = f"projects/unit-test/locations/unit-test/datasets/unit-test/fhirStores/unit-test/fhir/{resource_type}/{resource_id}"
+    return {
+        "ackId": ack_id,
+        "message": {
+            "attributes": {
+                "action": action,
+                "payloadType": "NameOnly",
+                "resourceType": resource_type,
+            },
+            "data": base64.b64encode(data.encode("utf-8")).decode("utf-8"),
+            "messageId": f"message-{ack_id}",
+        },
+    }
+
+
+def _controller():
+    controller = PubsubController(
+        Mock(),
+        Mock(),
+        is_syncing_to_notion_enabled="true",
+        firestore_service=Mock(),
+        debounce_service=Mock(),
+        message_ledger=Mock(),
+    )
+    controller.message_ledger.claim.return_value = MESSAGE_CLAIMED
+    controller.resolve_encounter_id = Mock(
+        side_effect=lambda resource_type, resource_id: None
+        if resource_id == "orphan"
+        else TEST_ENCOUNTER_ID
+    )
+    controller.sync_encounter = Mock()
+    return controller
+
+
+def test_process_batch_syncs_each_encounter_once():
+    subscriber = FakeSubscriber(
+        [
+            _received_message("1", "Encounter", TEST_ENCOUNTER_ID),
+            _received_message("2", "MedicationRequest", "medication-request-id"),
+            _received_message("3", "MedicationRequest", "medication-request-id"),
+            _received_message("4", "ServiceRequest", "orphan"),
+            _received_message("5", "Patient", "patient-id"),
+        ]
+    )
+    controller = _controller()
+    worker = FhirNotificationWorker(subscriber, controller)
+
+    assert worker.process_batch() == 5
+
+    controller.sync_encounter.assert_called_once_with(TEST_ENCOUNTER_ID)
+    assert controller.resolve_encounter_id.call_count == 3
+    assert sorted(subscriber.acked) == ["1", "2", "3", "4", "5"]
+    assert subscriber.nacked == []
+
+
+def test_process_batch_nacks_messages_of_failed_sync():
+    subscriber = FakeSubscriber(
+        [
+            _received_message("1", "Encounter", TEST_ENCOUNTER_ID),
+            {"ackId": "2", "message": {}},
+        ]
+    )
+    controller = _controller()
+    controller.sync_encounter.side_effect = Exception("notion is down")
+    worker = FhirNotificationWorker(subscriber, controller)
+
+    worker.process_batch()
+
+    assert subscriber.acked == ["2"]
+    assert subscriber.nacked == ["1"]
+    controller.message_ledger.release.assert_called_once_with("message-1")
+
+
+def test_process_batch_pulls_at_most_batch_size():
+    subscriber = FakeSubscriber(
+        [_received_message(str(i), "Encounter", str(i)) for i in range(3)]
+    )
+    worker = FhirNotificationWorker(subscriber, _controller(), batch_size=2)
+
+    assert worker.process_batch() == 2
+    assert worker.process_batch() == 1
+    assert worker.process_batch() == 0
+
+
+def test_process_batch_skips_redelivered_messages():
+    subscriber = FakeSubscriber(
+        [
+            _received_message("1", "Encounter", TEST_ENCOUNTER_ID),
+            _received_message("2", "Encounter", TEST_ENCOUNTER_ID),
+            _received_message("3", "Encounter", TEST_ENCOUNTER_ID),
+        ]
+    )
+    controller = _controller()
+    controller.message_ledger.claim.side_effect = [
+        MESSAGE_CLAIMED,
+        MESSAGE_DUPLICATE,
+        MESSAGE_IN_PROGRESS,
+    ]
+    worker = FhirNotificationWorker(subscriber, controller)
+
+    worker.process_batch()
+
+    controller.sync_encounter.assert_called_once_with(TEST_ENCOUNTER_ID)
+    assert sorted(subscriber.acked) == ["1", "2"]
+    assert subscriber.nacked == []
+    controller.message_ledger.complete.assert_called_once_with("message-1")
+
+
+def test_process_batch_leaves_pending_encounters_to_their_sync():
+    subscriber = FakeSubscriber(
+        [_received_message("1", "Encounter", TEST_ENCOUNTER_ID)]
+    )
+    controller = _controller()
+    controller.debounce_service.claim.return_value = False
+
+    FhirNotificationWorker(subscriber, controller).process_batch()
+
+    controller.sync_encounter.assert_not_called()
+    controller.debounce_service.wait_and_release.assert_not_called()
+    assert subscriber.acked == ["1"]
+
+
+def test_process_batch_waits_for_the_debounce_window():
+    subscriber = FakeSubscriber(
+        [_received_message("1", "Encounter", TEST_ENCOUNTER_ID)]
+    )
+    controller = _controller()
+    controller.debounce_service.claim.return_value = True
+
+    FhirNotificationWorker(subscriber, controller).process_batch()
+
+    controller.debounce_service.wait_and_release.assert_called_once_with(
+        TEST_ENCOUNTER_ID
+    )
+    controller.sync_encounter.assert_called_once_with(TEST_ENCOUNTER_ID)
+    assert subscriber.acked == ["1"]
+
+
+def test_process_batch_extends_the_ack_deadline_until_acked():
+    subscriber = FakeSubscriber(
+        [
+            _received_message("1", "Encounter", TEST_ENCOUNTER_ID),
+            _received_message("2", "Patient", "orphan"),
+        ]
+    )
+    controller = _controller()
+
+    def slow_sync(encounter_id):
+        deadline = time.monotonic() + 5
+        while len(subscriber.extended) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    controller.sync_encounter.side_effect = slow_sync
+    worker = FhirNotificationWorker(subscriber, controller, ack_extension_interval=0.01)
+
+    worker.process_batch()
+    extensions = len(subscriber.extended)
+
+    assert extensions >= 3
+    assert set(subscriber.extended) == {(("1", "2"), ACK_DEADLINE_EXTENSION_SECONDS)}
+    assert sorted(subscriber.acked) == ["1", "2"]
+    time.sleep(0.05)
+    assert len(subscriber.extended) == extensions
@@ -0,0 +1,338 @@
+import json
+import threading
+from unittest.mock import Mock
+
+import pytest
+import requests
+from fhir.resources import construct_fhir_element
+
+from services.lists_service import (
+    ListsService,
+    PatientQueue,
+    QueueSnapshotCache,
+    get_queue_list_ids,
+    queue_snapshots,
+)
+
+LIST_ID = "test-list-id"
+LIST_DATA = {
+    "resourceType": "List",
+    "id": LIST_ID,
+    "status": "current",
+    "mode": "working",
+    "title": "Patient Queue",
+}
+
+
+def _conflict():
+    response = requests.Response()
+    response.status_code = 412
+    return requests.HTTPError(response=response)
+
+
+@pytest.fixture(autouse=True)
+def clear_queue_snapshots():
+    yield
+    queue_snapshots.clear()
+
+
+class FakeListStore:
+    """In-memory FHIR List that enforces If-Match like the FHIR store"""
+
+    def __init__(self, data=LIST_DATA):
+        self.data = json.dumps(data)
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def client(self):
+        return FakeListClient(self)
+
+
+class FakeListClient:
+    def __init__(self, store: FakeListStore):
+        self.store = store
+        self.last_seen_etag = None
+
+    def get_resource(self, list_id, resource_type):
+        with self.store.lock:
+            self.last_seen_etag = f'W/"{self.store.version}"'
+            return construct_fhir_element(resource_type, json.loads(self.store.data))
+
+    def put_resource(self, list_id, fhir_list, lock_header):
+        with self.store.lock:
+            if lock_header != f'W/"{self.store.version}"':
+                raise _conflict()
+            self.store.version += 1
+            self.store.data = fhir_list.json()
+            return construct_fhir_element("List", json.loads(self.store.data))
+
+    def get_put_bundle(self, resource, uid, if_match=None):
+        return {
+            "resource": resource,
+            "request": {"method": "PUT", "url": f"List/{uid}", "ifMatch": if_match},
+        }
+
+    def create_resources(self, bundles, lock_header=""):
+        list_bundle = bundles[0]
+        self.put_resource(
+            LIST_ID, list_bundle["resource"], list_bundle["request"]["ifMatch"]
+        )
+        return bundles
+
+
+class MultiListClient(FakeListClient):
+    """FakeListClient over several lists, picked by id"""
+
+    def __init__(self, stores):
+        super().__init__(None)
+        self.stores = stores
+
+    def get_resource(self, list_id, resource_type):
+        self.store = self.stores[list_id]
+        return super().get_resource(list_id, resource_type)
+
+    def put_resource(self, list_id, fhir_list, lock_header):
+        self.store = self.stores[list_id]
+        return super().put_resource(list_id, fhir_list, lock_header)
+
+
+def test_patient_queue_indexes_positions():
+    fhir_list = construct_fhir_element(
+        "List",
+        {
+            **LIST_DATA,
+            "entry": [
+                {"item": {"reference": "Patient/1"}},
+                {"item": {"reference": "Patient/2"}},
+            ],
+        },
+    )
+
+    queue = PatientQueue(fhir_list)
+
+    assert len(queue) == 2
+    assert queue.head() == "1"
+    assert queue.position("2") == 1
+    assert queue.position("3") == -1
+    assert "1" in queue
+
+
+def test_enqueue_retries_on_version_conflict():
+    client = FakeListStore().client()
+    put_resource = client.put_resource
+
+    def put_after_two_conflicts(*args):
+        if client.put_resource.call_count <= 2:
+            raise _conflict()
+        return put_resource(*args)
+
+    client.put_resource = Mock(side_effect=put_after_two_conflicts)
+
+    err, fhir_list = ListsService(client, backoff=0).enqueue(LIST_ID, "1")
+
+    assert err is None
+    assert client.put_resource.call_count == 3
+    assert fhir_list.entry[0].item.reference == "Patient/1"
+
+
+def test_enqueue_raises_when_retries_are_exhausted():
+    client = FakeListStore().client()
+    client.put_resource = Mock(side_effect=_conflict())
+
+    with pytest.raises(requests.HTTPError):
+        ListsService(client, max_retries=2, backoff=0).enqueue(LIST_ID, "1")
+    assert client.put_resource.call_count == 3
+
+
+def test_enqueue_does_not_retry_other_errors():
+    client = FakeListStore().client()
+    response = requests.Response()
+    response.status_code = 500
+    client.put_resource = Mock(side_effect=requests.HTTPError(response=response))
+
+    with pytest.raises(requests.HTTPError):
+        ListsService(client, backoff=0).enqueue(LIST_ID, "1")
+    assert client.put_resource.call_count == 1
+
+
+def test_remove_and_dequeue():
+    store = FakeListStore()
+    service = ListsService(store.client(), backoff=0)
+    for patient_id in ["1", "2", "3"]:
+        service.enqueue(LIST_ID, patient_id)
+
+    err, fhir_list = service.remove(LIST_ID, "2")
+    assert err is None
+    assert [e.item.reference for e in fhir_list.entry] == ["Patient/1", "Patient/3"]
+
+    err, _ = service.remove(LIST_ID, "2")
+    assert err.args[0] == "Patient not in the list"
+
+    first_patient, bundle = service.dequeue(LIST_ID)
+    assert first_patient == "1"
+    assert bundle["request"]["method"] == "PUT"
+    assert [e.item.reference for e in bundle["resource"].entry] == ["Patient/3"]
+
+
+def test_remove_matches_entries_like_the_queue_index():
+    store = FakeListStore(
+        {
+            **LIST_DATA,
+            "entry": [
+                {"item": {"reference": "Patient/1/_history/2"}},
+                {"item": {"reference": "Patient/2"}},
+            ],
+        }
+    )
+    service = ListsService(store.client(), backoff=0)
+
+    err, fhir_list = service.remove(LIST_ID, "1")
+
+    assert err is None
+    assert [e.item.reference for e in fhir_list.entry] == ["Patient/2"]
+
+
+def test_concurrent_joiners_are_all_enqueued():
+    store = FakeListStore()
+    patient_ids = [str(i) for i in range(50)]
+    errors = []
+
+    def join(patient_id):
+        try:
+            err, _ = ListsService(store.client(), backoff=0.001).enqueue(
+                LIST_ID, patient_id
+            )
+            if err is not None:
+                errors.append(err)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=join, args=(p,)) for p in patient_ids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    queue = PatientQueue(construct_fhir_element("List", json.loads(store.data)))
+    assert errors == []
+    assert sorted(queue.patient_ids, key=int) == patient_ids
+
+
+def test_snapshot_is_refreshed_on_mutation_and_expiry():
+    now = [0.0]
+    snapshots = QueueSnapshotCache(ttl=5, clock=lambda: now[0])
+    store = FakeListStore()
+    client = store.client()
+    get_resource = Mock(side_effect=client.get_resource)
+    client.get_resource = get_resource
+    service = ListsService(client, backoff=0, snapshots=snapshots)
+
+    assert len(service.get_snapshot(LIST_ID)) == 0
+    service.enqueue(LIST_ID, "1")
+    assert service.get_snapshot(LIST_ID).position("1") == 0
+    assert get_resource.call_count == 2
+
+    # mutation by another instance is seen once the snapshot expires
+    ListsService(store.client(), backoff=0, snapshots=QueueSnapshotCache()).enqueue(
+        LIST_ID, "2"
+    )
+    assert service.get_snapshot(LIST_ID).position("2") == -1
+    now[0] = 6
+    assert service.get_snapshot(LIST_ID).position("2") == 1
+    assert get_resource.call_count == 3
+
+
+def test_snapshot_load_locks_are_dropped():
+    snapshots = QueueSnapshotCache()
+    store = FakeListStore()
+
+    snapshots.get_or_load(
+        LIST_ID, lambda: PatientQueue(store.client().get_resource(LIST_ID, "List"))
+    )
+    with pytest.raises(requests.HTTPError):
+        snapshots.get_or_load("unknown", Mock(side_effect=requests.HTTPError()))
+
+    assert snapshots._loading == {}
+    assert len(snapshots.get(LIST_ID)) == 0
+
+
+def test_dequeue_into_transaction_retries_on_version_conflict():
+    store = FakeListStore()
+    service = ListsService(store.client(), backoff=0)
+    for patient_id in ["1", "2"]:
+        service.enqueue(LIST_ID, patient_id)
+
+    built_for = []
+
+    def build(patient_id):
+        built_for.append(patient_id)
+        if len(built_for) == 1:
+            # the patient leaves the queue in the meantime
+            ListsService(store.client()).remove(LIST_ID, patient_id)
+        return None, [{"resource": patient_id}]
+
+    err, patient_id, resp = service.dequeue_into_transaction(LIST_ID, build)
+
+    assert err is None
+    assert built_for == ["1", "2"]
+    assert patient_id == "2"
+    assert resp[1] == {"resource": "2"}
+    assert len(service.get_snapshot(LIST_ID)) == 0
+
+
+def test_dequeue_into_transaction_on_empty_list():
+    service = ListsService(FakeListStore().client(), backoff=0)
+    build = Mock()
+
+    err, patient_id, resp = service.dequeue_into_transaction(LIST_ID, build)
+
+    assert err.args[0] == "No Patient in list"
+    build.assert_not_called()
+
+
+def test_get_queue_list_ids(monkeypatch):
+    monkeypatch.delenv("LIST_IDS", raising=False)
+    monkeypatch.setenv("LIST_ID", "a")
+    assert get_queue_list_ids() == ["a"]
+
+    monkeypatch.setenv("LIST_IDS", "a, b,")
+    assert get_queue_list_ids() == ["a", "b"]
+
+
+def test_enqueue_least_loaded_routes_to_shortest_list():
+    stores = {"a": FakeListStore({**LIST_DATA, "id": "a"}), "b": FakeListStore()}
+    stores["b"].data = json.dumps(
+        {**LIST_DATA, "id": "b", "entry": [{"item": {"reference": "Patient/1"}}]}
+    )
+
+    service = ListsService(
+        MultiListClient(stores), backoff=0, snapshots=QueueSnapshotCache()
+    )
+
+    err, fhir_list = service.enqueue_least_loaded(["b", "a"], "2")
+    assert err is None
+    assert fhir_list.id == "a"
+
+    err, _ = service.enqueue_least_loaded(["b", "a"], "1")
+    assert err.args[0] == "Patient already in the list"
+    assert service.longest(["a", "b"]) == "a"
+
+
+def test_enqueue_least_loaded_checks_the_other_lists_again():
+    stores = {
+        "a": FakeListStore({**LIST_DATA, "id": "a"}),
+        "b": FakeListStore({**LIST_DATA, "id": "b"}),
+    }
+    service = ListsService(
+        MultiListClient(stores), backoff=0, snapshots=QueueSnapshotCache()
+    )
+    assert service.find_patient(["a", "b"], "1") is None
+
+    # the first tap lands in b after the snapshots were read
+    ListsService(MultiListClient(stores), snapshots=QueueSnapshotCache()).enqueue(
+        "b", "1"
+    )
+    err, _ = service.enqueue_least_loaded(["a", "b"], "1")
+
+    assert err.args[0] == "Patient already in the list"
+    assert stores["a"].version == 0
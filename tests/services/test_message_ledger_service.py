@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock
+
+import pytest
+
+from services.message_ledger_service import (
+    DONE,
+    MESSAGE_CLAIMED,
+    MESSAGE_DUPLICATE,
+    MESSAGE_IN_PROGRESS,
+    PROCESSING,
+    MessageLedger,
+)
+
+
+@pytest.fixture
+def firestore_client(mocker):
+    mocker.patch(
+        "services.message_ledger_service.firestore.transactional",
+        lambda func: func,
+    )
+    firestore_client = Mock()
+    ref = firestore_client.get_collection.return_value.document.return_value
+    ref.get.return_value = Mock(exists=False)
+    yield firestore_client
+
+
+def _existing(firestore_client, status, claimed_ago):
+    ref = firestore_client.get_collection.return_value.document.return_value
+    snapshot = Mock(exists=True)
+    values = {
+        "status": status,
+        "claimed_at": datetime.now(timezone.utc) - claimed_ago,
+    }
+    snapshot.get.side_effect = values.get
+    ref.get.return_value = snapshot
+
+
+def test_claim_new_message(firestore_client):
+    ledger = MessageLedger(firestore_client)
+
+    assert ledger.claim("message-id") == MESSAGE_CLAIMED
+    transaction = firestore_client.client.transaction.return_value
+    assert transaction.set.call_args.args[1]["status"] == PROCESSING
+
+
+def test_completed_message_is_a_duplicate_without_firestore(firestore_client):
+    ledger = MessageLedger(firestore_client)
+    ledger.claim("message-id")
+    ledger.complete("message-id")
+    firestore_client.client.transaction.reset_mock()
+
+    assert ledger.claim("message-id") == MESSAGE_DUPLICATE
+    assert not firestore_client.client.transaction.called
+    assert ledger.stats() == {"messages": 2, "duplicates": 1, "duplicate_rate": 0.5}
+
+
+@pytest.mark.parametrize(
+    "status, claimed_ago, expected",
+    [
+        (DONE, timedelta(minutes=1), MESSAGE_DUPLICATE),
+        (PROCESSING, timedelta(minutes=1), MESSAGE_IN_PROGRESS),
+        (PROCESSING, timedelta(hours=1), MESSAGE_CLAIMED),
+        (DONE, timedelta(days=8), MESSAGE_CLAIMED),
+    ],
+)
+def test_claim_existing_message(firestore_client, status, claimed_ago, expected):
+    _existing(firestore_client, status, claimed_ago)
+    ledger = MessageLedger(firestore_client)
+
+    assert ledger.claim("message-id") == expected
+
+
+def test_release_deletes_the_claim(firestore_client):
+    ledger = MessageLedger(firestore_client)
+    ledger.claim("message-id")
+
+    ledger.release("message-id")
+
+    ref = firestore_client.get_collection.return_value.document.return_value
+    ref.delete.assert_called_once()
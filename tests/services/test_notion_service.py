@@ -8,9 +8,18 @@ from fhir.resources.medicationrequest import MedicationRequest
 from fhir.resources.patient import Patient
 from fhir.resources.practitionerrole import PractitionerRole
 from fhir.resources.servicerequest import ServiceRequest
+from notion_client import APIErrorCode, APIResponseError
 from pydantic import AnyUrl
 
-from services.notion_service import NotionService
+from services.notion_page_mapping_service import (
+    NOTION_ENCOUNTER_PAGES,
+    EncounterPageMapping,
+)
+from services.notion_service import (
+    NotionService,
+    SyncedPropertyHashes,
+    synced_property_hashes,
+)
 
 ACCOUNT_DATA = {
     "guarantor": [
@@ -474,6 +483,81 @@ def test_create_encounter_page_happy_path(notion_client):
     )
 
 
+def test_get_encounter_page_id_when_not_mapped_then_query_and_remember(
+    notion_client, page_mapping
+):
+    notion_client.databases.query.return_value = {"results": []}
+    notion_client.pages.create.return_value = {"id": TEST_ENCOUNTER_PAGE_ID}
+    notion_service = NotionService(
+        notion_client, TEST_ENCOUNTER_DATABASE_ID, page_mapping
+    )
+
+    assert notion_service.get_encounter_page_id(TEST_ENCOUNTER_ID) == (
+        TEST_ENCOUNTER_PAGE_ID
+    )
+    assert notion_service.get_encounter_page_id(TEST_ENCOUNTER_ID) == (
+        TEST_ENCOUNTER_PAGE_ID
+    )
+
+    notion_client.databases.query.assert_called_once()
+    notion_client.pages.create.assert_called_once()
+    page_mapping.firestore_client.add_value.assert_called_once_with(
+        NOTION_ENCOUNTER_PAGES,
+        {
+            "database_id": TEST_ENCOUNTER_DATABASE_ID,
+            "encounter_id": TEST_ENCOUNTER_ID,
+            "page_id": TEST_ENCOUNTER_PAGE_ID,
+        },
+        f"{TEST_ENCOUNTER_DATABASE_ID}_{TEST_ENCOUNTER_ID}",
+    )
+
+
+def test_get_encounter_page_id_when_mapped_in_firestore(notion_client, page_mapping):
+    document = page_mapping.firestore_client.get_collection.return_value.document
+    document.return_value.get.return_value = Mock(exists=True)
+    document.return_value.get.return_value.to_dict.return_value = {
+        "database_id": TEST_ENCOUNTER_DATABASE_ID,
+        "page_id": TEST_ENCOUNTER_PAGE_ID,
+    }
+    notion_service = NotionService(
+        notion_client, TEST_ENCOUNTER_DATABASE_ID, page_mapping
+    )
+
+    assert notion_service.get_encounter_page_id(TEST_ENCOUNTER_ID) == (
+        TEST_ENCOUNTER_PAGE_ID
+    )
+    assert notion_service.get_encounter_page_id(TEST_ENCOUNTER_ID) == (
+        TEST_ENCOUNTER_PAGE_ID
+    )
+
+    assert not notion_client.databases.query.called
+    document.assert_called_once_with(
+        f"{TEST_ENCOUNTER_DATABASE_ID}_{TEST_ENCOUNTER_ID}"
+    )
+
+
+def test_sync_encounter_when_mapped_page_was_deleted(notion_client, page_mapping):
+    page_mapping._remember(
+        (TEST_ENCOUNTER_DATABASE_ID, TEST_ENCOUNTER_ID), "deleted-page-id"
+    )
+    notion_client.databases.query.return_value = {"results": []}
+    notion_client.pages.create.return_value = {"id": TEST_ENCOUNTER_PAGE_ID}
+    notion_client.pages.update.side_effect = [
+        APIResponseError(
+            Mock(status_code=404), "Could not find page", APIErrorCode.ObjectNotFound
+        ),
+        {},
+    ]
+    notion_service = NotionService(
+        notion_client, TEST_ENCOUNTER_DATABASE_ID, page_mapping
+    )
+
+    page_id = notion_service.sync_encounter(TEST_ENCOUNTER_ID)
+
+    assert page_id == TEST_ENCOUNTER_PAGE_ID
+    assert notion_client.pages.update.call_args.kwargs["page_id"] == page_id
+
+
 def test_sync_encounter_to_notion_when_gender_and_dob_is_missing(notion_client):
     notion_service = NotionService(notion_client, TEST_ENCOUNTER_DATABASE_ID)
     TEST_PATIENT_WITHOUT_DOB_AND_GENDER = Patient(**PATIENT_DATA_WITHOUT_DOB_AND_GENDER)
@@ -654,8 +738,122 @@ def test_sync_encounter_to_notion_happy_path(notion_client):
     )
 
 
+def test_sync_encounter_to_notion_sends_only_changed_properties(notion_client):
+    notion_service = NotionService(notion_client, TEST_ENCOUNTER_DATABASE_ID)
+    resources = {
+        "account": TEST_ACCOUNT,
+        "appointment": TEST_APPOINTMENT,
+        "patient": TEST_PATIENT,
+        "clinical_note": TEST_CLINICAL_NOTE,
+    }
+    notion_service.sync_encounter_to_notion(TEST_ENCOUNTER_PAGE_ID, **resources)
+    notion_client.pages.update.reset_mock()
+
+    assert (
+        notion_service.sync_encounter_to_notion(TEST_ENCOUNTER_PAGE_ID, **resources)
+        is None
+    )
+    assert not notion_client.pages.update.called
+
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID,
+        **resources,
+        medication_request=TEST_MEDICATION_REQUEST,
+    )
+    notion_client.pages.update.assert_called_once_with(
+        page_id=TEST_ENCOUNTER_PAGE_ID,
+        properties={
+            "prescription": {
+                "rich_text": [{"text": {"content": "ロキソニン&セルベックス\nトランサミン"}}]
+            },
+        },
+    )
+
+
+def test_sync_encounter_to_notion_does_not_decode_unchanged_note(notion_client, mocker):
+    notion_service = NotionService(notion_client, TEST_ENCOUNTER_DATABASE_ID)
+    render_emr = mocker.spy(notion_service, "_render_emr")
+
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, clinical_note=TEST_CLINICAL_NOTE
+    )
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, clinical_note=TEST_CLINICAL_NOTE, patient=TEST_PATIENT
+    )
+
+    assert render_emr.call_count == 1
+    assert "emr" not in notion_client.pages.update.call_args.kwargs["properties"]
+
+
+def test_sync_encounter_to_notion_sends_every_property_after_ttl(notion_client):
+    clock = Mock(return_value=1000.0)
+    notion_service = NotionService(
+        notion_client,
+        TEST_ENCOUNTER_DATABASE_ID,
+        synced_hashes=SyncedPropertyHashes(ttl=60, clock=clock),
+    )
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, patient=TEST_PATIENT
+    )
+    properties = notion_client.pages.update.call_args.kwargs["properties"]
+
+    clock.return_value = 1059.0
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, patient=TEST_PATIENT
+    )
+    assert notion_client.pages.update.call_count == 1
+
+    clock.return_value = 1060.0
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, patient=TEST_PATIENT
+    )
+    assert notion_client.pages.update.call_count == 2
+    assert notion_client.pages.update.call_args.kwargs["properties"] == properties
+
+
+def test_sync_encounter_to_notion_sends_every_property_after_failure(notion_client):
+    notion_service = NotionService(notion_client, TEST_ENCOUNTER_DATABASE_ID)
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, patient=TEST_PATIENT
+    )
+    properties = notion_client.pages.update.call_args.kwargs["properties"]
+
+    notion_client.pages.update.side_effect = Exception("bad gateway")
+    with pytest.raises(Exception):
+        notion_service.sync_encounter_to_notion(
+            TEST_ENCOUNTER_PAGE_ID, patient=TEST_PATIENT, account=TEST_ACCOUNT
+        )
+    notion_client.pages.update.side_effect = None
+    notion_service.sync_encounter_to_notion(
+        TEST_ENCOUNTER_PAGE_ID, patient=TEST_PATIENT
+    )
+
+    assert notion_client.pages.update.call_args.kwargs["properties"] == properties
+
+
+def test_services_built_per_request_share_the_writer(notion_client, page_mapping):
+    first = NotionService(notion_client, TEST_ENCOUNTER_DATABASE_ID, page_mapping)
+    second = NotionService(notion_client, TEST_ENCOUNTER_DATABASE_ID, page_mapping)
+
+    assert first._writer is second._writer
+
+
 @pytest.fixture
 def notion_client(mocker):
     mocker.databases = Mock()
     mocker.pages = Mock()
     yield mocker
+
+
+@pytest.fixture
+def page_mapping():
+    firestore_client = Mock()
+    document = firestore_client.get_collection.return_value.document
+    document.return_value.get.return_value = Mock(exists=False)
+    yield EncounterPageMapping(firestore_client)
+
+
+@pytest.fixture(autouse=True)
+def clear_synced_property_hashes():
+    yield
+    synced_property_hashes.clear()
@@ -1,22 +1,79 @@
 from unittest.mock import Mock
 from uuid import uuid4
 
-from services.patient_call_logs_service import PatientCallLogsService
+from google.api_core.exceptions import NotFound
 
+from services.patient_call_logs_service import (
+    CALLING_STATUS,
+    CREATED_STATUS,
+    PatientCallLogsService,
+)
 
-def test_upsert_call_docs():
-    call_log_collection_mock = Mock()
-    call_log_collection_mock.where = Mock(return_value=call_log_collection_mock)
-    call_log_collection_mock.stream = Mock(return_value=[])
 
+def test_upsert_call_docs():
     firestore_client_mock = Mock()
-    firestore_client_mock.get_collection = Mock(return_value=call_log_collection_mock)
+    appointment_id = str(uuid4())
+    patient_id = str(uuid4())
 
     controller = PatientCallLogsService(firestore_client_mock)
 
     result = controller.upsert_call_docs(
-        patient_id=str(uuid4()),
-        appointment_id=str(uuid4()),
+        patient_id=patient_id,
+        appointment_id=appointment_id,
     )
 
     assert result == (None, "Successfully saved call logs.")
+    firestore_client_mock.get_collection.return_value.document.assert_called_once_with(
+        appointment_id
+    )
+    batch = firestore_client_mock.client.batch.return_value
+    ref, value = batch.set.call_args.args
+    assert value["status"] == CREATED_STATUS
+    assert value["patient_id"] == patient_id
+    assert "timestamp" in value
+    assert batch.set.call_args.kwargs == {"merge": True}
+    assert not firestore_client_mock.get_collection.return_value.where.called
+
+
+def test_upsert_call_docs_when_calling_keeps_timestamp():
+    firestore_client_mock = Mock()
+
+    controller = PatientCallLogsService(firestore_client_mock)
+
+    result = controller.upsert_call_docs(str(uuid4()), str(uuid4()), CALLING_STATUS)
+
+    assert result == (None, "Successfully saved call logs.")
+    batch = firestore_client_mock.client.batch.return_value
+    _, value = batch.update.call_args.args
+    assert value["status"] == CALLING_STATUS
+    assert "timestamp" not in value
+    assert not batch.set.called
+
+
+def test_upsert_call_docs_when_calling_without_log_creates_it():
+    firestore_client_mock = Mock()
+    batch = firestore_client_mock.client.batch.return_value
+    batch.commit.side_effect = [NotFound("No document to update"), None]
+
+    controller = PatientCallLogsService(firestore_client_mock)
+
+    result = controller.upsert_call_docs(str(uuid4()), str(uuid4()), CALLING_STATUS)
+
+    assert result == (None, "Successfully saved call logs.")
+    _, value = batch.set.call_args.args
+    assert value["status"] == CALLING_STATUS
+    assert "timestamp" in value
+    assert batch.set.call_args.kwargs == {"merge": True}
+
+
+def test_upsert_call_docs_when_write_fails():
+    firestore_client_mock = Mock()
+    firestore_client_mock.client.batch.return_value.commit.side_effect = Exception(
+        "unavailable"
+    )
+
+    controller = PatientCallLogsService(firestore_client_mock)
+
+    err, _ = controller.upsert_call_docs(str(uuid4()), str(uuid4()))
+
+    assert err == "Error while saving call logs: unavailable"
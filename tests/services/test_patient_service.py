@@ -240,21 +240,20 @@ def test_get_patient_multiple_emails():
     assert new_email == actual_email
 
 
-def test_get_patient_payment_details():
+def test_get_payment_details():
     # Given
     payment_id = "payment id"
     customer_id = "customer id"
-    mock = Mock(ResourceClient)
-    mock.get_resource = MockPatientClient(
+    patient = MockPatientClient(
         customer_id=customer_id, payment_id=payment_id
-    ).get_resource
-    patient_service = PatientService(mock)
+    ).get_resource(uuid.uuid1(), "Patient")
+    patient_service = PatientService(Mock(ResourceClient))
 
     # When
     err, (
         expected_cusotmer_id,
         expected_payment_id,
-    ) = patient_service.get_patient_payment_details(uuid.uuid1())
+    ) = patient_service.get_payment_details(patient)
 
     # Then
     assert expected_cusotmer_id == customer_id
@@ -264,12 +263,11 @@ def test_get_patient_payment_details():
 
 def test_get_patient_payment_error():
     # Given
-    mock = Mock(ResourceClient)
-    mock.get_resource = MockPatientClient().get_resource
-    patient_service = PatientService(mock)
+    patient = MockPatientClient().get_resource(uuid.uuid1(), "Patient")
+    patient_service = PatientService(Mock(ResourceClient))
 
     # When
-    err, outputs = patient_service.get_patient_payment_details(uuid.uuid1())
+    err, outputs = patient_service.get_payment_details(patient)
 
     # Then
     assert outputs is None
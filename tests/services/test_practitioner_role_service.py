@@ -7,9 +7,12 @@ from fhir.resources import construct_fhir_element
 from fhir.resources.domainresource import DomainResource
 
 from adapters.fhir_store import ResourceClient
-from services.practitioner_role_service import PractitionerRoleService
+from services.practitioner_role_service import (
+    PractitionerRoleDirectory,
+    PractitionerRoleService,
+)
 from services.practitioner_service import Biography, HumanName
-from utils.system_code import ServiceURL
+from utils.system_code import ServiceURL, SystemCode
 
 practitioner = {
     "active": True,
@@ -362,3 +365,49 @@ def test_update_visit_type_of_practitioner_role_returns_error_when_not_doctor():
 
     err, _ = service.update_practitioner_role(role, visit_type="walk-in")
     assert err.args[0] == "Can only update visit type for doctor"
+
+
+def test_get_role_by_practitioner_is_served_from_directory(mocker):
+    # Given
+    role = construct_fhir_element("PractitionerRole", json.dumps(practitioner_role))
+    resource_client = mocker.Mock()
+    resource_client.search.return_value = mocker.Mock(
+        entry=[mocker.Mock(resource=role)]
+    )
+    role_service = PractitionerRoleService(resource_client, PractitionerRoleDirectory())
+
+    # When
+    first = role_service.get_role_by_practitioner("1")
+    second = role_service.get_role_by_practitioner("1")
+
+    # Then
+    assert first.id == second.id == "1"
+    resource_client.search.assert_called_once_with(
+        "PractitionerRole", [("practitioner", "1")]
+    )
+
+
+def test_is_available_for_walk_in():
+    # Given
+    role_data = copy.deepcopy(practitioner_role)
+    role_data["code"].append({"coding": [SystemCode.visit_type_code("walk-in")]})
+    role = construct_fhir_element("PractitionerRole", json.dumps(role_data))
+    inactive_role = copy.deepcopy(role)
+    inactive_role.active = False
+    appointment_role = construct_fhir_element(
+        "PractitionerRole", json.dumps(practitioner_role)
+    )
+
+    # When and Then
+    assert PractitionerRoleService.is_available_for_walk_in(
+        role, datetime(2023, 1, 2, 9, 0), datetime(2023, 1, 2, 9, 10)
+    )
+    assert not PractitionerRoleService.is_available_for_walk_in(
+        role, datetime(2023, 1, 2, 19, 55), datetime(2023, 1, 2, 20, 5)
+    )
+    assert not PractitionerRoleService.is_available_for_walk_in(
+        inactive_role, datetime(2023, 1, 2, 9, 0), datetime(2023, 1, 2, 9, 10)
+    )
+    assert not PractitionerRoleService.is_available_for_walk_in(
+        appointment_role, datetime(2023, 1, 2, 9, 0), datetime(2023, 1, 2, 9, 10)
+    )
@@ -0,0 +1,73 @@
+from unittest.mock import Mock
+
+import pytest
+
+from services.stripe_cache_service import PAYMENT_METHODS, StripeReadCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_loads_once_until_ttl():
+    clock = FakeClock()
+    cache = StripeReadCache(ttl=30, clock=clock)
+    load = Mock(side_effect=["first", "second"])
+
+    assert cache.get("customer", "cus_1", load) == "first"
+    clock.now = 29
+    assert cache.get("customer", "cus_1", load) == "first"
+    clock.now = 30
+    assert cache.get("customer", "cus_1", load) == "second"
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+
+def test_get_does_not_cache_failed_loads():
+    cache = StripeReadCache()
+    load = Mock(side_effect=[Exception("stripe is down"), "loaded"])
+
+    with pytest.raises(Exception):
+        cache.get("customer", "cus_1", load)
+    assert cache.get("customer", "cus_1", load) == "loaded"
+
+
+def test_get_evicts_least_recently_used():
+    cache = StripeReadCache(max_size=2)
+    cache.get("customer", "a", lambda: "a")
+    cache.get("customer", "b", lambda: "b")
+    cache.get("customer", "a", lambda: "reloaded")
+    cache.get("customer", "c", lambda: "c")
+
+    assert cache.get("customer", "a", lambda: "reloaded") == "a"
+    assert cache.get("customer", "b", lambda: "reloaded") == "reloaded"
+
+
+def test_invalidate_where_drops_matching_entries():
+    cache = StripeReadCache()
+    cache.get(PAYMENT_METHODS, "cus_1", lambda: {"data": [{"id": "pm_1"}]})
+    cache.get(PAYMENT_METHODS, "cus_2", lambda: {"data": [{"id": "pm_2"}]})
+
+    cache.invalidate_where(
+        PAYMENT_METHODS, lambda methods: methods["data"][0]["id"] == "pm_1"
+    )
+
+    assert cache.get(PAYMENT_METHODS, "cus_1", lambda: "reloaded") == "reloaded"
+    assert cache.get(PAYMENT_METHODS, "cus_2", lambda: "reloaded") != "reloaded"
+
+
+def test_uncache_skips_caching_for_the_window():
+    clock = FakeClock()
+    cache = StripeReadCache(clock=clock)
+    cache.get(PAYMENT_METHODS, "cus_1", lambda: "before")
+
+    cache.uncache(PAYMENT_METHODS, "cus_1", 60)
+
+    assert cache.get(PAYMENT_METHODS, "cus_1", lambda: "during") == "during"
+    assert cache.get(PAYMENT_METHODS, "cus_1", lambda: "again") == "again"
+    clock.now = 60
+    assert cache.get(PAYMENT_METHODS, "cus_1", lambda: "after") == "after"
+    assert cache.get(PAYMENT_METHODS, "cus_1", lambda: "cached") == "after"
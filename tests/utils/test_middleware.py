@@ -0,0 +1,11 @@
+from unittest.mock import patch
+
+from utils.middleware import verify_id_token
+
+
+@patch("utils.middleware.firebase_auth")
+def test_verify_id_token_checks_revocation(firebase_auth):
+    firebase_auth.verify_id_token.return_value = {"uid": "u1"}
+
+    assert verify_id_token("token") == {"uid": "u1"}
+    firebase_auth.verify_id_token.assert_called_once_with("token", check_revoked=True)
@@ -0,0 +1,88 @@
+import json
+
+from utils.postal_index import (
+    PostalIndex,
+    build_postal_index,
+    get_postal_index,
+)
+
+
+def _write_source(tmp_path):
+    (tmp_path / "zip-100.json").write_text(
+        json.dumps(
+            {
+                "1000001": [13, "千代田区", "千代田"],
+                "1000002": [13, "千代田区", "皇居外苑"],
+            }
+        ),
+        encoding="utf-8",
+    )
+    (tmp_path / "zip-000.json").write_text("", encoding="utf-8")
+    (tmp_path / "zip-060.json").write_text(
+        json.dumps({"0600000": [1, "札幌市中央区", "", "１丁目"]}), encoding="utf-8"
+    )
+    return tmp_path
+
+
+def test_lookup_from_built_index(tmp_path):
+    index = PostalIndex.from_source(str(_write_source(tmp_path)))
+
+    assert len(index) == 3
+    assert index.lookup("1000001") == (13, "千代田区", "千代田", None)
+    assert index.lookup("0600000") == (1, "札幌市中央区", "", "１丁目")
+    assert index.lookup("1000003") is None
+    assert index.lookup("9999999") is None
+
+
+def test_load_maps_the_index_file(tmp_path):
+    path = tmp_path / "postal_index.bin"
+    path.write_bytes(build_postal_index(str(_write_source(tmp_path))))
+
+    index = PostalIndex.load(str(path))
+
+    assert index.lookup("1000002") == (13, "千代田区", "皇居外苑", None)
+
+
+def test_strings_are_interned(tmp_path):
+    index = build_postal_index(str(_write_source(tmp_path)))
+
+    assert index.count("千代田区".encode("utf-8")) == 1
+
+
+def test_codes_with_prefix(tmp_path):
+    index = PostalIndex.from_source(str(_write_source(tmp_path)))
+
+    assert [index.code_at(i) for i in index.codes_with_prefix("100")] == [
+        "1000001",
+        "1000002",
+    ]
+    assert [index.code_at(i) for i in index.codes_with_prefix("06")] == ["0600000"]
+    assert len(index.codes_with_prefix("2")) == 0
+
+
+def test_names_with_prefix(tmp_path):
+    index = PostalIndex.from_source(str(_write_source(tmp_path)))
+
+    matches = list(index.names_with_prefix("千代田"))
+    assert [(index.code_at(i), area_only) for i, area_only in matches] == [
+        ("1000001", True),
+        ("1000001", False),
+        ("1000002", False),
+    ]
+    assert [index.code_at(i) for i, _ in index.names_with_prefix("札幌")] == ["0600000"]
+    assert list(index.names_with_prefix("大阪")) == []
+
+
+def test_codes_in(tmp_path):
+    index = PostalIndex.from_source(str(_write_source(tmp_path)))
+
+    assert [index.code_at(i) for i in index.codes_in(13, "千代田区")] == [
+        "1000001",
+        "1000002",
+    ]
+    assert [index.code_at(i) for i in index.codes_in(13, "千代田区", "皇居外苑")] == ["1000002"]
+    assert index.codes_in(1, "千代田区") == []
+
+
+def test_get_postal_index():
+    assert get_postal_index().lookup("9768501") == (7, "相馬市", "沖ノ内", "１丁目２－１")
@@ -32,3 +32,13 @@ def test_call_stripe_after_singleton_creation(url_path):
 @pytest.fixture(autouse=True)
 def url_path():
     return f"{os.path.dirname(os.path.abspath(__file__))}/secrets"
+
+
+def test_shares_keep_alive_http_client(url_path):
+    import stripe
+
+    StripeSingleton(stripe, url_path)
+
+    session = stripe.default_http_client._session
+    assert session is not None
+    assert session.get_adapter("https://api.stripe.com")._pool_maxsize == 16
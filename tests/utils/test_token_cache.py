@@ -0,0 +1,79 @@
+from unittest.mock import Mock
+
+import pytest
+
+from utils.token_cache import VerifiedTokenCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_verify_once_until_exp():
+    clock = FakeClock()
+    cache = VerifiedTokenCache(ttl=300, clock=clock)
+    verify = Mock(return_value={"uid": "u1", "exp": 1100})
+
+    assert cache.verify("token", verify) == {"uid": "u1", "exp": 1100}
+    clock.now = 1099
+    cache.verify("token", verify)
+    assert verify.call_count == 1
+    clock.now = 1100
+    cache.verify("token", verify)
+    assert verify.call_count == 2
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2, "evictions": 0}
+
+
+def test_verify_once_until_ttl():
+    clock = FakeClock()
+    cache = VerifiedTokenCache(ttl=300, clock=clock)
+    verify = Mock(return_value={"uid": "u1", "exp": 5000})
+
+    cache.verify("token", verify)
+    clock.now = 1300
+    cache.verify("token", verify)
+
+    assert verify.call_count == 2
+
+
+def test_verify_does_not_cache_invalid_tokens():
+    cache = VerifiedTokenCache()
+    verify = Mock(side_effect=[Exception("expired"), {"uid": "u1"}])
+
+    with pytest.raises(Exception):
+        cache.verify("token", verify)
+    assert cache.verify("token", verify) == {"uid": "u1"}
+
+
+def test_verify_evicts_least_recently_used():
+    cache = VerifiedTokenCache(max_size=2)
+    verify = Mock(side_effect=lambda token: {"uid": token})
+    cache.verify("a", verify)
+    cache.verify("b", verify)
+    cache.verify("a", verify)
+    cache.verify("c", verify)
+
+    cache.verify("a", verify)
+    assert verify.call_count == 3
+    cache.verify("b", verify)
+    assert verify.call_count == 4
+    assert cache.stats()["evictions"] == 2
+
+
+def test_verify_returns_a_copy_of_the_claims():
+    cache = VerifiedTokenCache()
+    verify = Mock(return_value={"uid": "u1", "roles": {"Patient": {"id": "p1"}}})
+
+    cache.verify("token", verify)["roles"]["Patient"]["delegates"] = ["p2"]
+    claims = cache.verify("token", verify)
+    claims["roles"]["Staff"] = {"id": "s1"}
+
+    assert cache.verify("token", verify) == {
+        "uid": "u1",
+        "roles": {"Patient": {"id": "p1"}},
+    }
+    assert verify.call_count == 1